@@ -0,0 +1,162 @@
+import heapq
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Literal, Optional
+
+from sqlalchemy import select, Float, cast, desc
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from price_block import PriceBlock, CITY_INDEX, NULL, from_epoch_us, to_epoch_us
+
+SortBy = Literal["spread", "margin"]
+
+
+def _route(name, buy_price, buy_stamp, sell_price, sell_stamp) -> Dict[str, Any]:
+    spread = sell_price - buy_price
+    return {
+        "unique_name": name,
+        "buy_price": buy_price,
+        "buy_updated_at": buy_stamp,
+        "sell_price": sell_price,
+        "sell_updated_at": sell_stamp,
+        "spread": spread,
+        "margin": round(spread / buy_price, 4) if buy_price else None,
+    }
+
+
+def _cutoff(max_age_hours: Optional[float]) -> Optional[datetime]:
+    if max_age_hours is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+
+
+def top_routes_in_memory(
+    block: PriceBlock,
+    source: str,
+    destination: str,
+    limit: int,
+    sort_by: SortBy = "spread",
+    min_price: int = 0,
+    max_age_hours: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Top `limit` items by spread (or margin) buying in `source` and selling in `destination`."""
+    buy_prices, buy_stamps = block.prices[CITY_INDEX[source]], block.stamps[CITY_INDEX[source]]
+    sell_prices, sell_stamps = block.prices[CITY_INDEX[destination]], block.stamps[CITY_INDEX[destination]]
+
+    cutoff = _cutoff(max_age_hours)
+    min_stamp = to_epoch_us(cutoff) if cutoff is not None else None
+    # Prices are never negative, so NULL (int64 min) is also excluded by this bound
+    min_price = max(min_price, 0)
+
+    def candidates():
+        for row in range(len(block)):
+            buy, sell = buy_prices[row], sell_prices[row]
+            if buy < min_price or sell < min_price or sell <= buy:
+                continue
+            if min_stamp is not None and (buy_stamps[row] < min_stamp or sell_stamps[row] < min_stamp):
+                continue
+            if sort_by == "spread":
+                yield row, sell - buy
+            elif buy > 0:
+                yield row, (sell - buy) / buy
+
+    best = heapq.nlargest(limit, candidates(), key=lambda candidate: candidate[1])
+    return [
+        _route(
+            block.names[row],
+            buy_prices[row], _datetime(buy_stamps[row]),
+            sell_prices[row], _datetime(sell_stamps[row]),
+        )
+        for row, _ in best
+    ]
+
+
+def _datetime(stamp: int) -> Optional[datetime]:
+    return None if stamp == NULL else from_epoch_us(stamp)
+
+
+async def top_routes_sql(
+    db: AsyncSession,
+    model,
+    source: str,
+    destination: str,
+    limit: int,
+    sort_by: SortBy = "spread",
+    min_price: int = 0,
+    max_age_hours: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Same as top_routes_in_memory, computed by the database with ORDER BY ... LIMIT."""
+    buy_price = getattr(model, f"price_{source}")
+    buy_updated = getattr(model, f"{source}_updated_at")
+    sell_price = getattr(model, f"price_{destination}")
+    sell_updated = getattr(model, f"{destination}_updated_at")
+
+    spread = sell_price - buy_price
+    order = spread if sort_by == "spread" else cast(spread, Float) / buy_price
+
+    stmt = (
+        select(model.unique_name, buy_price, buy_updated, sell_price, sell_updated)
+        .where(
+            buy_price.is_not(None),
+            sell_price.is_not(None),
+            buy_price >= min_price,
+            sell_price >= min_price,
+            sell_price > buy_price,
+        )
+        .order_by(desc(order))
+        .limit(limit)
+    )
+    if sort_by == "margin":
+        stmt = stmt.where(buy_price > 0)
+
+    cutoff = _cutoff(max_age_hours)
+    if cutoff is not None:
+        stmt = stmt.where(buy_updated >= cutoff, sell_updated >= cutoff)
+
+    result = await db.execute(stmt)
+    return [_route(*row) for row in result.all()]
+
+
+async def top_routes_sql_long(
+    db: AsyncSession,
+    server: str,
+    type_: str,
+    source: str,
+    destination: str,
+    limit: int,
+    sort_by: SortBy = "spread",
+    min_price: int = 0,
+    max_age_hours: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """top_routes_sql for the long ItemPrice layout: a self-join of the two city rows."""
+    buy = aliased(models.ItemPrice)
+    sell = aliased(models.ItemPrice)
+
+    spread = sell.price - buy.price
+    order = spread if sort_by == "spread" else cast(spread, Float) / buy.price
+
+    stmt = (
+        select(buy.unique_name, buy.price, buy.updated_at, sell.price, sell.updated_at)
+        .join(sell, (sell.server == buy.server) & (sell.type == buy.type) & (sell.unique_name == buy.unique_name))
+        .where(
+            buy.server == server,
+            buy.type == type_,
+            buy.city == source,
+            sell.city == destination,
+            buy.price >= min_price,
+            sell.price >= min_price,
+            sell.price > buy.price,
+        )
+        .order_by(desc(order))
+        .limit(limit)
+    )
+    if sort_by == "margin":
+        stmt = stmt.where(buy.price > 0)
+
+    cutoff = _cutoff(max_age_hours)
+    if cutoff is not None:
+        stmt = stmt.where(buy.updated_at >= cutoff, sell.updated_at >= cutoff)
+
+    result = await db.execute(stmt)
+    return [_route(*row) for row in result.all()]
@@ -5,15 +5,19 @@ import httpx
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, WebSocket
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from starlette.responses import RedirectResponse
-from jose import jwt
+from jose import jwt, JWTError
 
 # Import your project's dependencies and models
 import models
 import dependencies
+from cache import TTLCache, MISSING
+from user_cache import user_cache
+from http_client import http_client
 
 router = APIRouter(tags=["Auth"])
 
@@ -22,6 +26,11 @@ SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_TO_A_SECURE_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Require an active subscription claim on the trade-bot read endpoints
+SUBSCRIPTION_GATE_ENABLED = os.getenv("SUBSCRIPTION_GATE_ENABLED", "0") == "1"
+# Decoded tokens kept in memory, so the gate verifies each token's signature once
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "4096"))
+
 # Discord Config
 DISCORD_CLIENT_ID = os.getenv("DISCORD_CLIENT_ID")
 DISCORD_CLIENT_SECRET = os.getenv("DISCORD_CLIENT_SECRET")
@@ -34,17 +43,82 @@ GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
 
 # --- UTILS ---
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, subscribed_until: Optional[datetime] = None):
+    """
+    Signed JWT. `sub_until` carries the subscription expiry (epoch seconds, null
+    without a subscription), so the trade endpoints can check it without a DB query.
+    """
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    if subscribed_until is not None and subscribed_until.tzinfo is None:
+        subscribed_until = subscribed_until.replace(tzinfo=timezone.utc)
+    to_encode.update({
+        "exp": expire,
+        "sub_until": int(subscribed_until.timestamp()) if subscribed_until else None,
+    })
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Claims of tokens that passed signature verification, LRU by token
+_token_cache = TTLCache(TOKEN_CACHE_MAX_ENTRIES, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def decode_token(token: str) -> dict:
+    """Verified claims of `token`; raises JWTError if it is invalid or expired."""
+    claims = _token_cache.get(token)
+    if claims is MISSING:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
+        _token_cache.set(token, claims)
+
+    # A cached token still expires, so exp is checked on every call
+    expired_at = datetime.fromtimestamp(claims.get("exp", 0), timezone.utc)
+    if datetime.now(timezone.utc) >= expired_at:
+        raise JWTError("Token expired")
+    return claims
+
+def token_cache_stats() -> dict:
+    return _token_cache.stats()
+
+_bearer = HTTPBearer(auto_error=False)
+
+def bearer_claims(credentials: Optional[HTTPAuthorizationCredentials]) -> dict:
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"}
+        )
+    try:
+        return decode_token(credentials.credentials)
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"}
+        )
+
+def check_subscription(credentials: Optional[HTTPAuthorizationCredentials]) -> dict:
+    """Claims of a valid token whose sub_until claim is in the future; raises 401/403 otherwise."""
+    claims = bearer_claims(credentials)
+    sub_until = claims.get("sub_until")
+    if not sub_until or sub_until <= datetime.now(timezone.utc).timestamp():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Subscription required")
+    return claims
+
+async def require_subscription(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)):
+    """Trade-route gate: verifies the bearer token and its sub_until claim, without touching the database."""
+    if not SUBSCRIPTION_GATE_ENABLED:
+        return
+    check_subscription(credentials)
+
+def websocket_credentials(websocket: WebSocket, token: Optional[str]) -> Optional[HTTPAuthorizationCredentials]:
+    """Browsers cannot set headers on a WebSocket handshake, so `?token=` is accepted too."""
+    if token:
+        return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    scheme, _, value = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and value:
+        return HTTPAuthorizationCredentials(scheme="Bearer", credentials=value)
+    return None
+
 def generate_unique_username(email: str) -> str:
     """Generates a username from email. Append random string to ensure uniqueness."""
     base = email.split("@")[0]
@@ -60,9 +134,10 @@ async def login_discord(
     state: str = Query(..., description="Local Flet App redirect URL"), 
     db: AsyncSession = Depends(dependencies.get_crypto_db)
 ):
-    async with httpx.AsyncClient() as client:
+    try:
         # 1. Exchange Code for Token
-        token_resp = await client.post(
+        token_resp = await http_client.post(
+            "discord",
             "https://discord.com/api/oauth2/token",
             data={
                 "client_id": DISCORD_CLIENT_ID,
@@ -82,11 +157,15 @@ async def login_discord(
         access_token = token_data.get("access_token")
 
         # 2. Get User Profile
-        user_resp = await client.get(
+        user_resp = await http_client.get(
+            "discord",
             "https://discord.com/api/users/@me",
             headers={"Authorization": f"Bearer {access_token}"}
         )
         discord_data = user_resp.json()
+    except httpx.HTTPError as e:
+        print(f"❌ Discord unreachable: {e!r}")
+        raise HTTPException(status_code=502, detail="Discord is unreachable")
 
     # 3. Process Login
     return await process_oauth_login(
@@ -105,8 +184,9 @@ async def login_google(
     state: str = Query(..., description="Local Flet App redirect URL"),
     db: AsyncSession = Depends(dependencies.get_crypto_db)
 ):
-    async with httpx.AsyncClient() as client:
-        token_resp = await client.post(
+    try:
+        token_resp = await http_client.post(
+            "google",
             "https://oauth2.googleapis.com/token",
             data={
                 "code": code,
@@ -125,11 +205,15 @@ async def login_google(
         token_data = token_resp.json()
         access_token = token_data.get("access_token")
 
-        user_resp = await client.get(
+        user_resp = await http_client.get(
+            "google",
             "https://www.googleapis.com/oauth2/v1/userinfo",
             headers={"Authorization": f"Bearer {access_token}"}
         )
         google_data = user_resp.json()
+    except httpx.HTTPError as e:
+        print(f"❌ Google unreachable: {e!r}")
+        raise HTTPException(status_code=502, detail="Google is unreachable")
 
     return await process_oauth_login(
         db, 
@@ -139,6 +223,36 @@ async def login_google(
         local_redirect_url=state
     )
 
+# --- TOKEN REFRESH ---
+
+@router.post("/token/refresh")
+async def refresh_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+    db: AsyncSession = Depends(dependencies.get_crypto_db)
+):
+    """
+    Reissues a still valid bearer token with the current subscription expiry,
+    e.g. after a payment extended it. Expired tokens are refused (log in again),
+    so a leaked token cannot be renewed forever.
+    """
+    claims = bearer_claims(credentials)
+    # Read past the user cache: a payment or deletion on another instance must count
+    result = await db.execute(select(models.User).where(models.User.id == int(claims["sub"])))
+    user = result.scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    subscribed_until = user.subscribed_until
+    if subscribed_until is not None and subscribed_until.tzinfo is None:
+        subscribed_until = subscribed_until.replace(tzinfo=timezone.utc)
+    if subscribed_until is None or subscribed_until <= datetime.now(timezone.utc):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Subscription required")
+
+    access_token = create_access_token(
+        data={"sub": str(user.id), "email": user.email}, subscribed_until=user.subscribed_until
+    )
+    return {"access_token": access_token, "token_type": "bearer", "subscribed_until": user.subscribed_until}
+
 # --- CORE LOGIN LOGIC ---
 
 async def process_oauth_login(
@@ -169,6 +283,7 @@ async def process_oauth_login(
             if discord_id: user.discord_id = discord_id
             if google_id: user.google_id = google_id
             await db.commit()
+            user_cache.invalidate(user.id)
             await db.refresh(user)
 
     # 3. If still no user, create a new one
@@ -203,7 +318,9 @@ async def process_oauth_login(
 
     # 4. Generate Token
     # Use 'id' (int) not 'user_id' as per your models.py
-    access_token = create_access_token(data={"sub": str(user.id), "email": user.email})
+    access_token = create_access_token(
+        data={"sub": str(user.id), "email": user.email}, subscribed_until=user.subscribed_until
+    )
     
     # 5. Redirect
     query_params = {
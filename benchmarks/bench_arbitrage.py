@@ -0,0 +1,81 @@
+"""
+Arbitrage query benchmark over a synthetic 30k-item table: hot table (in memory)
+vs ORDER BY ... LIMIT in the database.
+
+Usage:
+    python benchmarks/bench_arbitrage.py
+"""
+import sys
+import os
+import asyncio
+import random
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+import arbitrage
+from database import Base
+from buffer import PriceUpdateBuffer
+from hot_table import HotPriceTable
+from schemas import ItemPriceUpdate
+
+ITEMS = 30_000
+RUNS = 20
+
+
+async def timed(fn):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = await fn()
+    return (time.perf_counter() - start) / RUNS * 1000, result
+
+
+async def main():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    rng = random.Random(1)
+    buffer = PriceUpdateBuffer()
+    await buffer.add_updates("EU", "fast", [
+        ItemPriceUpdate(unique_name=f"T{4 + i % 5}_ITEM_{i}", **{
+            f"price_{city}": rng.randint(100, 100_000) for city in models.CITIES
+        })
+        for i in range(ITEMS)
+    ])
+    async with session_factory() as db:
+        await buffer.flush(db)
+
+    hot = HotPriceTable()
+    await hot.load(session_factory)
+    block = hot.block("EU", "fast")
+
+    print(f"{ITEMS} items, top 50 lymhurst -> black_market")
+    for sort_by in ("spread", "margin"):
+        async def memory():
+            return arbitrage.top_routes_in_memory(block, "lymhurst", "black_market", 50, sort_by)
+
+        async def sql():
+            async with session_factory() as db:
+                return await arbitrage.top_routes_sql(
+                    db, models.ItemFastEU, "lymhurst", "black_market", 50, sort_by
+                )
+
+        memory_ms, memory_routes = await timed(memory)
+        sql_ms, sql_routes = await timed(sql)
+        assert [r["spread"] for r in memory_routes] == [r["spread"] for r in sql_routes]
+        print(f"{sort_by:>7} | memory {memory_ms:7.2f} ms | sql {sql_ms:7.2f} ms")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
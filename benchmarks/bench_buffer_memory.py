@@ -0,0 +1,71 @@
+"""
+Buffer memory benchmark: the previous dict-per-item layout vs PriceBlock columns.
+
+Usage:
+    python benchmarks/bench_buffer_memory.py
+"""
+import sys
+import os
+import tracemalloc
+from datetime import datetime, timezone
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import models
+from price_block import PriceBlock, to_epoch_us
+
+ITEMS = 30_000
+BUCKETS = 6
+
+
+def build_dict_layout(names):
+    """{ item_name: {price_<city>: int, <city>_updated_at: datetime} } as before."""
+    buckets = []
+    for _ in range(BUCKETS):
+        data = {}
+        for i, name in enumerate(names):
+            fields = {}
+            for n, city in enumerate(models.CITIES):
+                fields[f"price_{city}"] = 10_000 + i + n
+                # A fresh datetime per city, as each request stamped its own
+                fields[f"{city}_updated_at"] = datetime.now(timezone.utc)
+            data[name] = fields
+        buckets.append(data)
+    return buckets
+
+
+def build_block_layout(names):
+    buckets = []
+    for _ in range(BUCKETS):
+        block = PriceBlock()
+        for i, name in enumerate(names):
+            row = block.row(name)
+            for n in range(len(models.CITIES)):
+                block.set(row, n, 10_000 + i + n, to_epoch_us(datetime.now(timezone.utc)))
+        buckets.append(block)
+    return buckets
+
+
+def measure(builder, names):
+    tracemalloc.start()
+    buckets = builder(names)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del buckets
+    return current
+
+
+def main():
+    # Item names are shared with the request payloads, so keep them out of the measurement
+    names = [f"T{4 + i % 5}_ITEM_{i}" for i in range(ITEMS)]
+
+    print(f"{ITEMS} items x {len(models.CITIES)} cities x {BUCKETS} buckets")
+    dict_bytes = measure(build_dict_layout, names)
+    block_bytes = measure(build_block_layout, names)
+    print(f"{'dict layout':>12}: {dict_bytes / 2**20:8.1f} MiB")
+    print(f"{'PriceBlock':>12}: {block_bytes / 2**20:8.1f} MiB  ({dict_bytes / block_bytes:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Ingest latency benchmark: PriceUpdateBuffer.add_updates with and without a
+concurrent flush loop writing to the database.
+
+Usage:
+    python benchmarks/bench_ingest.py
+"""
+import sys
+import os
+import asyncio
+import statistics
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from buffer import PriceUpdateBuffer
+from schemas import ItemPriceUpdate
+
+REQUESTS = 500
+ITEMS_PER_REQUEST = 200
+
+
+def make_request(i):
+    return [
+        ItemPriceUpdate(unique_name=f"T4_ITEM_{(i * ITEMS_PER_REQUEST + n) % 30_000}", price_lymhurst=i + n)
+        for n in range(ITEMS_PER_REQUEST)
+    ]
+
+
+async def flush_loop(buffer, session_factory, stop):
+    while not stop.is_set():
+        async with session_factory() as db:
+            await buffer.flush(db)
+        await asyncio.sleep(0)
+
+
+async def measure(buffer, requests):
+    latencies = []
+    for i, updates in enumerate(requests):
+        server = ("EU", "US", "AS")[i % 3]
+        start = time.perf_counter()
+        await buffer.add_updates(server, "fast", updates)
+        latencies.append(time.perf_counter() - start)
+        # Yield like a real request handler would, so the flush task gets to run
+        await asyncio.sleep(0)
+    latencies.sort()
+    return latencies
+
+
+def report(label, latencies):
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:>16} | p50 {p50:7.3f} ms | p99 {p99:7.3f} ms | max {latencies[-1] * 1000:7.3f} ms")
+
+
+async def main():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    requests = [make_request(i) for i in range(REQUESTS)]
+    print(f"{REQUESTS} requests x {ITEMS_PER_REQUEST} items")
+
+    report("idle", await measure(PriceUpdateBuffer(), requests))
+
+    buffer = PriceUpdateBuffer()
+    stop = asyncio.Event()
+    flusher = asyncio.create_task(flush_loop(buffer, session_factory, stop))
+    report("during flushes", await measure(buffer, requests))
+    stop.set()
+    await flusher
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
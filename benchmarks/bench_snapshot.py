@@ -0,0 +1,92 @@
+"""
+Snapshot benchmark: GET /items/ style JSON vs the packed columnar snapshot,
+for a full 30k-item table. Reports payload size and serialization time.
+
+Usage:
+    python benchmarks/bench_snapshot.py
+"""
+import sys
+import os
+import asyncio
+import gzip
+import json
+import random
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+import snapshot
+from database import Base
+from buffer import PriceUpdateBuffer
+from storage import WideStorage
+from schemas import ItemPriceUpdate
+
+ITEMS = 30_000
+
+
+async def seed(session_factory):
+    rng = random.Random(1)
+    buffer = PriceUpdateBuffer()
+    await buffer.add_updates("EU", "fast", [
+        ItemPriceUpdate(unique_name=f"T{4 + i % 5}_ITEM_{i}", **{
+            # Scrapers rarely see every city, so leave some gaps
+            f"price_{city}": rng.randint(100, 100_000) for city in models.CITIES if rng.random() < 0.8
+        })
+        for i in range(ITEMS)
+    ])
+    async with session_factory() as db:
+        await buffer.flush(db)
+
+
+async def main():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    await seed(session_factory)
+    model = models.ItemFastEU
+
+    async with session_factory() as db:
+        start = time.perf_counter()
+        result = await db.execute(select(*model.__table__.columns))
+        rows = [dict(row) for row in result.mappings()]
+        query_json = time.perf_counter() - start
+
+        start = time.perf_counter()
+        body_json = json.dumps(jsonable_encoder(rows)).encode()
+        encode_json = time.perf_counter() - start
+        start = time.perf_counter()
+        body_json_gz = gzip.compress(body_json, compresslevel=6)
+        gzip_json = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table = await WideStorage().load_table(db, "EU", "fast")
+        query_snapshot = time.perf_counter() - start
+
+    start = time.perf_counter()
+    body_snapshot = snapshot.encode("EU", "fast", table)
+    encode_snapshot = time.perf_counter() - start
+    start = time.perf_counter()
+    body_snapshot_gz = gzip.compress(body_snapshot, compresslevel=6)
+    gzip_snapshot = time.perf_counter() - start
+
+    print(f"{ITEMS} items, EU/fast")
+    print(f"{'format':>16} | {'query (ms)':>10} | {'encode (ms)':>11} | {'raw (KiB)':>9} | {'gzip (KiB)':>10} | {'gzip (ms)':>9}")
+    print("-" * 82)
+    print(f"{'JSON':>16} | {query_json * 1000:>10.1f} | {encode_json * 1000:>11.1f} | {len(body_json) / 1024:>9.0f} | {len(body_json_gz) / 1024:>10.0f} | {gzip_json * 1000:>9.1f}")
+    print(f"{'packed columns':>16} | {query_snapshot * 1000:>10.1f} | {encode_snapshot * 1000:>11.1f} | {len(body_snapshot) / 1024:>9.0f} | {len(body_snapshot_gz) / 1024:>10.0f} | {gzip_snapshot * 1000:>9.1f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
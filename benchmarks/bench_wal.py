@@ -0,0 +1,84 @@
+"""
+WAL benchmark: ingest throughput of PriceUpdateBuffer with the write-ahead
+log off, on without fsync, and on with group-committed fsync.
+
+CONCURRENCY clients each send REQUESTS_PER_CLIENT requests back to back, the
+way concurrent ingest requests hit one instance. With group commit, requests
+arriving within WAL_GROUP_COMMIT_MS share a single fsync.
+
+Usage:
+    python benchmarks/bench_wal.py
+    BENCH_WAL_DIR=/mnt/disk python benchmarks/bench_wal.py   # measure a specific disk
+"""
+import sys
+import os
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from buffer import PriceUpdateBuffer
+from schemas import ItemPriceUpdate
+from wal import PriceWAL
+
+BENCH_WAL_DIR = os.getenv("BENCH_WAL_DIR")
+CONCURRENCY = 32
+REQUESTS_PER_CLIENT = 50
+ITEMS_PER_REQUEST = 200
+
+
+def make_request(i):
+    return [
+        ItemPriceUpdate(unique_name=f"T4_ITEM_{(i * ITEMS_PER_REQUEST + n) % 30_000}", price_lymhurst=i + n)
+        for n in range(ITEMS_PER_REQUEST)
+    ]
+
+
+async def client(buffer, requests, latencies):
+    for i, updates in enumerate(requests):
+        start = time.perf_counter()
+        await buffer.add_updates(("EU", "US", "AS")[i % 3], "fast", updates)
+        latencies.append(time.perf_counter() - start)
+
+
+async def bench(label, wal, requests):
+    buffer = PriceUpdateBuffer(wal=wal)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(buffer, chunk, latencies) for chunk in requests))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    items = CONCURRENCY * REQUESTS_PER_CLIENT * ITEMS_PER_REQUEST
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    commits = f"{wal.commits:>7}" if wal is not None else f"{'-':>7}"
+    print(f"{label:>14} | {items / elapsed:>12,.0f} items/s | p50 {p50:7.3f} ms | p99 {p99:7.3f} ms | commits {commits}")
+
+
+async def main():
+    requests = [
+        [make_request(client_id * REQUESTS_PER_CLIENT + i) for i in range(REQUESTS_PER_CLIENT)]
+        for client_id in range(CONCURRENCY)
+    ]
+    print(f"{CONCURRENCY} clients x {REQUESTS_PER_CLIENT} requests x {ITEMS_PER_REQUEST} items")
+
+    await bench("wal off", None, requests)
+    for label, fsync, group_commit_ms in (
+        ("wal, no fsync", False, 2),
+        ("wal, fsync", True, 0),
+        ("wal, fsync 2ms", True, 2),
+    ):
+        directory = tempfile.mkdtemp(prefix="bench_wal_", dir=BENCH_WAL_DIR)
+        try:
+            await bench(label, PriceWAL(directory, group_commit_ms=group_commit_ms, fsync=fsync), requests)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
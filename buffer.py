@@ -1,102 +1,281 @@
 import asyncio
-from typing import Dict, Any, Literal
+import os
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
 from datetime import datetime, timezone
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import update
-import models
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from price_block import PriceBlock, NULL, PRICE_FIELD_INDEX, to_epoch_us
+from storage import PriceStorage, price_storage
+from buffer_backend import make_backend
+from wal import PriceWAL, WAL_ENABLED
+
+# Tables written concurrently by one flush, each on its own pooled connection
+FLUSH_PARALLELISM = int(os.getenv("FLUSH_PARALLELISM", "6"))
+# Extra attempts for a table whose write failed, before its block is requeued
+FLUSH_TABLE_RETRIES = int(os.getenv("FLUSH_TABLE_RETRIES", "2"))
+# Backoff before retry n is FLUSH_RETRY_BACKOFF_SECONDS * 2**n
+FLUSH_RETRY_BACKOFF_SECONDS = float(os.getenv("FLUSH_RETRY_BACKOFF_SECONDS", "0.1"))
+
+class _Shard:
+    """
+    Double buffer for one (server, type) bucket. Ingest writes into `active`;
+    a flush swaps in an empty block and writes the old one, so neither side copies.
+    """
+    __slots__ = ("active", "first_added")
 
-class PriceUpdateBuffer:
     def __init__(self):
-        # Structure: self._buffers[server][type] = { item_name: data }
-        self._buffers: Dict[str, Dict[str, Dict[str, Any]]] = {
-            "EU": {"fast": {}, "order": {}},
-            "US": {"fast": {}, "order": {}},
-            "AS": {"fast": {}, "order": {}},
+        self.active = PriceBlock()
+        # Monotonic time of the oldest unflushed entry (None when empty)
+        self.first_added: Optional[float] = None
+
+    def swap(self) -> PriceBlock:
+        data, self.active = self.active, PriceBlock()
+        self.first_added = None
+        return data
+
+    def requeue(self, data: PriceBlock, first_added: Optional[float]):
+        """Puts a block whose flush failed back under the active one, newer prices win."""
+        data.merge(self.active)
+        self.active = data
+        if first_added is not None and (self.first_added is None or first_added < self.first_added):
+            self.first_added = first_added
+
+    def clear(self):
+        self.swap()
+
+    def __len__(self):
+        return len(self.active)
+
+
+class PriceUpdateBuffer:
+    def __init__(
+        self,
+        storage: Optional[PriceStorage] = None,
+        backend=None,
+        wal: Optional[PriceWAL] = None,
+        parallelism: Optional[int] = None,
+        retries: Optional[int] = None,
+    ):
+        # Layout the flushed blocks are written to (PRICE_STORAGE by default)
+        self.storage = storage or price_storage
+        # Where flushed blocks go first (BUFFER_BACKEND by default), see buffer_backend.py
+        self.backend = backend or make_backend()
+        # Optional write-ahead log (WAL_ENABLED), see wal.py
+        self.wal = wal
+        # Flush tuning, FLUSH_PARALLELISM / FLUSH_TABLE_RETRIES when None
+        self.parallelism = parallelism
+        self.retries = retries
+        # Structure: self._buffers[server][type] = _Shard(PriceBlock of item prices)
+        # Shards never share state: ingest for one bucket does not wait on a flush of another.
+        self._buffers: Dict[str, Dict[str, _Shard]] = {
+            "EU": {"fast": _Shard(), "order": _Shard()},
+            "US": {"fast": _Shard(), "order": _Shard()},
+            "AS": {"fast": _Shard(), "order": _Shard()},
         }
-        self._lock = asyncio.Lock()
+        # One flush per bucket at a time, held from swap to WAL release: a later
+        # flush's release would otherwise delete segments whose records an
+        # earlier, still running flush has not committed yet
+        self._flush_locks: Dict[Tuple[str, str], asyncio.Lock] = {
+            (server, type_): asyncio.Lock() for server in self._buffers for type_ in self._buffers[server]
+        }
+        self._flush_listeners: List[Callable[[str, str, PriceBlock, datetime], None]] = []
+        self.failed_flushes = 0
+
+    def add_flush_listener(self, listener: Callable[[str, str, PriceBlock, datetime], None]):
+        """
+        Registers listener(server, type, block, flushed_at), called for every bucket
+        after its flush is committed. Listeners run synchronously and must not block.
+        """
+        self._flush_listeners.append(listener)
+
+    def _notify_flushed(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        for listener in self._flush_listeners:
+            try:
+                listener(server, type_, block, flushed_at)
+            except Exception as e:
+                print(f"Error in flush listener {listener!r}: {e}")
+
+    def buckets(self) -> List[Tuple[str, str]]:
+        return [(server, type_) for server in self._buffers for type_ in self._buffers[server]]
+
+    def bucket_stats(self) -> List[Dict[str, Any]]:
+        """Size and age (seconds) of the oldest entry for every (server, type) bucket."""
+        now = time.monotonic()
+        stats = []
+        for server, type_ in self.buckets():
+            shard = self._buffers[server][type_]
+            stats.append({
+                "server": server,
+                "type": type_,
+                "size": len(shard),
+                "age": now - shard.first_added if shard.first_added is not None else 0.0,
+            })
+        return stats
 
     async def add_updates(self, server: str, type_: str, updates: list):
+        """Buffers a list of ItemPriceUpdate models."""
+        logged = self._merge(server, type_, (
+            (item.unique_name, ((key, getattr(item, key)) for key in item.model_fields_set))
+            for item in updates
+        ))
+        if logged:
+            await self.wal.sync()
+
+    async def add_rows(self, server: str, type_: str, rows: Iterable[Dict[str, Any]]):
+        """Buffers already validated plain dicts shaped like ItemPriceUpdate."""
+        if self._merge(server, type_, ((row["unique_name"], row.items()) for row in rows)):
+            await self.wal.sync()
+
+    def _merge(self, server: str, type_: str, items: Iterable[Tuple[str, Iterable[Tuple[str, Any]]]]) -> bool:
+        """Merges the items into the active block; True if a WAL record now has to be synced."""
         # Basic validation
         if server not in self._buffers or type_ not in self._buffers[server]:
-            return 
-
-        current_time = datetime.now(timezone.utc)
+            return False
 
-        async with self._lock:
-            for item in updates:
-                data = item.model_dump(exclude_unset=True)
-                name = data.pop("unique_name")
+        current_time = to_epoch_us(datetime.now(timezone.utc))
+        shard = self._buffers[server][type_]
+        logged = [] if self.wal is not None else None
 
-                if not data:
+        # Synchronous on purpose: the merge runs atomically on the event loop, so no lock is needed
+        for unique_name, fields in items:
+            block = shard.active
+            row = None
+            for key, price in fields:
+                city_idx = PRICE_FIELD_INDEX.get(key)
+                # Later non-null prices overwrite earlier ones; nulls carry no update
+                if city_idx is None or price is None:
                     continue
+                if row is None:
+                    row = block.row(unique_name)
+                block.set(row, city_idx, price, current_time)
+                if logged is not None:
+                    logged.append((unique_name, city_idx, price))
+
+            if row is not None and shard.first_added is None:
+                shard.first_added = time.monotonic()
+
+        if logged:
+            self.wal.append(server, type_, current_time, logged)
+        return bool(logged)
 
-                # Add timestamps dynamically
-                for key in list(data.keys()):
-                    if key.startswith("price_"):
-                        city_slug = key.replace("price_", "")
-                        timestamp_field = f"{city_slug}_updated_at"
-                        data[timestamp_field] = current_time
-
-                if name not in self._buffers[server][type_]:
-                    self._buffers[server][type_][name] = {}
-                
-                # Merge updates
-                self._buffers[server][type_][name].update(data)
-
-    async def flush(self, db: AsyncSession):
-        async with self._lock:
-            # Deep copy to snapshot current state
-            buffers_snapshot = {
-                server: {
-                    "fast": self._buffers[server]["fast"].copy(),
-                    "order": self._buffers[server]["order"].copy()
-                } for server in self._buffers
-            }
-            
-            # Clear original buffers
-            for server in self._buffers:
-                self._buffers[server]["fast"].clear()
-                self._buffers[server]["order"].clear()
-
-        total_count = 0
-        
-        try:
-            # Iterate through servers (EU, US, AS)
-            for server, types in buffers_snapshot.items():
-                # Iterate through types (fast, order)
-                for type_name, data_map in types.items():
-                    if data_map:
-                        # Dynamic Model Selection
-                        model_class = models.MODEL_MAP[server][type_name]
-                        total_count += await self._flush_data(db, model_class, data_map)
-            
-            await db.commit()
-            return total_count
-
-        except Exception as e:
-            print(f"Error flushing buffer: {e}")
-            await db.rollback()
+    def replay_wal(self) -> int:
+        """Merges what the WAL still holds back into the buffer (at startup). Returns the records replayed."""
+        if self.wal is None:
             return 0
+        records = 0
+        for server, type_, stamp, entries in self.wal.replay():
+            if server not in self._buffers or type_ not in self._buffers[server]:
+                continue
+            shard = self._buffers[server][type_]
+            block = shard.active
+            for unique_name, city_idx, price in entries:
+                row = block.row(unique_name)
+                if block.prices[city_idx][row] == NULL or stamp >= block.stamps[city_idx][row]:
+                    block.set(row, city_idx, price, stamp)
+            if entries and shard.first_added is None:
+                shard.first_added = time.monotonic()
+            records += 1
+        return records
+
+    async def flush(self, db: AsyncSession, buckets: Optional[Iterable[Tuple[str, str]]] = None):
+        """
+        Writes the given (server, type) buckets to the database, or all of them by default.
+
+        Each table is written on its own pooled connection and transaction, up to
+        FLUSH_PARALLELISM at a time, so a flush takes about as long as its slowest
+        table. `db` only provides the engine. A table whose write fails is retried
+        on its own; once its retries are used up its block is requeued.
+        """
+        selected = list(buckets) if buckets is not None else self.buckets()
+
+        session_factory = async_sessionmaker(db.bind, expire_on_commit=False)
+        # SQLite has a single writer, and a StaticPool shares one connection between sessions
+        parallelism = 1 if db.bind.dialect.name == "sqlite" else (self.parallelism or FLUSH_PARALLELISM)
+        semaphore = asyncio.Semaphore(parallelism)
+
+        counts = await asyncio.gather(*(
+            self._flush_table(session_factory, semaphore, server, type_) for server, type_ in selected
+        ))
 
-    async def _flush_data(self, db: AsyncSession, model, data_map: Dict):
+        # A shared backend applies what every instance staged, including the blocks above
+        if not self.backend.applies_directly:
+            await self._apply_staged(session_factory)
+
+        return sum(counts)
+
+    async def _flush_table(self, session_factory, semaphore: asyncio.Semaphore, server: str, type_: str) -> int:
+        # Uncontended, the lock is taken without yielding, so every bucket of a
+        # flush is still swapped before any of them awaits the database
+        async with self._flush_locks[(server, type_)]:
+            # Swap in an empty buffer (O(1)); new updates go to the fresh one
+            shard = self._buffers[server][type_]
+            first_added = shard.first_added
+            block = shard.swap()
+            # The swapped block is logged in the WAL segments before this one
+            wal_segment = self.wal.rotate(server, type_) if self.wal is not None else None
+            return await self._write_table(session_factory, semaphore, server, type_, block, first_added, wal_segment)
+
+    async def _write_table(self, session_factory, semaphore: asyncio.Semaphore,
+                           server: str, type_: str, block: PriceBlock, first_added: Optional[float], wal_segment: Optional[int]) -> int:
         count = 0
-        for unique_name, fields in data_map.items():
-            fields["updated_at"] = datetime.now(timezone.utc)
-            
-            # Update existing
-            stmt = (
-                update(model)
-                .where(model.unique_name == unique_name)
-                .values(**fields)
-            )
-            result = await db.execute(stmt)
-
-            # Insert if not exists
-            if result.rowcount == 0:
-                new_item = model(unique_name=unique_name, **fields)
-                db.add(new_item)
-            
-            count += 1
+        flushed_at = None
+        if block:
+            retries = FLUSH_TABLE_RETRIES if self.retries is None else self.retries
+            for attempt in range(retries + 1):
+                try:
+                    async with semaphore, session_factory() as db:
+                        flushed_at = await self._begin_write(db, server, type_)
+                        count = await self._flush_data(db, server, type_, block, flushed_at)
+                        await db.commit()
+                    break
+                except Exception as e:
+                    if attempt < retries:
+                        print(f"Error flushing {server}/{type_} (attempt {attempt + 1}), retrying: {e}")
+                        await asyncio.sleep(FLUSH_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                        continue
+                    # Nothing was written: put the block back so the next flush retries it.
+                    # Its WAL segments are kept until that flush commits.
+                    self._buffers[server][type_].requeue(block, first_added)
+                    self.failed_flushes += 1
+                    print(f"Error flushing {server}/{type_}, requeued {len(block)} items: {e}")
+                    return 0
+
+        if wal_segment is not None:
+            try:
+                await self.wal.release(server, type_, wal_segment)
+            except Exception as e:
+                print(f"Error releasing WAL segments of {server}/{type_}: {e}")
+
+        if block and self.backend.applies_directly:
+            self._notify_flushed(server, type_, block, flushed_at)
         return count
 
-price_buffer = PriceUpdateBuffer()
\ No newline at end of file
+    async def _begin_write(self, db: AsyncSession, server: str, type_: str) -> datetime:
+        """Flush stamp for a table write; takes the series' version lock when writing prices directly."""
+        if not self.backend.applies_directly:
+            # Staged rows keep their per-city stamps; the apply stamps them again
+            return datetime.now(timezone.utc)
+        _, flushed_at = await self.storage.begin_write(db, server, type_)
+        return flushed_at
+
+    async def _apply_staged(self, session_factory):
+        """Applies staged rows one claim per transaction, at most backend.max_claims of them."""
+        for _ in range(self.backend.max_claims):
+            try:
+                async with session_factory() as db:
+                    applied, flushed_at, more = await self.backend.apply_claim(db, self.storage)
+                    await db.commit()
+            except Exception as e:
+                # The claim rolled back: the rows stay staged for the next flush, on any instance
+                self.failed_flushes += 1
+                print(f"Error applying staged updates: {e}")
+                return
+            for server, type_, block in applied:
+                self._notify_flushed(server, type_, block, flushed_at)
+            if not more:
+                return
+
+    async def _flush_data(self, db: AsyncSession, server: str, type_: str, block: PriceBlock, flushed_at: Optional[datetime] = None):
+        return await self.backend.write(db, self.storage, server, type_, block, flushed_at)
+
+price_buffer = PriceUpdateBuffer(wal=PriceWAL() if WAL_ENABLED else None)
@@ -0,0 +1,176 @@
+"""
+Where PriceUpdateBuffer.flush hands its blocks to.
+
+- "local" (default): the block is upserted into the price storage directly.
+- "staging": the block is appended to the shared PriceStaging table (COPY on
+  asyncpg, executemany elsewhere), and every flush, on any instance, then
+  claims staged rows, merges them and applies them to the price storage.
+  Instances only keep a flush interval of updates in memory, and
+  /system/flush-buffer on one instance drains what all of them staged.
+
+Selected with BUFFER_BACKEND.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from price_block import PriceBlock, CITY_COUNT, NULL, to_epoch_us
+from storage import PriceStorage, UPSERT_BATCH_SIZE
+
+BUFFER_BACKEND = os.getenv("BUFFER_BACKEND", "local")
+# Staged rows claimed, merged and committed per transaction; keeps each
+# apply transaction (and the version locks it holds) short
+STAGING_CLAIM_ROWS = int(os.getenv("STAGING_CLAIM_ROWS", "10000"))
+# Claims per flush; rows staged beyond that wait for the next flush, so one
+# flush cannot run forever while other instances keep staging
+STAGING_MAX_CLAIMS = int(os.getenv("STAGING_MAX_CLAIMS", "50"))
+
+STAGING_COLUMNS = ["server", "type", "unique_name", "city_idx", "price", "stamp"]
+
+# (server, type, block) written to the price storage by a flush
+Applied = List[Tuple[str, str, PriceBlock]]
+
+
+class LocalBackend:
+    """Writes flushed blocks straight into the price storage."""
+    name = "local"
+    # Blocks passed to write() are in the storage once the flush commits
+    applies_directly = True
+
+    async def write(self, db: AsyncSession, storage: PriceStorage, server: str, type_: str, block: PriceBlock, flushed_at: datetime) -> int:
+        return await storage.write_block(db, server, type_, block, flushed_at)
+
+    # Nothing is staged
+    max_claims = 0
+
+    async def apply_claim(self, db: AsyncSession, storage: PriceStorage) -> Tuple[Applied, Optional[datetime], bool]:
+        return [], None, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class StagingTableBackend:
+    """
+    Shared staging table. Rows are claimed with
+    DELETE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING,
+    inside the apply transaction: if the apply fails, the claim rolls back
+    and the rows stay staged for the next flusher. Concurrent flushers on
+    other instances skip the locked rows instead of waiting.
+    """
+    name = "staging"
+    applies_directly = False
+
+    def __init__(self, claim_rows: Optional[int] = None, max_claims: Optional[int] = None):
+        self.claim_rows = claim_rows or STAGING_CLAIM_ROWS
+        self.max_claims = max_claims or STAGING_MAX_CLAIMS
+        self.staged_rows = 0
+        self.applied_rows = 0
+
+    async def write(self, db, storage, server, type_, block, flushed_at):
+        records = []
+        for city_idx in range(CITY_COUNT):
+            prices, stamps = block.prices[city_idx], block.stamps[city_idx]
+            for row, name in enumerate(block.names):
+                if prices[row] != NULL:
+                    records.append((server, type_, name, city_idx, prices[row], stamps[row]))
+
+        connection = await db.connection()
+        if connection.dialect.name == "postgresql" and connection.dialect.driver == "asyncpg":
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                models.PriceStaging.__tablename__, records=records, columns=STAGING_COLUMNS
+            )
+        else:
+            stmt = models.PriceStaging.__table__.insert()
+            rows = [dict(zip(STAGING_COLUMNS, record)) for record in records]
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                await db.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+
+        self.staged_rows += len(records)
+        return len(block)
+
+    async def _claim(self, db: AsyncSession) -> list:
+        staging = models.PriceStaging
+        claimed_ids = (
+            select(staging.id)
+            .order_by(staging.id)
+            .limit(self.claim_rows)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = delete(staging).where(staging.id.in_(claimed_ids)).returning(
+            staging.server, staging.type, staging.unique_name, staging.city_idx, staging.price, staging.stamp
+        )
+        return (await db.execute(stmt)).all()
+
+    async def apply_claim(self, db, storage):
+        """
+        Claims up to claim_rows staged rows, merges them per bucket (latest
+        stamp wins) and writes the result, in the caller's transaction:
+        (applied, flush stamp, whether more rows may be staged).
+
+        A staged price only replaces a stored one with an older stamp:
+        instances stage independently, so a row staged late can be older than
+        what an earlier apply wrote. Those prices are left out of `applied`
+        too, so flush listeners only see what was written.
+        """
+        rows = await self._claim(db)
+        blocks: Dict[Tuple[str, str], PriceBlock] = {}
+        for server, type_, name, city_idx, price, stamp in rows:
+            block = blocks.get((server, type_))
+            if block is None:
+                block = blocks[(server, type_)] = PriceBlock()
+            row = block.row(name)
+            # Instances stage independently, so order by stamp rather than by claim order
+            if block.prices[city_idx][row] == NULL or stamp >= block.stamps[city_idx][row]:
+                block.set(row, city_idx, price, stamp)
+        self.applied_rows += len(rows)
+
+        # Version locks in a fixed order, so two appliers cannot deadlock; the
+        # stamp read after the last one is newer than any committed row
+        flushed_at = None
+        for server, type_ in sorted(blocks):
+            _, flushed_at = await storage.begin_write(db, server, type_)
+
+        applied = []
+        for (server, type_), block in sorted(blocks.items()):
+            # The version lock keeps other writers of the series out until commit
+            block = await self._newer_than_stored(db, storage, server, type_, block)
+            if block:
+                await storage.write_block(db, server, type_, block, flushed_at, newer_only=True)
+                applied.append((server, type_, block))
+        return applied, flushed_at, len(rows) == self.claim_rows
+
+    async def _newer_than_stored(self, db, storage, server, type_, block: PriceBlock) -> PriceBlock:
+        stored = {
+            row["unique_name"]: row
+            for row in await storage.read_prices(db, server, type_, list(block.names), None)
+        }
+        newer = PriceBlock()
+        for src_row, name in enumerate(block.names):
+            current = stored.get(name, {})
+            for city_idx, city in enumerate(models.CITIES):
+                price, stamp = block.prices[city_idx][src_row], block.stamps[city_idx][src_row]
+                stored_at = current.get(f"{city}_updated_at")
+                if price == NULL or (stored_at is not None and to_epoch_us(stored_at) >= stamp):
+                    continue
+                newer.set(newer.row(name), city_idx, price, stamp)
+        return newer
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "staged_rows": self.staged_rows, "applied_rows": self.applied_rows}
+
+
+BACKENDS = {"local": LocalBackend, "staging": StagingTableBackend}
+
+if BUFFER_BACKEND not in BACKENDS:
+    raise ValueError(f"BUFFER_BACKEND must be one of {sorted(BACKENDS)}, got '{BUFFER_BACKEND}'")
+
+
+def make_backend(name: str = BUFFER_BACKEND):
+    return BACKENDS[name]()
@@ -0,0 +1,172 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from price_block import PriceBlock
+
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", "1024"))
+PRICE_CACHE_TTL_SECONDS = float(os.getenv("PRICE_CACHE_TTL_SECONDS", "60"))
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Size-bounded LRU with a per-entry time to live.
+    `on_evict(key)` is called whenever an entry leaves the cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        on_evict: Optional[Callable[[Hashable], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            self.pop(key)
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            oldest, _ = self._entries.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(oldest)
+
+    def pop(self, key: Hashable):
+        if self._entries.pop(key, None) is not None and self.on_evict:
+            self.on_evict(key)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# (server, type, item names or None for "all", city slugs or None for "all columns")
+PriceQueryKey = Tuple[str, str, Optional[frozenset], Optional[Tuple[str, ...]]]
+
+
+class PriceQueryCache:
+    """
+    Read-through cache for GET /items/ results.
+
+    A flush invalidates only the entries that could contain an item it wrote:
+    queries naming that item, and queries over the whole table.
+    """
+
+    def __init__(self, max_entries: int = PRICE_CACHE_MAX_ENTRIES, ttl: float = PRICE_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(max_entries, ttl, on_evict=self._unindex)
+        # (server, type, item) -> keys of queries naming that item
+        self._by_item: Dict[Tuple[str, str, str], Set[PriceQueryKey]] = {}
+        # (server, type) -> keys of whole-table queries
+        self._whole_table: Dict[Tuple[str, str], Set[PriceQueryKey]] = {}
+        # Bumped on every invalidation of a (server, type); a read that started
+        # before a flush must not store its (now stale) result
+        self._generation: Dict[Tuple[str, str], int] = {}
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(
+        server: str, type_: str, item_names: Optional[Iterable[str]], cities: Optional[Iterable[str]]
+    ) -> PriceQueryKey:
+        return (
+            server,
+            type_,
+            frozenset(item_names) if item_names else None,
+            tuple(cities) if cities else None,
+        )
+
+    def generation(self, server: str, type_: str) -> int:
+        return self._generation.get((server, type_), 0)
+
+    def get(self, key: PriceQueryKey) -> Any:
+        return self._cache.get(key)
+
+    def set(self, key: PriceQueryKey, value: Any, generation: int):
+        server, type_, item_names, _ = key
+        if self.generation(server, type_) != generation:
+            return
+
+        self._cache.set(key, value)
+        if item_names is None:
+            self._whole_table.setdefault((server, type_), set()).add(key)
+        else:
+            for name in item_names:
+                self._by_item.setdefault((server, type_, name), set()).add(key)
+
+    def _unindex(self, key: PriceQueryKey):
+        server, type_, item_names, _ = key
+        if item_names is None:
+            self._whole_table.get((server, type_), set()).discard(key)
+            return
+        for name in item_names:
+            keys = self._by_item.get((server, type_, name))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_item[(server, type_, name)]
+
+    def invalidate(self, server: str, type_: str, item_names: Iterable[str]):
+        bucket = (server, type_)
+        self._generation[bucket] = self._generation.get(bucket, 0) + 1
+
+        stale = set(self._whole_table.pop(bucket, ()))
+        for name in item_names:
+            stale.update(self._by_item.pop((server, type_, name), ()))
+
+        for key in stale:
+            self._cache.pop(key)
+        self.invalidations += len(stale)
+
+    def on_flush(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        self.invalidate(server, type_, block.names)
+
+    def clear(self):
+        self._cache.clear()
+        self._by_item.clear()
+        self._whole_table.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "invalidated_entries": self.invalidations}
+
+
+price_cache = PriceQueryCache()
@@ -0,0 +1,29 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cursors import decode_cursor, encode_cursor
+from storage import PriceStorage
+
+
+async def fetch_changes(
+    db: AsyncSession,
+    storage: PriceStorage,
+    server: str,
+    type_: str,
+    since: Optional[str],
+    limit: int,
+) -> Dict[str, Any]:
+    """
+    Rows written by flushes after the cursor, oldest first, keyset-paginated
+    by the storage layout. Without a cursor the whole table is paged.
+    Flush stamps follow commit order (PriceStorage.begin_write), so a row can
+    never commit behind a cursor that was already handed out.
+    """
+    # Storage keys are (flush time, unique_name[, city])
+    after = decode_cursor(since, (datetime, *[str] * (storage.key_length - 1))) if since else None
+
+    rows, last_key, has_more = await storage.fetch_changes(db, server, type_, after, limit)
+    cursor = encode_cursor(last_key) if last_key is not None else since
+    return {"items": rows, "cursor": cursor, "has_more": has_more}
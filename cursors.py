@@ -0,0 +1,41 @@
+"""
+Opaque keyset cursors for GET /items/changes and GET /invoices/.
+
+A cursor is the sort key of the last row a page returned, as unpadded
+URL-safe base64 JSON. Datetimes travel as epoch microseconds so the key
+round-trips exactly.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Sequence
+
+from price_block import from_epoch_us, to_epoch_us
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    values = [to_epoch_us(value) if isinstance(value, datetime) else value for value in key]
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, fields: Sequence[type]) -> tuple:
+    """Decodes a cursor whose key has one value per type in `fields` (datetime, int or str)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError("cursor for another key")
+        key = []
+        for value, field in zip(values, fields):
+            expected = int if field is datetime else field
+            if isinstance(value, bool) or not isinstance(value, expected):
+                raise ValueError("bad cursor fields")
+            key.append(from_epoch_us(value) if field is datetime else value)
+        return tuple(key)
+    except (ValueError, TypeError, OverflowError) as e:
+        raise InvalidCursor(str(e)) from e
@@ -1,12 +1,19 @@
 import os
+import time
 import urllib.parse
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from typing import Any, Dict
+from sqlalchemy import exc
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # Retrieve individual components from Environment Variables
 db_user = os.getenv("DB_USER", "postgres")
 db_pass = os.getenv("DB_PASSWORD", "supersecurepassword") # This comes from your Secret
 db_host = os.getenv("INSTANCE_CONNECTION_NAME", "localhost") 
+# Read replica of the trade-bot database (instance connection name or IP); unset = no replica
+trade_replica_host = os.getenv("TRADE_DB_REPLICA_HOST")
 NOWPAYMENTS_API_KEY = os.getenv("NOWPAYMENTS_API_KEY")
 NOWPAYMENTS_IPN_SECRET = os.getenv("NOWPAYMENTS_IPN_SECRET")
 
@@ -14,27 +21,118 @@ NOWPAYMENTS_IPN_SECRET = os.getenv("NOWPAYMENTS_IPN_SECRET")
 trade_db_name = os.getenv("DB_NAME_TRADE", "trade_bot_db")
 crypto_db_name = os.getenv("DB_NAME_CRYPTO", "crypto_backend_db")
 
+# --- Pool settings ---
+# Per engine, e.g. TRADE_DB_POOL_SIZE / CRYPTO_DB_POOL_SIZE. Keep the sum of
+# (pool size + overflow) x instances below the Cloud SQL connection limit.
+def pool_settings(prefix: str, pool_size: int, max_overflow: int) -> Dict[str, Any]:
+    return {
+        "pool_size": int(os.getenv(f"{prefix}_POOL_SIZE", str(pool_size))),
+        "max_overflow": int(os.getenv(f"{prefix}_MAX_OVERFLOW", str(max_overflow))),
+        # Seconds a request waits for a free connection before failing
+        "pool_timeout": float(os.getenv(f"{prefix}_POOL_TIMEOUT", "10")),
+        # Reconnect connections older than this many seconds (Cloud SQL drops idle ones)
+        "pool_recycle": int(os.getenv(f"{prefix}_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv(f"{prefix}_POOL_PRE_PING", "1") == "1",
+        # SQLAlchemy compiled statement cache entries
+        "query_cache_size": int(os.getenv(f"{prefix}_QUERY_CACHE_SIZE", "500")),
+    }
+
+# asyncpg prepared statements cached per connection by the SQLAlchemy dialect
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        # Includes opening a new connection and the pre-ping, when they happen
+        waited = time.perf_counter() - start
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return connection
+
+    def _create_connection(self):
+        self.connects += 1
+        return super()._create_connection()
+
+
+def pool_stats(engine: AsyncEngine) -> Dict[str, Any]:
+    pool = engine.pool
+    stats: Dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    if isinstance(pool, MeteredPool):
+        stats.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            connects=pool.connects,
+            avg_wait_ms=round(pool.wait_seconds / pool.checkouts * 1000, 3) if pool.checkouts else 0.0,
+            max_wait_ms=round(pool.max_wait_seconds * 1000, 3),
+        )
+    return stats
+
 # Function to build URL
-def get_db_url(db_name):
+def get_db_url(db_name, host=None):
+    host = host or db_host
     # Retrieve and URL-encode the password
     raw_pass = os.getenv("DB_PASSWORD", "supersecurepassword")
     encoded_pass = urllib.parse.quote_plus(raw_pass)  # <--- USE THIS
 
-    is_ip = "." in db_host and ":" not in db_host
+    is_ip = "." in host and ":" not in host
     if os.getenv("K_SERVICE") and not is_ip:
         # Use Unix Socket
-        return f"postgresql+asyncpg://{db_user}:{encoded_pass}@/{db_name}?host=/cloudsql/{db_host}"
+        return f"postgresql+asyncpg://{db_user}:{encoded_pass}@/{db_name}?host=/cloudsql/{host}&prepared_statement_cache_size={PREPARED_STATEMENT_CACHE_SIZE}"
     else:
         # Use TCP
-        return f"postgresql+asyncpg://{db_user}:{encoded_pass}@{db_host}/{db_name}"
+        return f"postgresql+asyncpg://{db_user}:{encoded_pass}@{host}/{db_name}?prepared_statement_cache_size={PREPARED_STATEMENT_CACHE_SIZE}"
 
 # Create Engines
-trade_bot_engine = create_async_engine(get_db_url(trade_db_name), echo=False)
-crypto_backend_engine = create_async_engine(get_db_url(crypto_db_name), echo=False)
+trade_bot_engine = create_async_engine(
+    get_db_url(trade_db_name), echo=False, poolclass=MeteredPool,
+    **pool_settings("TRADE_DB", pool_size=5, max_overflow=5),
+)
+crypto_backend_engine = create_async_engine(
+    get_db_url(crypto_db_name), echo=False, poolclass=MeteredPool,
+    **pool_settings("CRYPTO_DB", pool_size=2, max_overflow=3),
+)
+trade_replica_engine = create_async_engine(
+    get_db_url(trade_db_name, trade_replica_host), echo=False, poolclass=MeteredPool,
+    **pool_settings("TRADE_DB_REPLICA", pool_size=5, max_overflow=5),
+) if trade_replica_host else None
 
 # Create Sessions
 TradeBotSession = async_sessionmaker(trade_bot_engine, expire_on_commit=False)
 CryptoBackendSession = async_sessionmaker(crypto_backend_engine, expire_on_commit=False)
+TradeReplicaSession = async_sessionmaker(trade_replica_engine, expire_on_commit=False) if trade_replica_engine else None
 
 class Base(DeclarativeBase):
-    pass
\ No newline at end of file
+    pass
+
+# --- Dialect helpers ---
+# INSERT constructs with on_conflict_do_nothing / on_conflict_do_update
+_INSERT_BY_DIALECT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def dialect_insert(dialect_name: str):
+    """The dialect's insert() with ON CONFLICT support; ValueError where there is none."""
+    insert = _INSERT_BY_DIALECT.get(dialect_name)
+    if insert is None:
+        raise ValueError(f"ON CONFLICT is not supported for dialect '{dialect_name}'")
+    return insert
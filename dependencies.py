@@ -1,11 +1,17 @@
 from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import TradeBotSession, CryptoBackendSession
+from replica import trade_read_router
 
 async def get_trade_db() -> AsyncGenerator[AsyncSession, None]:
     async with TradeBotSession() as session:
         yield session
 
+async def get_trade_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Read-only trade-bot session: on the read replica when it is healthy, see replica.py."""
+    async with trade_read_router.session() as session:
+        yield session
+
 async def get_crypto_db() -> AsyncGenerator[AsyncSession, None]:
     async with CryptoBackendSession() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from buffer import PriceUpdateBuffer, price_buffer
+from database import TradeBotSession
+
+# Flush a bucket once it holds this many items...
+FLUSH_MAX_ITEMS = int(os.getenv("FLUSH_MAX_ITEMS", "5000"))
+# ...or once its oldest entry is this old, whichever comes first
+FLUSH_MAX_AGE_SECONDS = float(os.getenv("FLUSH_MAX_AGE_SECONDS", "30"))
+# How often the scheduler checks the thresholds
+FLUSH_CHECK_INTERVAL_SECONDS = float(os.getenv("FLUSH_CHECK_INTERVAL_SECONDS", "1"))
+BACKGROUND_FLUSH_ENABLED = os.getenv("BACKGROUND_FLUSH_ENABLED", "1") == "1"
+# With a shared buffer backend, how often rows staged by other instances are applied
+# when this instance has nothing due itself
+STAGING_APPLY_INTERVAL_SECONDS = float(os.getenv("STAGING_APPLY_INTERVAL_SECONDS", "5"))
+
+
+class BackgroundFlusher:
+    """
+    Periodically flushes buffer buckets that reached the size or age threshold.
+    """
+
+    def __init__(
+        self,
+        buffer: PriceUpdateBuffer,
+        session_factory,
+        max_items: int = FLUSH_MAX_ITEMS,
+        max_age: float = FLUSH_MAX_AGE_SECONDS,
+        check_interval: float = FLUSH_CHECK_INTERVAL_SECONDS,
+        apply_interval: float = STAGING_APPLY_INTERVAL_SECONDS,
+    ):
+        self.buffer = buffer
+        self.session_factory = session_factory
+        self.max_items = max_items
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.apply_interval = apply_interval
+        self._last_flush_time = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self._flushes = 0
+        self._errors = 0
+        self._flushed_items = 0
+        self._last_flush: Dict[str, Any] = {}
+        self._max_latency = 0.0
+        self._max_lag = 0.0
+
+    def due_buckets(self) -> List[Tuple[str, str]]:
+        return [
+            (bucket["server"], bucket["type"])
+            for bucket in self.buffer.bucket_stats()
+            if bucket["size"] > 0 and (bucket["size"] >= self.max_items or bucket["age"] >= self.max_age)
+        ]
+
+    async def flush_due(self) -> int:
+        """Flushes every bucket past a threshold. Returns the number of items written."""
+        due = self.due_buckets()
+        if not due:
+            shared = not self.buffer.backend.applies_directly
+            if not shared or time.monotonic() - self._last_flush_time < self.apply_interval:
+                return 0
+        return await self._flush(due)
+
+    async def drain(self) -> int:
+        """Flushes every non-empty bucket regardless of thresholds."""
+        pending = [
+            (bucket["server"], bucket["type"])
+            for bucket in self.buffer.bucket_stats()
+            if bucket["size"] > 0
+        ]
+        if not pending:
+            return 0
+        return await self._flush(pending)
+
+    async def _flush(self, buckets: List[Tuple[str, str]]) -> int:
+        lag = max(
+            (bucket["age"] for bucket in self.buffer.bucket_stats()
+             if (bucket["server"], bucket["type"]) in buckets),
+            default=0.0,
+        )
+
+        start = time.perf_counter()
+        async with self.session_factory() as db:
+            count = await self.buffer.flush(db, buckets)
+        latency = time.perf_counter() - start
+        self._last_flush_time = time.monotonic()
+
+        self._flushes += 1
+        self._flushed_items += count
+        self._max_latency = max(self._max_latency, latency)
+        self._max_lag = max(self._max_lag, lag)
+        self._last_flush = {
+            "buckets": [f"{server}/{type_}" for server, type_ in buckets],
+            "batch_size": count,
+            "latency_ms": round(latency * 1000, 2),
+            "lag_seconds": round(lag, 3),
+        }
+        return count
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.flush_due()
+            except Exception as e:
+                self._errors += 1
+                print(f"Error in background flush: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain: bool = True) -> int:
+        """Stops the scheduler and, by default, writes whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if drain:
+            return await self.drain()
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "max_items": self.max_items,
+            "max_age_seconds": self.max_age,
+            "flushes": self._flushes,
+            "errors": self._errors,
+            "flushed_items": self._flushed_items,
+            "avg_batch_size": round(self._flushed_items / self._flushes, 1) if self._flushes else 0,
+            "max_latency_ms": round(self._max_latency * 1000, 2),
+            "max_lag_seconds": round(self._max_lag, 3),
+            "last_flush": self._last_flush,
+        }
+
+
+price_flusher = BackgroundFlusher(price_buffer, TradeBotSession)
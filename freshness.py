@@ -0,0 +1,169 @@
+import os
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import models
+from price_block import PriceBlock, CITY_COUNT, NULL, to_epoch_us
+from storage import price_storage
+
+# Opt-in: the counters are loaded once and then only see this process's own
+# flushes, so they drift when other instances (or the shared staging backend)
+# write the tables. Enable only for single-instance deployments.
+FRESHNESS_COUNTERS_ENABLED = os.getenv("FRESHNESS_COUNTERS_ENABLED", "0") == "1"
+# Default "updated within" window of GET /items/prices-up-to-date
+FRESHNESS_WINDOW_HOURS = float(os.getenv("FRESHNESS_WINDOW_HOURS", "8"))
+# Longest window the counters can answer; larger windows fall back to SQL
+FRESHNESS_RETENTION_HOURS = float(os.getenv("FRESHNESS_RETENTION_HOURS", "24"))
+# Width of a time bucket; windows are accurate to one bucket
+FRESHNESS_BUCKET_SECONDS = int(os.getenv("FRESHNESS_BUCKET_SECONDS", "300"))
+
+# Stamp of a price that exists but has no <city>_updated_at (never "recent")
+_NO_STAMP = 0
+
+
+class _CityCounter:
+    """Items with a price, and items per update-time bucket, for one table column."""
+    __slots__ = ("total", "buckets")
+
+    def __init__(self):
+        self.total = 0
+        self.buckets: Dict[int, int] = {}
+
+
+class _FreshnessTable:
+    __slots__ = ("index", "stamps", "counters")
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        # Last update per item/city in epoch microseconds; NULL when there is no price
+        self.stamps: List[array] = [array("q") for _ in range(CITY_COUNT)]
+        self.counters = [_CityCounter() for _ in range(CITY_COUNT)]
+
+    def row(self, name: str) -> int:
+        row = self.index.get(name)
+        if row is None:
+            row = self.index[name] = len(self.index)
+            for column in self.stamps:
+                column.append(NULL)
+        return row
+
+
+class FreshnessCounters:
+    """
+    Per-city "has price" and "updated within the window" counts for every
+    (server, type) table, kept up to date by buffer flushes.
+
+    Each item/city update moves the item from the bucket of its previous
+    timestamp to the bucket of the new one, so a query only sums the buckets
+    newer than the cutoff: O(cities x buckets in window), independent of row count.
+    """
+
+    def __init__(
+        self,
+        retention_hours: float = FRESHNESS_RETENTION_HOURS,
+        bucket_seconds: int = FRESHNESS_BUCKET_SECONDS,
+    ):
+        self.retention_us = int(retention_hours * 3600 * 1_000_000)
+        self.bucket_us = bucket_seconds * 1_000_000
+        self._tables: Dict[Tuple[str, str], _FreshnessTable] = {}
+        self.loaded = False
+        self.load_seconds = 0.0
+
+    def _bucket(self, stamp_us: int) -> int:
+        return stamp_us // self.bucket_us
+
+    def _oldest_bucket(self, now_us: int) -> int:
+        return self._bucket(now_us - self.retention_us)
+
+    def _record(self, table: _FreshnessTable, row: int, city_idx: int, stamp_us: int, oldest_bucket: int):
+        counter = table.counters[city_idx]
+        previous = table.stamps[city_idx][row]
+        if previous == NULL:
+            counter.total += 1
+        else:
+            bucket = self._bucket(previous)
+            if bucket >= oldest_bucket and bucket in counter.buckets:
+                counter.buckets[bucket] -= 1
+                if not counter.buckets[bucket]:
+                    del counter.buckets[bucket]
+
+        bucket = self._bucket(stamp_us)
+        if bucket >= oldest_bucket:
+            counter.buckets[bucket] = counter.buckets.get(bucket, 0) + 1
+        table.stamps[city_idx][row] = stamp_us
+
+    def _expire(self, table: _FreshnessTable, now_us: int):
+        """Drops buckets that fell out of the retention period."""
+        oldest_bucket = self._oldest_bucket(now_us)
+        for counter in table.counters:
+            for bucket in [b for b in counter.buckets if b < oldest_bucket]:
+                del counter.buckets[bucket]
+
+    async def load(self, session_factory):
+        tables = {}
+        start = time.perf_counter()
+        oldest_bucket = self._oldest_bucket(to_epoch_us(datetime.now(timezone.utc)))
+
+        async with session_factory() as db:
+            for server, types in models.MODEL_MAP.items():
+                for type_ in types:
+                    table = tables[(server, type_)] = _FreshnessTable()
+                    block = (await price_storage.load_table(db, server, type_)).block
+                    for src_row, name in enumerate(block.names):
+                        row = table.row(name)
+                        for city_idx in range(CITY_COUNT):
+                            if block.prices[city_idx][src_row] == NULL:
+                                continue
+                            stamp_us = block.stamps[city_idx][src_row]
+                            if stamp_us == NULL:
+                                stamp_us = _NO_STAMP
+                            self._record(table, row, city_idx, stamp_us, oldest_bucket)
+
+        self._tables = tables
+        self.load_seconds = time.perf_counter() - start
+        self.loaded = True
+
+    def on_flush(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        if not self.loaded:
+            return
+        table = self._tables[(server, type_)]
+        oldest_bucket = self._oldest_bucket(to_epoch_us(flushed_at))
+        for src_row, name in enumerate(block.names):
+            row = None
+            for city_idx in range(CITY_COUNT):
+                if block.prices[city_idx][src_row] == NULL:
+                    continue
+                if row is None:
+                    row = table.row(name)
+                self._record(table, row, city_idx, block.stamps[city_idx][src_row], oldest_bucket)
+
+    def can_answer(self, window_hours: float) -> bool:
+        return self.loaded and window_hours * 3600 * 1_000_000 <= self.retention_us
+
+    def counts(self, server: str, type_: str, window_hours: float, now: Optional[datetime] = None) -> List[Tuple[int, int]]:
+        """(items with a price, items updated within the window) per city, in models.CITIES order."""
+        now_us = to_epoch_us(now or datetime.now(timezone.utc))
+        table = self._tables[(server, type_)]
+        self._expire(table, now_us)
+        first_bucket = self._bucket(now_us - int(window_hours * 3600 * 1_000_000))
+
+        return [
+            (
+                counter.total,
+                sum(count for bucket, count in counter.buckets.items() if bucket >= first_bucket),
+            )
+            for counter in table.counters
+        ]
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "load_seconds": round(self.load_seconds, 3),
+            "retention_hours": self.retention_us / 3600 / 1_000_000,
+            "bucket_seconds": self.bucket_us // 1_000_000,
+        }
+
+
+freshness_counters = FreshnessCounters()
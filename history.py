@@ -0,0 +1,268 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import TradeBotSession
+from database import dialect_insert
+from storage import cached_statement
+from price_block import PriceBlock, NULL, from_epoch_us
+
+# Off by default: every flush then writes a tick per city price plus three
+# candle upserts to the primary
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "0") == "1"
+# How often flushed blocks are written out as ticks and rolled up
+HISTORY_WRITE_INTERVAL_SECONDS = float(os.getenv("HISTORY_WRITE_INTERVAL_SECONDS", "5"))
+# Rows sent per executemany() call
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "1000"))
+# Raw ticks older than this are deleted; candles are kept
+HISTORY_TICK_RETENTION_DAYS = float(os.getenv("HISTORY_TICK_RETENTION_DAYS", "30"))
+# Flushed blocks held while the database is unavailable; older ones are discarded
+HISTORY_MAX_PENDING_BLOCKS = int(os.getenv("HISTORY_MAX_PENDING_BLOCKS", "1000"))
+
+RESOLUTIONS = {
+    "5m": 5 * 60 * 1_000_000,
+    "1h": 3600 * 1_000_000,
+    "1d": 86400 * 1_000_000,
+}
+
+_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def build_candle_upsert(dialect_name: str):
+    """
+    INSERT ... ON CONFLICT DO UPDATE that merges a partial candle into the stored one:
+    the earliest tick gives the open, the latest the close.
+    """
+    def build():
+        table = models.PriceCandle.__table__
+        stmt = dialect_insert(dialect_name)(table)
+        new, old = stmt.excluded, table.c
+        return stmt.on_conflict_do_update(
+            index_elements=[old.server, old.type, old.unique_name, old.city, old.resolution, old.bucket_start],
+            set_={
+                "open": case((new.open_at < old.open_at, new.open), else_=old.open),
+                "open_at": case((new.open_at < old.open_at, new.open_at), else_=old.open_at),
+                "close": case((new.close_at >= old.close_at, new.close), else_=old.close),
+                "close_at": case((new.close_at >= old.close_at, new.close_at), else_=old.close_at),
+                "high": case((new.high > old.high, new.high), else_=old.high),
+                "low": case((new.low < old.low, new.low), else_=old.low),
+                "ticks": old.ticks + new.ticks,
+            },
+        )
+
+    return cached_statement(("upsert", dialect_name, models.PriceCandle.__tablename__), build)
+
+
+class HistoryRecorder:
+    """
+    Keeps the price history. The flush listener only queues the flushed block,
+    so the flush itself pays nothing; a background task writes the queued
+    blocks as PriceTick rows and merges them into the 5m/1h/1d candles.
+
+    One tick is written per item/city per flush: updates merged in the buffer
+    before a flush are not kept individually.
+    """
+
+    def __init__(self, session_factory=None, write_interval: float = HISTORY_WRITE_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.write_interval = write_interval
+        self._pending: List[Tuple[str, str, PriceBlock]] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+
+        # Stats
+        self.ticks_written = 0
+        self.candles_written = 0
+        self.discarded_blocks = 0
+        self.errors = 0
+
+    def on_flush(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        # The buffer never touches a block again once it is flushed
+        self._pending.append((server, type_, block))
+        self._discard_overflow()
+
+    def _discard_overflow(self):
+        """Drops the oldest blocks beyond HISTORY_MAX_PENDING_BLOCKS."""
+        overflow = len(self._pending) - HISTORY_MAX_PENDING_BLOCKS
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.discarded_blocks += overflow
+
+    async def write_pending(self, db: AsyncSession) -> int:
+        """Writes queued blocks as ticks and candles in one transaction. Returns the tick count."""
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+
+            ticks: List[Dict[str, Any]] = []
+            candles: Dict[tuple, List[Any]] = {}
+            datetimes: Dict[int, datetime] = {}
+
+            def to_datetime(stamp_us):
+                value = datetimes.get(stamp_us)
+                if value is None:
+                    value = datetimes[stamp_us] = from_epoch_us(stamp_us)
+                return value
+
+            for server, type_, block in pending:
+                for city_idx, city in enumerate(models.CITIES):
+                    prices, stamps = block.prices[city_idx], block.stamps[city_idx]
+                    for row, name in enumerate(block.names):
+                        price = prices[row]
+                        if price == NULL:
+                            continue
+                        stamp = stamps[row]
+                        ticks.append({
+                            "server": server, "type": type_, "unique_name": name,
+                            "city": city, "ts": to_datetime(stamp), "price": price,
+                        })
+                        for resolution, width in RESOLUTIONS.items():
+                            _add_to_candle(candles, (server, type_, name, city, resolution, stamp - stamp % width), price, stamp)
+
+            candle_rows = [
+                {
+                    "server": server, "type": type_, "unique_name": name, "city": city,
+                    "resolution": resolution, "bucket_start": to_datetime(bucket),
+                    "open": candle[0], "open_at": to_datetime(candle[1]),
+                    "high": candle[2], "low": candle[3],
+                    "close": candle[4], "close_at": to_datetime(candle[5]),
+                    "ticks": candle[6],
+                }
+                for (server, type_, name, city, resolution, bucket), candle in candles.items()
+            ]
+
+            try:
+                tick_stmt = models.PriceTick.__table__.insert()
+                candle_stmt = build_candle_upsert(db.get_bind().dialect.name)
+                for start in range(0, len(ticks), HISTORY_BATCH_SIZE):
+                    await db.execute(tick_stmt, ticks[start:start + HISTORY_BATCH_SIZE])
+                for start in range(0, len(candle_rows), HISTORY_BATCH_SIZE):
+                    await db.execute(candle_stmt, candle_rows[start:start + HISTORY_BATCH_SIZE])
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                # Retried on the next run, ahead of anything flushed since
+                self._pending[:0] = pending
+                self._discard_overflow()
+                raise
+
+            self.ticks_written += len(ticks)
+            self.candles_written += len(candle_rows)
+            return len(ticks)
+
+    async def prune(self, db: AsyncSession, now: Optional[datetime] = None) -> int:
+        """Deletes ticks past the retention period."""
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=HISTORY_TICK_RETENTION_DAYS)
+        result = await db.execute(delete(models.PriceTick).where(models.PriceTick.ts < cutoff))
+        await db.commit()
+        return result.rowcount
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.write_interval)
+            try:
+                async with self.session_factory() as db:
+                    await self.write_pending(db)
+                    if time.monotonic() - self._last_prune >= _PRUNE_INTERVAL_SECONDS:
+                        self._last_prune = time.monotonic()
+                        await self.prune(db)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error writing price history: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain: bool = True) -> int:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if drain and self._pending:
+            async with self.session_factory() as db:
+                return await self.write_pending(db)
+        return 0
+
+    def clear(self):
+        self._pending = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "pending_blocks": len(self._pending),
+            "ticks_written": self.ticks_written,
+            "candles_written": self.candles_written,
+            "discarded_blocks": self.discarded_blocks,
+            "errors": self.errors,
+        }
+
+
+def _add_to_candle(candles: Dict[tuple, List[Any]], key: tuple, price: int, stamp: int):
+    # [open, open_at, high, low, close, close_at, ticks]
+    candle = candles.get(key)
+    if candle is None:
+        candles[key] = [price, stamp, price, price, price, stamp, 1]
+        return
+    if stamp < candle[1]:
+        candle[0], candle[1] = price, stamp
+    if stamp >= candle[5]:
+        candle[4], candle[5] = price, stamp
+    candle[2] = max(candle[2], price)
+    candle[3] = min(candle[3], price)
+    candle[6] += 1
+
+
+async def query_series(
+    db: AsyncSession,
+    server: str,
+    type_: str,
+    unique_name: str,
+    city: str,
+    resolution: str,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """Candles (or raw ticks for resolution 'raw') of one item/city, oldest first."""
+    if resolution == "raw":
+        model = models.PriceTick
+        time_column = model.ts
+        columns = [model.ts, model.price]
+    else:
+        model = models.PriceCandle
+        time_column = model.bucket_start
+        columns = [model.bucket_start, model.open, model.high, model.low, model.close, model.ticks]
+
+    stmt = select(*columns).where(
+        model.server == server,
+        model.type == type_,
+        model.unique_name == unique_name,
+        model.city == city,
+    )
+    if resolution != "raw":
+        stmt = stmt.where(model.resolution == resolution)
+    if start is not None:
+        stmt = stmt.where(time_column >= start)
+    if end is not None:
+        stmt = stmt.where(time_column < end)
+
+    # Latest `limit` points, returned oldest first
+    stmt = stmt.order_by(time_column.desc()).limit(limit)
+    result = await db.execute(stmt)
+    return [dict(row) for row in reversed(result.mappings().all())]
+
+
+price_history = HistoryRecorder(TradeBotSession)
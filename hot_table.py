@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import models
+from price_block import PriceBlock, PriceTable, CITY_INDEX, NULL, from_epoch_us, to_epoch_us
+from storage import price_storage
+
+HOT_TABLE_ENABLED = os.getenv("HOT_TABLE_ENABLED", "0") == "1"
+
+
+def _value(value: int) -> Optional[int]:
+    return None if value == NULL else value
+
+
+def _datetime(value: int) -> Optional[datetime]:
+    return None if value == NULL else from_epoch_us(value)
+
+
+class HotPriceTable:
+    """
+    In-memory copy of every MODEL_MAP table, loaded once at startup and patched
+    by each buffer flush. When loaded, GET /items/ is answered from it and the
+    database is only the durable store.
+    """
+
+    def __init__(self):
+        self._tables: Dict[Tuple[str, str], PriceTable] = {}
+        self.loaded = False
+        self.load_seconds = 0.0
+
+    async def load(self, session_factory):
+        tables = {}
+        start = time.perf_counter()
+        async with session_factory() as db:
+            for server, types in models.MODEL_MAP.items():
+                for type_ in types:
+                    tables[(server, type_)] = await price_storage.load_table(db, server, type_)
+        self.load_seconds = time.perf_counter() - start
+        self._tables = tables
+        self.loaded = True
+
+    def on_flush(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        if not self.loaded:
+            return
+        table = self._tables[(server, type_)]
+        flushed_us = to_epoch_us(flushed_at)
+        for name in block.names:
+            table.updated[table.row(name)] = flushed_us
+        table.block.merge(block)
+
+    def block(self, server: str, type_: str) -> PriceBlock:
+        return self._tables[(server, type_)].block
+
+    def table(self, server: str, type_: str) -> PriceTable:
+        return self._tables[(server, type_)]
+
+    def query(
+        self, server: str, type_: str, item_names: Optional[List[str]], city_slugs: Optional[List[str]]
+    ) -> List[Dict[str, Any]]:
+        """Same rows and keys as the SQL path of get_prices."""
+        table = self._tables[(server, type_)]
+        block = table.block
+
+        if item_names:
+            rows = []
+            seen = set()
+            for name in item_names:
+                row = block.index.get(name)
+                if row is not None and row not in seen:
+                    seen.add(row)
+                    rows.append(row)
+        else:
+            rows = range(len(block))
+
+        data = []
+        if city_slugs:
+            cities = [(city, CITY_INDEX[city]) for city in city_slugs]
+            for row in rows:
+                item = {"unique_name": block.names[row]}
+                for city, city_idx in cities:
+                    item[f"price_{city}"] = _value(block.prices[city_idx][row])
+                    item[f"{city}_updated_at"] = _datetime(block.stamps[city_idx][row])
+                data.append(item)
+        else:
+            # Column order of the table itself
+            for row in rows:
+                item = {"unique_name": block.names[row]}
+                for city_idx, city in enumerate(models.CITIES):
+                    item[f"price_{city}"] = _value(block.prices[city_idx][row])
+                for city_idx, city in enumerate(models.CITIES):
+                    item[f"{city}_updated_at"] = _datetime(block.stamps[city_idx][row])
+                item["updated_at"] = _datetime(table.updated[row])
+                data.append(item)
+        return data
+
+    def memory_bytes(self) -> Dict[str, int]:
+        columns = 0
+        index = 0
+        for table in self._tables.values():
+            columns += table.block.nbytes() + table.updated.itemsize * len(table.updated)
+            index += sys.getsizeof(table.block.index) + sys.getsizeof(table.block.names)
+            index += sum(sys.getsizeof(name) for name in table.block.names)
+        return {"columns": columns, "index": index, "total": columns + index}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "load_seconds": round(self.load_seconds, 3),
+            "rows": {f"{server}/{type_}": len(table.block) for (server, type_), table in self._tables.items()},
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+hot_table = HotPriceTable()
@@ -0,0 +1,120 @@
+"""
+One pooled outbound HTTP client for the OAuth providers and NOWPayments.
+
+`main.lifespan` starts it and closes it on shutdown, so logins and checkouts
+reuse kept-alive connections (HTTP/2 when the `h2` package is installed)
+instead of paying for a TLS handshake on every request. Each provider has its
+own timeout.
+
+Failed calls are retried at most HTTP_RETRIES times, with exponential backoff:
+- GETs on any transport error and on 429/502/503/504;
+- POSTs only when the connection was never made (the OAuth code exchange is
+  single-use and the NOWPayments invoice call is not idempotent).
+
+Tests pass an httpx.MockTransport to `start()` to stub the providers.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:  # falls back to HTTP/1.1 keep-alive
+    HTTP2_AVAILABLE = False
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF_SECONDS = float(os.getenv("HTTP_RETRY_BACKOFF_SECONDS", "0.2"))
+
+OAUTH_TIMEOUT_SECONDS = float(os.getenv("OAUTH_TIMEOUT_SECONDS", "10"))
+NOWPAYMENTS_TIMEOUT_SECONDS = float(os.getenv("NOWPAYMENTS_TIMEOUT_SECONDS", "30"))
+
+PROVIDER_TIMEOUTS = {
+    "discord": httpx.Timeout(OAUTH_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    "google": httpx.Timeout(OAUTH_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    "nowpayments": httpx.Timeout(NOWPAYMENTS_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUSES = {429, 502, 503, 504}
+# The request never left this process, so resending cannot apply it twice
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class HTTPClient:
+    def __init__(self, retries: Optional[int] = None, backoff: Optional[float] = None):
+        self.retries = retries
+        self.backoff = backoff
+        self._client: Optional[httpx.AsyncClient] = None
+        # Stats, per provider
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def start(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+        """Opens the shared client; a no-op when already open. `transport` replaces the network (tests)."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                ),
+                transport=transport,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    def _count(self, provider: str, field: str):
+        counts = self.counts.setdefault(provider, {"requests": 0, "retries": 0, "failures": 0})
+        counts[field] += 1
+
+    async def request(self, provider: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Sends one request with the provider's timeout, retrying what is safe to retry."""
+        # Started lazily where the lifespan does not run (scripts, ASGI test clients)
+        client = self.start()
+        retries = HTTP_RETRIES if self.retries is None else self.retries
+        backoff = HTTP_RETRY_BACKOFF_SECONDS if self.backoff is None else self.backoff
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        self._count(provider, "requests")
+
+        attempt = 0
+        while True:
+            try:
+                resp = await client.request(method, url, timeout=PROVIDER_TIMEOUTS[provider], **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= retries or not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    self._count(provider, "failures")
+                    raise
+                print(f"{provider} {method} {url} failed ({e!r}), retrying")
+            else:
+                if attempt >= retries or not (idempotent and resp.status_code in RETRY_STATUSES):
+                    return resp
+            self._count(provider, "retries")
+            await asyncio.sleep(backoff * 2 ** attempt)
+            attempt += 1
+
+    async def get(self, provider: str, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request(provider, "GET", url, **kwargs)
+
+    async def post(self, provider: str, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request(provider, "POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self._client is not None,
+            "http2": HTTP2_AVAILABLE,
+            "providers": {provider: dict(counts) for provider, counts in self.counts.items()},
+        }
+
+
+http_client = HTTPClient()
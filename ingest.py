@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import struct
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from buffer import PriceUpdateBuffer
+from storage import PRICE_FIELDS
+from price_block import MAX_PRICE
+
+try:
+    import msgpack
+except ImportError:  # msgpack uploads are rejected with 415 when it is missing
+    msgpack = None
+
+# Largest single NDJSON line / msgpack frame accepted
+STREAM_MAX_ROW_BYTES = int(os.getenv("STREAM_MAX_ROW_BYTES", str(64 * 1024)))
+# Rows handed to the buffer at a time
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "2000"))
+# Rejected rows echoed back in the response
+MAX_REPORTED_ERRORS = 20
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+MSGPACK_CONTENT_TYPES = {"application/x-msgpack", "application/msgpack", "application/vnd.msgpack"}
+
+_ALLOWED_FIELDS = frozenset(PRICE_FIELDS) | {"unique_name"}
+_FRAME_HEADER = struct.Struct(">I")
+# Integer strings pydantic's lax int mode accepts: "12", " +12 ", "1_000", "12.00"
+_INT_STRING = re.compile(r"\s*\+?(\d+(?:_\d+)*)(?:\.0+)?\s*", re.ASCII)
+
+
+class StreamFormatError(Exception):
+    pass
+
+
+class RowTooLargeError(Exception):
+    pass
+
+
+class StreamAborted(Exception):
+    """Upload stopped part-way; rows accepted before the error stay buffered."""
+
+    def __init__(self, status_code: int, reason: str, result: Dict[str, Any]):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.result = result
+
+
+class _Invalid:
+    """Placeholder for a row that could not be decoded."""
+    __slots__ = ("reason",)
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+def validate_row(obj: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Fast-path version of ItemPriceUpdate validation for one decoded row.
+    Like the model, unknown fields are dropped and prices may be ints,
+    integral floats or integer strings. Stricter on purpose: booleans are
+    not prices and unique_name must not be empty.
+    Returns (row, None) when valid, or (None, reason).
+    """
+    if not isinstance(obj, dict):
+        return None, "row is not an object"
+
+    name = obj.get("unique_name")
+    if not isinstance(name, str) or not name:
+        return None, "unique_name must be a non-empty string"
+
+    row = {"unique_name": name}
+    for key, value in obj.items():
+        if key not in _ALLOWED_FIELDS or key == "unique_name":
+            continue
+        if value is None:
+            row[key] = None
+            continue
+        # bool is an int subclass, but never a price
+        if type(value) is not int:
+            digits = _INT_STRING.fullmatch(value) if isinstance(value, str) else None
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            elif digits:
+                value = int(digits.group(1))
+            else:
+                return None, f"{key} must be an integer"
+        if not 0 <= value <= MAX_PRICE:
+            return None, f"{key} must be between 0 and {MAX_PRICE}"
+        row[key] = value
+
+    return row, None
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_row_bytes: Optional[int] = None):
+    """Yields one decoded object per non-empty line."""
+    max_row_bytes = max_row_bytes or STREAM_MAX_ROW_BYTES
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_row_bytes:
+            raise RowTooLargeError(f"Line exceeds {max_row_bytes} bytes")
+        for line in lines:
+            if line.strip():
+                yield _decode_json(line)
+    if pending.strip():
+        yield _decode_json(pending)
+
+
+def _decode_json(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return _Invalid("invalid JSON")
+
+
+async def iter_msgpack_frames(chunks: AsyncIterator[bytes], max_row_bytes: Optional[int] = None):
+    """Yields one decoded object per frame: a 4-byte big-endian length followed by a msgpack map."""
+    max_row_bytes = max_row_bytes or STREAM_MAX_ROW_BYTES
+    pending = bytearray()
+    async for chunk in chunks:
+        pending += chunk
+        offset = 0
+        while len(pending) - offset >= _FRAME_HEADER.size:
+            (length,) = _FRAME_HEADER.unpack_from(pending, offset)
+            if length > max_row_bytes:
+                raise RowTooLargeError(f"Frame exceeds {max_row_bytes} bytes")
+            end = offset + _FRAME_HEADER.size + length
+            if end > len(pending):
+                break
+            yield _decode_msgpack(bytes(pending[offset + _FRAME_HEADER.size:end]))
+            offset = end
+        del pending[:offset]
+    if pending:
+        raise StreamFormatError("Truncated msgpack frame at end of body")
+
+
+def _decode_msgpack(frame: bytes):
+    try:
+        return msgpack.unpackb(frame, raw=False)
+    except Exception:
+        return _Invalid("invalid msgpack")
+
+
+def select_decoder(content_type: Optional[str]):
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson
+    if media_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise StreamFormatError("msgpack uploads are not available on this server")
+        return iter_msgpack_frames
+    raise StreamFormatError(
+        "Unsupported Content-Type; use application/x-ndjson or application/x-msgpack"
+    )
+
+
+async def ingest_stream(
+    buffer: PriceUpdateBuffer,
+    server: str,
+    type_: str,
+    chunks: AsyncIterator[bytes],
+    decoder,
+    chunk_rows: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Decodes, validates and buffers rows as they arrive. At most `chunk_rows`
+    validated rows are held before being merged into the buffer.
+    """
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    accepted = 0
+    rejected = 0
+    errors: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+
+    async def buffer_pending():
+        nonlocal accepted, pending
+        if pending:
+            await buffer.add_rows(server, type_, pending)
+            accepted += len(pending)
+            pending = []
+
+    line = 0
+    try:
+        async for obj in decoder(chunks):
+            line += 1
+            if isinstance(obj, _Invalid):
+                row, reason = None, obj.reason
+            else:
+                row, reason = validate_row(obj)
+
+            if row is None:
+                rejected += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": line, "error": reason})
+                continue
+
+            pending.append(row)
+            if len(pending) >= chunk_rows:
+                await buffer_pending()
+    except (RowTooLargeError, StreamFormatError) as e:
+        await buffer_pending()
+        status_code = 413 if isinstance(e, RowTooLargeError) else 400
+        raise StreamAborted(status_code, str(e), {"accepted": accepted, "rejected": rejected, "errors": errors})
+
+    await buffer_pending()
+    return {"accepted": accepted, "rejected": rejected, "errors": errors}
@@ -0,0 +1,50 @@
+"""
+Keyset pagination for GET /invoices/, newest first.
+
+Pages are ordered by (created_at, id) descending and the cursor is the key
+of the last invoice returned, so page N costs the same index range scan as
+page 1 (ix_Invoice_created_at_id, or ix_Invoice_user_id_created_at_id for
+one user) instead of skipping N * limit rows. Cursors stay valid while new
+invoices arrive: those sort before the cursor and never shift later pages.
+
+The body stays the bare list it was before cursors, and the next cursor
+travels in the X-Next-Cursor header. `offset` still works for clients
+written before cursors; it is deprecated and will be removed.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from cursors import decode_cursor, encode_cursor
+
+ORDER = (models.Invoice.created_at.desc(), models.Invoice.id.desc())
+
+
+async def fetch_page(
+    db: AsyncSession, user_id: Optional[int], cursor: Optional[str], limit: int
+) -> Tuple[List[models.Invoice], Optional[str]]:
+    """(invoices, cursor of the next page or None when this is the last one)."""
+    invoice = models.Invoice
+    stmt = select(invoice).order_by(*ORDER).limit(limit + 1)
+    if user_id:
+        stmt = stmt.where(invoice.user_id == user_id)
+    if cursor:
+        stmt = stmt.where(tuple_(invoice.created_at, invoice.id) < tuple_(*decode_cursor(cursor, (datetime, int))))
+
+    rows = (await db.execute(stmt)).scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not has_more:
+        return rows, None
+    return rows, encode_cursor((rows[-1].created_at, rows[-1].id))
+
+
+async def fetch_offset_page(db: AsyncSession, user_id: Optional[int], offset: int, limit: int) -> List[models.Invoice]:
+    """Offset paging, for clients written before cursors."""
+    stmt = select(models.Invoice).order_by(*ORDER).offset(offset).limit(limit)
+    if user_id:
+        stmt = stmt.where(models.Invoice.user_id == user_id)
+    return (await db.execute(stmt)).scalars().all()
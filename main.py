@@ -1,29 +1,93 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, case, and_
+from sqlalchemy import select
 from typing import List, Optional, Literal
 from datetime import datetime, timedelta, timezone
+import asyncio
 import random 
 
 import models, dependencies
 from schemas import *
 from buffer import price_buffer
-from database import trade_bot_engine, crypto_backend_engine
+from flusher import price_flusher, BACKGROUND_FLUSH_ENABLED
+from cache import price_cache, MISSING
+from hot_table import hot_table, HOT_TABLE_ENABLED
+from storage import price_storage
+from snapshot import snapshot_store
+from history import price_history, HISTORY_ENABLED
+from price_stream import price_stream, DROPPED, PRICE_STREAM_SEND_TIMEOUT_SECONDS
+from freshness import freshness_counters, FRESHNESS_COUNTERS_ENABLED, FRESHNESS_WINDOW_HOURS
+from database import trade_bot_engine, crypto_backend_engine, trade_replica_engine, TradeBotSession, pool_stats
+from replica import trade_read_router
+from singleflight import SingleFlight
+from user_cache import user_cache, subscription_status
+from http_client import http_client
 import auth
 import payments
+import ingest
+import arbitrage
+import snapshot
+import changes
+import history
+import invoices
+import cursors
 
 # --- LIFESPAN (Startup & Shutdown) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Startup: Service is starting...")
+    if price_buffer.wal is not None:
+        replayed = price_buffer.replay_wal()
+        print(f"Startup: Replayed {replayed} WAL records into the price buffer")
+    if HOT_TABLE_ENABLED:
+        await hot_table.load(TradeBotSession)
+        stats = hot_table.stats()
+        print(
+            f"Startup: Hot price table loaded {sum(stats['rows'].values())} rows "
+            f"in {stats['load_seconds']}s ({stats['memory_bytes']['total'] / 2**20:.1f} MiB)"
+        )
+    if FRESHNESS_COUNTERS_ENABLED:
+        await freshness_counters.load(TradeBotSession)
+        print(f"Startup: Freshness counters loaded in {freshness_counters.load_seconds:.3f}s")
+    if BACKGROUND_FLUSH_ENABLED:
+        price_flusher.start()
+    if HISTORY_ENABLED:
+        price_history.start()
+    http_client.start()
     yield 
+    print("Shutdown: Draining price buffer...")
+    drained = await price_flusher.stop()
+    print(f"Shutdown: Flushed {drained} buffered items")
+    if HISTORY_ENABLED:
+        written = await price_history.stop()
+        print(f"Shutdown: Wrote {written} price history ticks")
+    await http_client.close()
     print("Shutdown: Closing database connections...")
     await trade_bot_engine.dispose()
     await crypto_backend_engine.dispose()
+    if trade_replica_engine is not None:
+        await trade_replica_engine.dispose()
 
 app = FastAPI(title="Trade Bot & Crypto Backend", lifespan=lifespan)
 
+price_buffer.add_flush_listener(price_cache.on_flush)
+price_buffer.add_flush_listener(hot_table.on_flush)
+price_buffer.add_flush_listener(freshness_counters.on_flush)
+price_buffer.add_flush_listener(price_stream.on_flush)
+if HISTORY_ENABLED:
+    price_buffer.add_flush_listener(price_history.on_flush)
+
+# --- Request coalescing ---
+# Concurrent identical DB reads share one query and one serialized body
+prices_flight = SingleFlight()
+freshness_flight = SingleFlight()
+
+def json_body(data) -> bytes:
+    return JSONResponse(jsonable_encoder(data)).body
+
 app.include_router(auth.router, tags=["Auth"])
 app.include_router(payments.router, tags=["Payments"])
 
@@ -50,6 +114,28 @@ async def update_price(
     await price_buffer.add_updates(server, type, updates)
     return {"message": "Updates queued", "server": server, "type": type}
 
+@app.put("/items/prices/stream", tags=["Trade Bot"])
+async def update_price_stream(
+    request: Request,
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    type: ItemType = Query(..., description="Type of item price: 'fast' or 'order'")
+):
+    """
+    Bulk upload read incrementally: NDJSON (one ItemPriceUpdate object per line)
+    or msgpack maps each prefixed with a 4-byte big-endian length.
+    """
+    try:
+        decoder = ingest.select_decoder(request.headers.get("content-type"))
+    except ingest.StreamFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    try:
+        result = await ingest.ingest_stream(price_buffer, server, type, request.stream(), decoder)
+    except ingest.StreamAborted as e:
+        raise HTTPException(status_code=e.status_code, detail={"error": e.reason, **e.result})
+
+    return {"message": "Updates queued", "server": server, "type": type, **result}
+
 @app.post("/system/flush-buffer", tags=["System"])
 async def flush_buffer_endpoint(
     db: AsyncSession = Depends(dependencies.get_trade_db)
@@ -59,106 +145,268 @@ async def flush_buffer_endpoint(
         return {"status": "skipped", "message": "Buffers were empty"}
     return {"status": "success", "flushed_items": count}
 
-@app.get("/items/", tags=["Trade Bot"])
+@app.get("/system/stats", tags=["System"])
+async def system_stats():
+    return {
+        "buffer": price_buffer.bucket_stats(),
+        "buffer_backend": price_buffer.backend.stats(),
+        "buffer_failed_flushes": price_buffer.failed_flushes,
+        "wal": price_buffer.wal.stats() if price_buffer.wal is not None else None,
+        "flusher": price_flusher.stats(),
+        "price_cache": price_cache.stats(),
+        "hot_table": hot_table.stats(),
+        "freshness_counters": freshness_counters.stats(),
+        "price_stream": price_stream.stats(),
+        "price_history": price_history.stats(),
+        "db_pools": {
+            "trade": pool_stats(trade_bot_engine),
+            "trade_replica": pool_stats(trade_replica_engine) if trade_replica_engine is not None else None,
+            "crypto": pool_stats(crypto_backend_engine),
+        },
+        "read_replica": trade_read_router.stats(),
+        "user_cache": user_cache.stats(),
+        "token_cache": auth.token_cache_stats(),
+        "http_client": http_client.stats(),
+        "single_flight": {"items": prices_flight.stats(), "prices_up_to_date": freshness_flight.stats()},
+    }
+
+@app.get("/items/", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
 async def get_prices(
     server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
     item_names: Optional[List[str]] = Query(None),
     cities: Optional[List[str]] = Query(None, description="List of cities (e.g. 'lymhurst')"),
     type: ItemType = Query("fast", description="Which table to query"),
+    # Primary, not replica: a miss right after a flush fills the cache under the new
+    # generation, and a lagging replica would pin pre-flush rows there for the TTL
     db: AsyncSession = Depends(dependencies.get_trade_db)
 ):
-    # Select the correct model dynamically
-    target_model = models.MODEL_MAP[server][type]
-    
-    selected_columns = [target_model.unique_name]
-    
+    city_slugs = []
     if cities:
         for city in cities:
             city_slug = city.lower().replace(" ", "_")
-            price_col = getattr(target_model, f"price_{city_slug}", None)
-            updated_col = getattr(target_model, f"{city_slug}_updated_at", None)
-
-            if not price_col:
+            if city_slug not in models.CITIES:
                 raise HTTPException(status_code=400, detail=f"Invalid city: {city}")
+            city_slugs.append(city_slug)
 
-            selected_columns.append(price_col)
-            selected_columns.append(updated_col)
-            
-        stmt = select(*selected_columns)
-    else:
-        stmt = select(target_model)
+    if hot_table.loaded:
+        return hot_table.query(server, type, item_names, city_slugs)
 
-    if item_names:
-        stmt = stmt.where(target_model.unique_name.in_(item_names))
-    
-    result = await db.execute(stmt)
+    cache_key = price_cache.make_key(server, type, item_names, city_slugs)
+    cached = price_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
+    generation = price_cache.generation(server, type)
 
-    if cities:
-        data = []
-        rows = result.all()
-        for row in rows:
-            item_data = {"unique_name": row[0]}
-            current_idx = 1 
-            for city in cities:
-                city_slug = city.lower().replace(" ", "_")
-                item_data[f"price_{city_slug}"] = row[current_idx]
-                item_data[f"{city_slug}_updated_at"] = row[current_idx + 1]
-                current_idx += 2
-            data.append(item_data)
-        return data
-    else:
-        return result.scalars().all()
+    async def query():
+        data = await price_storage.read_prices(db, server, type, item_names, city_slugs)
+        price_cache.set(cache_key, data, generation)
+        return json_body(data)
 
-@app.get("/items/prices-up-to-date", tags=["Trade Bot"])
-async def get_prices_up_to_date(
+    # Keyed by generation too: a request arriving after a flush does not join a read from before it
+    body = await prices_flight.do((cache_key, generation), query)
+    return Response(content=body, media_type="application/json")
+
+@app.get("/items/changes", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
+async def get_price_changes(
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    type: ItemType = Query("fast", description="Which table to query"),
+    since: Optional[str] = Query(None, description="Cursor from the previous response; omit to page the whole table"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: AsyncSession = Depends(dependencies.get_trade_read_db)
+):
+    """
+    Rows touched by flushes after `since`, oldest first. Keep the returned
+    cursor and pass it back; while `has_more` is true, request again at once.
+    """
+    try:
+        page = await changes.fetch_changes(db, price_storage, server, type, since, limit)
+    except cursors.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"server": server, "type": type, **page}
+
+@app.websocket("/items/stream")
+async def stream_prices(
+    websocket: WebSocket,
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    type: ItemType = Query("fast", description="Which table to follow"),
+    item_names: Optional[List[str]] = Query(None),
+    cities: Optional[List[str]] = Query(None, description="List of cities (e.g. 'lymhurst')"),
+    token: Optional[str] = Query(None, description="Access token, if not sent as an Authorization: Bearer header"),
+):
+    """
+    Pushes one JSON message per flush that touched the subscribed items,
+    holding only their changed city prices. Clients that fall behind are
+    disconnected with code 1013 and should reconnect and resync.
+
+    With the subscription gate on, the handshake needs a token like the other
+    trade endpoints, and the stream closes with 1008 when the token or the
+    subscription runs out.
+    """
+    access_until = None
+    if auth.SUBSCRIPTION_GATE_ENABLED:
+        try:
+            claims = auth.check_subscription(auth.websocket_credentials(websocket, token))
+        except HTTPException as e:
+            await websocket.close(code=1008, reason=e.detail)
+            return
+        access_until = min(claims["exp"], claims["sub_until"])
+
+    city_slugs = [city.lower().replace(" ", "_") for city in cities or []]
+    if any(slug not in models.CITIES for slug in city_slugs):
+        await websocket.close(code=1008, reason="Invalid city")
+        return
+
+    await websocket.accept()
+    subscriber = price_stream.subscribe(server, type, item_names, city_slugs)
+
+    async def pump():
+        while True:
+            message = await subscriber.get()
+            if message is DROPPED:
+                await websocket.close(code=1013, reason="Consumer too slow")
+                return
+            try:
+                await asyncio.wait_for(websocket.send_text(message), PRICE_STREAM_SEND_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1013, reason="Consumer too slow")
+                return
+
+    async def wait_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    async def expire():
+        await asyncio.sleep(access_until - datetime.now(timezone.utc).timestamp())
+        await websocket.close(code=1008, reason="Token or subscription expired")
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(wait_disconnect())]
+    if access_until is not None:
+        tasks.append(asyncio.create_task(expire()))
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        price_stream.unsubscribe(subscriber)
+        for task in tasks:
+            task.cancel()
+        # Retrieves every task's outcome; a client gone mid-send is not an error here
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+@app.get("/items/history", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
+async def get_price_history(
     server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    item_name: str = Query(..., description="Item unique name"),
+    city: str = Query(..., description="City (e.g. 'lymhurst')"),
+    type: ItemType = Query("fast", description="Which table's prices"),
+    resolution: Literal["raw", "5m", "1h", "1d"] = Query("1h", description="Candle width, or 'raw' for individual ticks"),
+    start: Optional[datetime] = Query(None, description="Inclusive lower bound"),
+    end: Optional[datetime] = Query(None, description="Exclusive upper bound"),
+    limit: int = Query(500, ge=1, le=5000, description="Latest points to return"),
+    db: AsyncSession = Depends(dependencies.get_trade_read_db)
+):
+    """
+    OHLC series of one item/city price. History is written a few seconds
+    after each flush, so the newest prices may not be included yet.
+    """
+    city_slug = city.lower().replace(" ", "_")
+    if city_slug not in models.CITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid city: {city}")
+    return await history.query_series(db, server, type, item_name, city_slug, resolution, start, end, limit)
+
+@app.get("/items/arbitrage", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
+async def get_arbitrage(
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    source: str = Query(..., description="City to buy in (e.g. 'lymhurst')"),
+    destination: str = Query(..., description="City to sell in (e.g. 'black_market')"),
+    type: ItemType = Query("fast", description="Which table to query"),
+    sort_by: arbitrage.SortBy = Query("spread", description="'spread' (silver) or 'margin' (spread / buy price)"),
+    limit: int = Query(50, ge=1, le=1000),
+    min_price: int = Query(0, ge=0, description="Ignore prices below this in either city"),
+    max_age_hours: Optional[float] = Query(None, gt=0, description="Only prices updated within this many hours"),
+    db: AsyncSession = Depends(dependencies.get_trade_read_db)
+):
+    """
+    Top items by profit buying in `source` and selling in `destination`.
+    """
+    source_slug = source.lower().replace(" ", "_")
+    destination_slug = destination.lower().replace(" ", "_")
+    for city, slug in ((source, source_slug), (destination, destination_slug)):
+        if slug not in models.CITIES:
+            raise HTTPException(status_code=400, detail=f"Invalid city: {city}")
+
+    options = dict(limit=limit, sort_by=sort_by, min_price=min_price, max_age_hours=max_age_hours)
+    if hot_table.loaded:
+        block = hot_table.block(server, type)
+        return arbitrage.top_routes_in_memory(block, source_slug, destination_slug, **options)
+
+    return await price_storage.top_routes(db, server, type, source_slug, destination_slug, **options)
+
+@app.get("/items/snapshot", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
+async def get_snapshot(
+    request: Request,
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    type: ItemType = Query("fast", description="Which table to export"),
+    compression: Literal["gzip", "none"] = Query("gzip"),
+    # Primary: the encoded payload is reused while the version is unchanged
     db: AsyncSession = Depends(dependencies.get_trade_db)
+):
+    """
+    Whole table in the packed columnar format described in snapshot.py.
+    The ETag changes with every write to the table, from any instance; send
+    it back in If-None-Match to get a 304 while nothing changed.
+    """
+    version = await price_storage.table_version(db, server, type)
+    etag = snapshot_store.etag(server, type, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+
+    payload = snapshot_store.get(server, type, compression, version)
+    if payload is None:
+        # From the database, not the hot table: that one only sees this process's flushes
+        table = await price_storage.load_table(db, server, type)
+        payload = snapshot_store.build(server, type, compression, table, version)
+
+    if compression == "gzip":
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=payload, media_type=snapshot.MEDIA_TYPE, headers=headers)
+
+@app.get("/items/prices-up-to-date", tags=["Trade Bot"], dependencies=[Depends(auth.require_subscription)])
+async def get_prices_up_to_date(
+    server: ServerType = Query(..., description="Server Region: EU, US, or AS"),
+    window_hours: Optional[float] = Query(None, gt=0, description="Counts prices updated within this many hours"),
+    db: AsyncSession = Depends(dependencies.get_trade_read_db)
 ):
     """
     Returns update stats for the specified server.
     """
-    cutoff_time = datetime.now(timezone.utc) - timedelta(hours=8)
-    cities = [
-        "black_market", "caerleon", "lymhurst", "bridgewatch", 
-        "fort_sterling", "thetford", "martlock", "brecilien"
-    ]
-
-    # Dynamically pick models
-    ModelFast = models.MODEL_MAP[server]["fast"]
-    ModelOrder = models.MODEL_MAP[server]["order"]
-
-    def build_stats_query(model):
-        selections = []
-        for city in cities:
-            price_col = getattr(model, f"price_{city}")
-            updated_col = getattr(model, f"{city}_updated_at")
-            
-            selections.append(func.count(price_col))
-            selections.append(
-                func.sum(
-                    case(
-                        (and_(price_col.is_not(None), updated_col >= cutoff_time), 1), 
-                        else_=0
-                    )
-                )
-            )
-        return select(*selections)
-
-    res_fast = await db.execute(build_stats_query(ModelFast))
-    row_fast = res_fast.one()
-    res_order = await db.execute(build_stats_query(ModelOrder))
-    row_order = res_order.one()
+    if window_hours is None:
+        window_hours = FRESHNESS_WINDOW_HOURS
 
-    response_data = {}
+    if freshness_counters.can_answer(window_hours):
+        counts_fast = freshness_counters.counts(server, "fast", window_hours)
+        counts_order = freshness_counters.counts(server, "order", window_hours)
+        return freshness_percentages(counts_fast, counts_order)
 
-    for i, city in enumerate(cities):
-        idx_total = i * 2
-        idx_recent = i * 2 + 1
+    async def query():
+        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=window_hours)
+        counts_fast = await price_storage.count_fresh(db, server, "fast", cutoff_time)
+        counts_order = await price_storage.count_fresh(db, server, "order", cutoff_time)
+        return json_body(freshness_percentages(counts_fast, counts_order))
 
-        fast_total = row_fast[idx_total] or 0
-        fast_recent = row_fast[idx_recent] or 0
-        order_total = row_order[idx_total] or 0
-        order_recent = row_order[idx_recent] or 0
+    body = await freshness_flight.do((server, window_hours), query)
+    return Response(content=body, media_type="application/json")
+
+def freshness_percentages(counts_fast, counts_order):
+    """Share of prices per city (fast and order tables combined) that are recent, as "NN%"."""
+    response_data = {}
+
+    for i, city in enumerate(models.CITIES):
+        fast_total, fast_recent = counts_fast[i]
+        order_total, order_recent = counts_order[i]
 
         combined_total_valid = fast_total + order_total
         combined_recent_valid = fast_recent + order_recent
@@ -204,13 +452,22 @@ async def get_user(
     user_id: int, 
     db: AsyncSession = Depends(dependencies.get_crypto_db)
 ):
-    query = select(models.User).where(models.User.id == user_id)
-    result = await db.execute(query)
-    user = result.scalar_one_or_none()
+    user = await user_cache.load(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+@app.get("/users/{user_id}/subscription", tags=["Subscription"])
+async def get_subscription(
+    user_id: int,
+    db: AsyncSession = Depends(dependencies.get_crypto_db)
+):
+    """Whether the user's subscription is active; answered from memory while the user is cached."""
+    user = await user_cache.load(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return subscription_status(user)
+
 @app.patch("/users/{user_id}", response_model=UserResponse, tags=["Users"])
 async def change_info(
     user_id: int,
@@ -231,6 +488,7 @@ async def change_info(
         setattr(user, key, value)
     
     await db.commit()
+    user_cache.invalidate(user_id)
     await db.refresh(user)
     return user
 
@@ -255,6 +513,7 @@ async def add_subscription(
         user.subscribed_until = now + timedelta(days=sub_data.days)
         
     await db.commit()
+    user_cache.invalidate(user_id)
     return {"status": "updated", "subscribed_until": user.subscribed_until}
 
 @app.delete("/users/{user_id}/subscription", tags=["Subscription"])
@@ -269,6 +528,7 @@ async def remove_subscription(
     if user:
         user.subscribed_until = None
         await db.commit()
+        user_cache.invalidate(user_id)
         
     return {"status": "removed"}
 
@@ -303,18 +563,29 @@ async def create_invoice(
 
 @app.get("/invoices/", tags=["Invoices"])
 async def get_invoices(
+    response: Response,
     user_id: Optional[int] = None,
-    limit: int = 100,
-    offset: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page; omit for the newest invoices"),
+    offset: Optional[int] = Query(None, ge=0, deprecated=True, description="Use cursor instead"),
     db: AsyncSession = Depends(dependencies.get_crypto_db)
 ):
-    stmt = select(models.Invoice).offset(offset).limit(limit)
-    if user_id:
-        stmt = stmt.where(models.Invoice.user_id == user_id)
-    
-    stmt = stmt.order_by(models.Invoice.created_at.desc())
-    result = await db.execute(stmt)
-    return result.scalars().all()
+    """
+    Invoices, newest first, as a list. When more follow, the `X-Next-Cursor`
+    response header holds the cursor of the next page; pass it back as `cursor`.
+    The deprecated `offset` pages the old way and sets no header.
+    """
+    if offset is not None:
+        if cursor:
+            raise HTTPException(status_code=400, detail="Use either cursor or offset")
+        return await invoices.fetch_offset_page(db, user_id, offset, limit)
+    try:
+        rows, next_cursor = await invoices.fetch_page(db, user_id, cursor, limit)
+    except cursors.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 @app.get("/invoices/last", tags=["Invoices"])
 async def get_last_invoices(
@@ -323,7 +594,7 @@ async def get_last_invoices(
 ):
     stmt = (
         select(models.Invoice)
-        .order_by(models.Invoice.created_at.desc())
+        .order_by(models.Invoice.created_at.desc(), models.Invoice.id.desc())
         .limit(count)
     )
     result = await db.execute(stmt)
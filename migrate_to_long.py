@@ -0,0 +1,81 @@
+"""
+Copies the six wide item tables into the long ItemPrice table, so the
+service can be switched to PRICE_STORAGE=long.
+
+Usage:
+    python migrate_to_long.py
+
+Re-running is safe: existing ItemPrice rows are overwritten with the wide
+values. Stop ingest (or keep the service on the wide layout) while it runs;
+updates flushed to the wide tables afterwards are not copied.
+"""
+import asyncio
+import sys
+import traceback
+from typing import Dict
+
+from sqlalchemy import select, literal, func
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+import models
+from database import get_db_url, trade_db_name
+from database import dialect_insert
+
+# Force stdout to flush immediately so logs appear in Cloud Build
+sys.stdout.reconfigure(line_buffering=True)
+
+
+async def copy_to_long(conn: AsyncConnection) -> Dict[str, int]:
+    """INSERT ... SELECT of every non-null city price, per table and city. Returns rows copied per table."""
+    target = models.ItemPrice.__table__
+    insert = dialect_insert(conn.dialect.name)
+    copied = {}
+
+    for server, types in models.MODEL_MAP.items():
+        for type_, model in types.items():
+            copied[model.__tablename__] = 0
+            for city in models.CITIES:
+                price_col = getattr(model, f"price_{city}")
+                updated_col = getattr(model, f"{city}_updated_at")
+                source = select(
+                    literal(server), literal(type_), model.unique_name, literal(city),
+                    price_col, updated_col, func.coalesce(model.updated_at, updated_col),
+                ).where(price_col.is_not(None))
+
+                stmt = insert(target).from_select(
+                    ["server", "type", "unique_name", "city", "price", "updated_at", "flushed_at"], source
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[target.c.server, target.c.type, target.c.unique_name, target.c.city],
+                    set_={
+                        "price": stmt.excluded.price,
+                        "updated_at": stmt.excluded.updated_at,
+                        "flushed_at": stmt.excluded.flushed_at,
+                    },
+                )
+                result = await conn.execute(stmt)
+                copied[model.__tablename__] += result.rowcount
+    return copied
+
+
+async def migrate():
+    print(">>> SCRIPT STARTED: migrate_to_long.py")
+    engine = create_async_engine(get_db_url(trade_db_name))
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(models.ItemPrice.__table__.create, checkfirst=True)
+            copied = await copy_to_long(conn)
+        for table, count in copied.items():
+            print(f"[{table}] copied {count} city prices")
+        print(f">>> SUCCESS: {sum(copied.values())} rows in ItemPrice. Set PRICE_STORAGE=long to use them.")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(migrate())
+    except Exception:
+        print("\n!!! SCRIPT CRASHED !!!")
+        traceback.print_exc()
+        sys.exit(1)
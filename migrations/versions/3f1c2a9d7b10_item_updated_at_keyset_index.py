@@ -0,0 +1,46 @@
+"""item tables: (updated_at, unique_name) index for delta sync
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d7b10'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ITEM_TABLES = ("ItemFastEU", "ItemOrderEU", "ItemFastUS", "ItemOrderUS", "ItemFastAS", "ItemOrderAS")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while the index builds; it cannot run in a transaction
+    with op.get_context().autocommit_block():
+        for table in ITEM_TABLES:
+            op.create_index(
+                f"ix_{table}_updated_at_unique_name",
+                table,
+                ["updated_at", "unique_name"],
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for table in ITEM_TABLES:
+            op.drop_index(
+                f"ix_{table}_updated_at_unique_name",
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,38 @@
+"""shared buffer: PriceStaging
+
+Revision ID: 5b7f0e3c9a28
+Revises: c2d9b7e4a611
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7f0e3c9a28'
+down_revision: Union[str, Sequence[str], None] = 'c2d9b7e4a611'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'PriceStaging',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+        sa.Column('server', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('unique_name', sa.String(), nullable=False),
+        sa.Column('city_idx', sa.SmallInteger(), nullable=False),
+        sa.Column('price', sa.BigInteger(), nullable=False),
+        sa.Column('stamp', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('PriceStaging')
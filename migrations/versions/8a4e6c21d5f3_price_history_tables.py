@@ -0,0 +1,61 @@
+"""price history: PriceTick and PriceCandle
+
+Revision ID: 8a4e6c21d5f3
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e6c21d5f3'
+down_revision: Union[str, Sequence[str], None] = '3f1c2a9d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'PriceTick',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+        sa.Column('server', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('unique_name', sa.String(), nullable=False),
+        sa.Column('city', sa.String(), nullable=False),
+        sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('price', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_PriceTick_series_ts', 'PriceTick', ['server', 'type', 'unique_name', 'city', 'ts'])
+    op.create_index('ix_PriceTick_ts', 'PriceTick', ['ts'])
+
+    op.create_table(
+        'PriceCandle',
+        sa.Column('server', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('unique_name', sa.String(), nullable=False),
+        sa.Column('city', sa.String(), nullable=False),
+        sa.Column('resolution', sa.String(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('open', sa.BigInteger(), nullable=False),
+        sa.Column('high', sa.BigInteger(), nullable=False),
+        sa.Column('low', sa.BigInteger(), nullable=False),
+        sa.Column('close', sa.BigInteger(), nullable=False),
+        sa.Column('open_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('close_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('ticks', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('server', 'type', 'unique_name', 'city', 'resolution', 'bucket_start'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('PriceCandle')
+    op.drop_index('ix_PriceTick_ts', table_name='PriceTick')
+    op.drop_index('ix_PriceTick_series_ts', table_name='PriceTick')
+    op.drop_table('PriceTick')
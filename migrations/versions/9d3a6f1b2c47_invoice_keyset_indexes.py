@@ -0,0 +1,38 @@
+"""invoices: (created_at, id) and (user_id, created_at, id) indexes for keyset pagination
+
+Revision ID: 9d3a6f1b2c47
+Revises: 5b7f0e3c9a28
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3a6f1b2c47'
+down_revision: Union[str, Sequence[str], None] = '5b7f0e3c9a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = {
+    "ix_Invoice_created_at_id": ["created_at", "id"],
+    "ix_Invoice_user_id_created_at_id": ["user_id", "created_at", "id"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps Invoice writable (payment webhooks) while the indexes build
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, "Invoice", columns, if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(name, table_name="Invoice", if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,40 @@
+"""invoices: created_at NOT NULL, it is the keyset pagination key
+
+Revision ID: b7c1e5d93f20
+Revises: e4b8a2f6c913
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c1e5d93f20'
+down_revision: Union[str, Sequence[str], None] = 'e4b8a2f6c913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Postgres already sorted NULLs first under DESC; now() keeps them on the first page
+    op.execute('UPDATE "Invoice" SET created_at = now() WHERE created_at IS NULL')
+    op.alter_column(
+        'Invoice', 'created_at',
+        existing_type=sa.DateTime(timezone=True),
+        existing_server_default=sa.text('now()'),
+        nullable=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        'Invoice', 'created_at',
+        existing_type=sa.DateTime(timezone=True),
+        existing_server_default=sa.text('now()'),
+        nullable=True,
+    )
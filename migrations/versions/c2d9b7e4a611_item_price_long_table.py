@@ -0,0 +1,42 @@
+"""long layout: ItemPrice
+
+Revision ID: c2d9b7e4a611
+Revises: 8a4e6c21d5f3
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d9b7e4a611'
+down_revision: Union[str, Sequence[str], None] = '8a4e6c21d5f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'ItemPrice',
+        sa.Column('server', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('unique_name', sa.String(), nullable=False),
+        sa.Column('city', sa.String(), nullable=False),
+        sa.Column('price', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('flushed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('server', 'type', 'unique_name', 'city'),
+    )
+    op.create_index('ix_ItemPrice_series_flushed_at', 'ItemPrice', ['server', 'type', 'flushed_at', 'unique_name', 'city'])
+    op.create_index('ix_ItemPrice_series_city_updated_at', 'ItemPrice', ['server', 'type', 'city', 'updated_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ItemPrice_series_city_updated_at', table_name='ItemPrice')
+    op.drop_index('ix_ItemPrice_series_flushed_at', table_name='ItemPrice')
+    op.drop_table('ItemPrice')
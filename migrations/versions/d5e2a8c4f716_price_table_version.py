@@ -0,0 +1,34 @@
+"""prices: PriceTableVersion write counter per (server, type)
+
+Revision ID: d5e2a8c4f716
+Revises: b7c1e5d93f20
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e2a8c4f716'
+down_revision: Union[str, Sequence[str], None] = 'b7c1e5d93f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'PriceTableVersion',
+        sa.Column('server', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('server', 'type'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('PriceTableVersion')
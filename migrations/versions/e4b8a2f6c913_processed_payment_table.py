@@ -0,0 +1,35 @@
+"""payments: ProcessedPayment dedup table for idempotent NOWPayments webhooks
+
+Revision ID: e4b8a2f6c913
+Revises: 9d3a6f1b2c47
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8a2f6c913'
+down_revision: Union[str, Sequence[str], None] = '9d3a6f1b2c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'ProcessedPayment',
+        sa.Column('payment_id', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('days', sa.Integer(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('payment_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('ProcessedPayment')
@@ -1,6 +1,6 @@
-from sqlalchemy import BigInteger, String, DateTime, ForeignKey, Integer, Float
+from sqlalchemy import BigInteger, String, DateTime, ForeignKey, Integer, Float, Index, SmallInteger
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship, Mapped, mapped_column, DeclarativeBase
+from sqlalchemy.orm import relationship, Mapped, mapped_column, DeclarativeBase, declared_attr
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from database import Base
@@ -9,6 +9,12 @@ from database import Base
 # DATABASE 1: Trade Bot (Items) - SHARED STRUCTURE
 # ==========================================
 
+# City slugs in column order: price_<city> / <city>_updated_at
+CITIES = (
+    "black_market", "caerleon", "lymhurst", "bridgewatch",
+    "fort_sterling", "thetford", "martlock", "brecilien",
+)
+
 class ItemBase:
     """
     Mixin class containing all shared columns for Item tables.
@@ -37,6 +43,11 @@ class ItemBase:
 
     updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
+    @declared_attr.directive
+    def __table_args__(cls):
+        # Keyset index for GET /items/changes (updated_at, unique_name) cursors
+        return (Index(f"ix_{cls.__tablename__}_updated_at_unique_name", "updated_at", "unique_name"),)
+
 # --- EU Tables ---
 class ItemFastEU(Base, ItemBase):
     __tablename__ = "ItemFastEU"
@@ -67,6 +78,92 @@ MODEL_MAP = {
     "AS": {"fast": ItemFastAS, "order": ItemOrderAS},
 }
 
+# --- LONG LAYOUT (PRICE_STORAGE=long) ---
+class ItemPrice(Base):
+    """
+    Latest price of one item in one city: the long-format alternative to the
+    six wide tables above. See storage.py.
+    """
+    __tablename__ = "ItemPrice"
+    __table_args__ = (
+        # Delta sync keyset (GET /items/changes)
+        Index("ix_ItemPrice_series_flushed_at", "server", "type", "flushed_at", "unique_name", "city"),
+        # Per-city freshness counts
+        Index("ix_ItemPrice_series_city_updated_at", "server", "type", "city", "updated_at"),
+    )
+
+    server: Mapped[str] = mapped_column(String, primary_key=True)
+    type: Mapped[str] = mapped_column(String, primary_key=True)
+    unique_name: Mapped[str] = mapped_column(String, primary_key=True)
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+    price: Mapped[int] = mapped_column(BigInteger)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    flushed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+
+# --- SHARED BUFFER (BUFFER_BACKEND=staging) ---
+class PriceStaging(Base):
+    """Flushed city prices waiting to be merged into the price tables by any instance."""
+    __tablename__ = "PriceStaging"
+
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    server: Mapped[str] = mapped_column(String)
+    type: Mapped[str] = mapped_column(String)
+    unique_name: Mapped[str] = mapped_column(String)
+    city_idx: Mapped[int] = mapped_column(SmallInteger)
+    price: Mapped[int] = mapped_column(BigInteger)
+    # Update time in epoch microseconds
+    stamp: Mapped[int] = mapped_column(BigInteger)
+
+# --- WRITE VERSIONS ---
+class PriceTableVersion(Base):
+    """
+    Per (server, type) write counter, bumped first thing in every transaction
+    that writes current prices. Its row lock is held until commit, so writers
+    of a series commit one after another, in version order.
+    """
+    __tablename__ = "PriceTableVersion"
+
+    server: Mapped[str] = mapped_column(String, primary_key=True)
+    type: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger)
+
+# --- PRICE HISTORY ---
+class PriceTick(Base):
+    """Append-only log of every flushed city price."""
+    __tablename__ = "PriceTick"
+    __table_args__ = (
+        Index("ix_PriceTick_series_ts", "server", "type", "unique_name", "city", "ts"),
+        Index("ix_PriceTick_ts", "ts"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    server: Mapped[str] = mapped_column(String)
+    type: Mapped[str] = mapped_column(String)
+    unique_name: Mapped[str] = mapped_column(String)
+    city: Mapped[str] = mapped_column(String)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    price: Mapped[int] = mapped_column(BigInteger)
+
+class PriceCandle(Base):
+    """OHLC rollup of PriceTick per series, resolution ('5m', '1h', '1d') and bucket."""
+    __tablename__ = "PriceCandle"
+
+    server: Mapped[str] = mapped_column(String, primary_key=True)
+    type: Mapped[str] = mapped_column(String, primary_key=True)
+    unique_name: Mapped[str] = mapped_column(String, primary_key=True)
+    city: Mapped[str] = mapped_column(String, primary_key=True)
+    resolution: Mapped[str] = mapped_column(String, primary_key=True)
+    bucket_start: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+
+    open: Mapped[int] = mapped_column(BigInteger)
+    high: Mapped[int] = mapped_column(BigInteger)
+    low: Mapped[int] = mapped_column(BigInteger)
+    close: Mapped[int] = mapped_column(BigInteger)
+    # Timestamps of the open/close ticks, so late batches merge in the right order
+    open_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    close_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    ticks: Mapped[int] = mapped_column(Integer)
+
 # ==========================================
 # DATABASE 2: Crypto Backend (Users & Invoices)
 # ==========================================
@@ -98,8 +195,25 @@ class Invoice(Base):
     price_amount: Mapped[float] = mapped_column(Float)
     pay_currency: Mapped[Optional[str]] = mapped_column(String)
     
-    created_at: Mapped[Optional[datetime]] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+    # NOT NULL: it is the keyset pagination key
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    user: Mapped["User"] = relationship("User", back_populates="invoices")
+
+    # Keyset pagination, newest first (GET /invoices/)
+    __table_args__ = (
+        Index("ix_Invoice_created_at_id", "created_at", "id"),
+        Index("ix_Invoice_user_id_created_at_id", "user_id", "created_at", "id"),
     )
 
-    user: Mapped["User"] = relationship("User", back_populates="invoices")
\ No newline at end of file
+
+class ProcessedPayment(Base):
+    """NOWPayments payments already applied; the primary key turns IPN retries into no-ops."""
+    __tablename__ = "ProcessedPayment"
+
+    payment_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer)
+    days: Mapped[int] = mapped_column(Integer)
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -1,10 +1,13 @@
 import hmac, hashlib, json
 from fastapi import APIRouter, Depends, Request, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
+from sqlalchemy import select, text, update
 from datetime import datetime, timedelta, timezone
 
 import models, dependencies, schemas
+from user_cache import user_cache
+from http_client import http_client
+from database import dialect_insert
 import httpx
 import os
 
@@ -45,9 +48,12 @@ async def create_payment(
         "ipn_callback_url": "https://trade-backend-service-1054089939982.europe-west4.run.app/payments/webhook"
     }
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, json=payload, headers=headers)
-        data = resp.json()
+    try:
+        resp = await http_client.post("nowpayments", url, json=payload, headers=headers)
+    except httpx.HTTPError as e:
+        print(f"❌ NOWPayments unreachable: {e!r}")
+        raise HTTPException(502, "Payment provider is unreachable")
+    data = resp.json()
 
     # Create Invoice (formerly Payment)
     # Using 'id' from NOWPayments as the primary key or unique identifier
@@ -63,11 +69,69 @@ async def create_payment(
     
     return {"invoice_url": data['invoice_url']}
 
+# --- Webhook ---
+
+# Postgres: claim the payment id, mark the invoice done and stack the days onto
+# the subscription in one statement. A retried IPN conflicts on the primary key,
+# claims nothing and changes nothing; concurrent payments for one user serialize
+# on the User row and each extends the value the other committed.
+_APPLY_PAYMENT_PG = text("""
+    WITH claimed AS (
+        INSERT INTO "ProcessedPayment" (payment_id, user_id, days)
+        VALUES (:payment_id, :user_id, :days)
+        ON CONFLICT (payment_id) DO NOTHING
+        RETURNING payment_id
+    ), invoice AS (
+        UPDATE "Invoice" SET status = 'done'
+        WHERE id IN (SELECT payment_id FROM claimed)
+        RETURNING id
+    ), extended AS (
+        UPDATE "User" SET subscribed_until = GREATEST(subscribed_until, now()) + make_interval(days => :days)
+        WHERE id = :user_id AND EXISTS (SELECT 1 FROM claimed)
+        RETURNING id
+    )
+    SELECT EXISTS (SELECT 1 FROM claimed)
+""")
+
+async def apply_finished_payment(db: AsyncSession, payment_id: int, user_id: int, days: int) -> bool:
+    """
+    Applies a finished payment exactly once. Returns False if it was applied before.
+    The caller commits.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        result = await db.execute(_APPLY_PAYMENT_PG, {"payment_id": payment_id, "user_id": user_id, "days": days})
+        return bool(result.scalar())
+
+    # Elsewhere (SQLite in tests) the same steps run in one transaction; the
+    # claiming INSERT takes SQLite's write lock before the subscription is read
+    claim = dialect_insert(dialect)(models.ProcessedPayment).values(
+        payment_id=payment_id, user_id=user_id, days=days
+    ).on_conflict_do_nothing(index_elements=["payment_id"])
+    if (await db.execute(claim)).rowcount == 0:
+        return False
+
+    await db.execute(update(models.Invoice).where(models.Invoice.id == payment_id).values(status="done"))
+    current = (await db.execute(
+        select(models.User.subscribed_until).where(models.User.id == user_id)
+    )).one_or_none()
+    if current is not None:
+        now = datetime.now(timezone.utc)
+        until = current[0].replace(tzinfo=timezone.utc) if current[0] else now
+        await db.execute(
+            update(models.User).where(models.User.id == user_id)
+            .values(subscribed_until=max(until, now) + timedelta(days=days))
+        )
+    return True
+
 @router.post("/webhook")
 async def payment_webhook(request: Request, db: AsyncSession = Depends(dependencies.get_crypto_db)):
-    sig = request.headers.get('x-nowpayments-sig')
-    body = await request.body()
-    data_json = await request.json()
+    sig = request.headers.get('x-nowpayments-sig') or ""
+    try:
+        data_json = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON")
+    # NOWPayments signs the body re-serialized with sorted keys
     sorted_data = json.dumps(data_json, separators=(',', ':'), sort_keys=True)
     
     # Verify signature
@@ -77,38 +141,28 @@ async def payment_webhook(request: Request, db: AsyncSession = Depends(dependenc
         hashlib.sha512
     ).hexdigest()
     
-    if sig != calc_sig:
+    # Compare bytes: compare_digest raises TypeError on a str header with non-ASCII characters
+    if not hmac.compare_digest(sig.encode(), calc_sig.encode()):
         raise HTTPException(403, "Invalid Signature")
 
+    payment_status = data_json.get('payment_status')
+
     # Process Payment
-    if data_json.get('payment_status') == 'finished':
+    if payment_status == 'finished':
         payment_id = int(data_json.get('id')) # The NOWPayments Invoice ID
-        
-        # 1. Update Invoice Status to "done"
-        stmt = (
-            update(models.Invoice)
-            .where(models.Invoice.id == payment_id)
-            .values(status="done")
-        )
-        await db.execute(stmt)
-
-        # 2. Update User Subscription
         # Parse user_id and days from order_id passed earlier
         user_id, days = map(int, data_json.get('order_id').split("::"))
-        
-        res = await db.execute(select(models.User).where(models.User.id == user_id))
-        user = res.scalar_one_or_none()
-        
-        if user:
-            now = datetime.now(timezone.utc)
-            current = user.subscribed_until.replace(tzinfo=timezone.utc) if user.subscribed_until else now
-            
-            # Stack subscription time
-            if current > now:
-                user.subscribed_until = current + timedelta(days=days)
-            else:
-                user.subscribed_until = now + timedelta(days=days)
-            
+        applied = await apply_finished_payment(db, payment_id, user_id, days)
+        await db.commit()
+        if applied:
+            user_cache.invalidate(user_id)
+    elif payment_status and data_json.get('id') is not None:
+        # Progress updates may arrive late or repeated; never move a paid invoice back
+        await db.execute(
+            update(models.Invoice)
+            .where(models.Invoice.id == int(data_json['id']), models.Invoice.status != "done")
+            .values(status=payment_status)
+        )
         await db.commit()
 
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
@@ -0,0 +1,115 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import models
+
+# Marks "no value" in the int64 columns (prices are never negative)
+NULL = -(2 ** 63)
+# Largest price an int64 column (and the BigInteger price columns) can hold
+MAX_PRICE = 2 ** 63 - 1
+
+CITY_COUNT = len(models.CITIES)
+CITY_INDEX = {city: i for i, city in enumerate(models.CITIES)}
+# price_<city> -> column index
+PRICE_FIELD_INDEX = {f"price_{city}": i for i, city in enumerate(models.CITIES)}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_us(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_epoch_us(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+class PriceBlock:
+    """
+    Column store for the 8 city prices of a set of items.
+
+    One int64 array per city for prices and one for their timestamps (epoch
+    microseconds), plus an item name -> row index. Missing values are NULL.
+    """
+    __slots__ = ("index", "names", "prices", "stamps")
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.prices: List[array] = [array("q") for _ in range(CITY_COUNT)]
+        self.stamps: List[array] = [array("q") for _ in range(CITY_COUNT)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self.index
+
+    def row(self, name: str) -> int:
+        """Row index of an item, appending an empty row if it is new."""
+        row = self.index.get(name)
+        if row is None:
+            row = len(self.names)
+            self.index[name] = row
+            self.names.append(name)
+            for column in self.prices:
+                column.append(NULL)
+            for column in self.stamps:
+                column.append(NULL)
+        return row
+
+    def set(self, row: int, city_idx: int, price: int, stamp_us: int):
+        self.prices[city_idx][row] = price
+        self.stamps[city_idx][row] = stamp_us
+
+    def get(self, name: str, city_idx: int) -> Tuple[Optional[int], Optional[int]]:
+        """(price, stamp_us) of one item/city, or (None, None)."""
+        row = self.index.get(name)
+        if row is None:
+            return None, None
+        price = self.prices[city_idx][row]
+        if price == NULL:
+            return None, None
+        return price, self.stamps[city_idx][row]
+
+    def merge(self, newer: "PriceBlock"):
+        """Applies a newer block on top of this one: its non-null prices win."""
+        for src_row, name in enumerate(newer.names):
+            row = self.row(name)
+            for city_idx in range(CITY_COUNT):
+                price = newer.prices[city_idx][src_row]
+                if price != NULL:
+                    self.set(row, city_idx, price, newer.stamps[city_idx][src_row])
+
+    def iter_items(self) -> Iterator[Tuple[str, List[Optional[int]], List[Optional[int]]]]:
+        """Yields (name, prices, stamps_us) per row with NULL mapped to None."""
+        for row, name in enumerate(self.names):
+            prices = [None if column[row] == NULL else column[row] for column in self.prices]
+            stamps = [None if column[row] == NULL else column[row] for column in self.stamps]
+            yield name, prices, stamps
+
+    def nbytes(self) -> int:
+        """Bytes held by the price/timestamp columns."""
+        return sum(column.itemsize * len(column) for column in self.prices + self.stamps)
+
+
+class PriceTable:
+    """PriceBlock of one (server, type) table plus the row-level updated_at column."""
+    __slots__ = ("block", "updated")
+
+    def __init__(self):
+        self.block = PriceBlock()
+        self.updated = array("q")
+
+    def row(self, name: str) -> int:
+        row = self.block.row(name)
+        if row == len(self.updated):
+            self.updated.append(NULL)
+        return row
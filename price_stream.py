@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+import models
+from price_block import PriceBlock, CITY_INDEX, NULL, from_epoch_us
+
+# Messages a subscriber may have pending before it is dropped as too slow
+PRICE_STREAM_QUEUE_SIZE = int(os.getenv("PRICE_STREAM_QUEUE_SIZE", "64"))
+# A single send taking longer than this also drops the subscriber
+PRICE_STREAM_SEND_TIMEOUT_SECONDS = float(os.getenv("PRICE_STREAM_SEND_TIMEOUT_SECONDS", "10"))
+
+# Queued in place of pending messages when a subscriber is dropped
+DROPPED = None
+
+
+class Subscriber:
+    """One client's filter plus its bounded queue of serialized messages."""
+    __slots__ = ("server", "type", "items", "city_idx", "queue", "dropped")
+
+    def __init__(self, server: str, type_: str, items: Optional[FrozenSet[str]], city_idx: Tuple[int, ...], queue_size: int):
+        self.server = server
+        self.type = type_
+        self.items = items
+        self.city_idx = city_idx
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    @property
+    def filter_key(self) -> Tuple[Optional[FrozenSet[str]], Tuple[int, ...]]:
+        return self.items, self.city_idx
+
+    async def get(self) -> Optional[str]:
+        """Next message, or DROPPED once the hub gave up on this subscriber."""
+        return await self.queue.get()
+
+
+class PriceStreamHub:
+    """
+    In-process fan-out of flushed prices to stream subscribers.
+
+    on_flush runs inside the buffer flush, so it never waits: each subscriber
+    has a bounded queue and one that is full is dropped instead of stalling
+    the flush. Subscribers with the same filter share one serialized message.
+    """
+
+    def __init__(self, queue_size: int = PRICE_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[Tuple[str, str], Set[Subscriber]] = {}
+        self.messages_sent = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(
+        self,
+        server: str,
+        type_: str,
+        item_names: Optional[Sequence[str]] = None,
+        city_slugs: Optional[Sequence[str]] = None,
+    ) -> Subscriber:
+        city_idx = tuple(sorted({CITY_INDEX[city] for city in city_slugs})) if city_slugs else tuple(range(len(models.CITIES)))
+        items = frozenset(item_names) if item_names else None
+        subscriber = Subscriber(server, type_, items, city_idx, self.queue_size)
+        self._subscribers.setdefault((server, type_), set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.get((subscriber.server, subscriber.type), set()).discard(subscriber)
+
+    def _drop(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber)
+        subscriber.dropped = True
+        self.dropped_subscribers += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(DROPPED)
+
+    def on_flush(self, server: str, type_: str, block: PriceBlock, flushed_at: datetime):
+        subscribers = self._subscribers.get((server, type_))
+        if not subscribers:
+            return
+
+        messages: Dict[Tuple[Optional[FrozenSet[str]], Tuple[int, ...]], Optional[str]] = {}
+        for subscriber in list(subscribers):
+            key = subscriber.filter_key
+            if key not in messages:
+                items = _changed_items(block, subscriber.items, subscriber.city_idx)
+                messages[key] = _message(server, type_, flushed_at, items) if items else None
+            message = messages[key]
+            if message is None:
+                continue
+            try:
+                subscriber.queue.put_nowait(message)
+                self.messages_sent += 1
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def stats(self):
+        return {
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "messages_sent": self.messages_sent,
+            "dropped_subscribers": self.dropped_subscribers,
+            "queue_size": self.queue_size,
+        }
+
+
+def _changed_items(block: PriceBlock, items: Optional[FrozenSet[str]], city_idx: Tuple[int, ...]) -> List[Dict[str, Any]]:
+    """The subscribed cities of the subscribed items that this flush wrote."""
+    if items is None:
+        rows = range(len(block))
+    else:
+        rows = sorted(block.index[name] for name in items if name in block.index)
+
+    changed = []
+    for row in rows:
+        entry = None
+        for idx in city_idx:
+            price = block.prices[idx][row]
+            if price == NULL:
+                continue
+            if entry is None:
+                entry = {"unique_name": block.names[row]}
+            city = models.CITIES[idx]
+            entry[f"price_{city}"] = price
+            entry[f"{city}_updated_at"] = from_epoch_us(block.stamps[idx][row]).isoformat()
+        if entry is not None:
+            changed.append(entry)
+    return changed
+
+
+def _message(server: str, type_: str, flushed_at: datetime, items: List[Dict[str, Any]]) -> str:
+    return json.dumps({
+        "server": server,
+        "type": type_,
+        "flushed_at": flushed_at.isoformat(),
+        "items": items,
+    })
+
+
+price_stream = PriceStreamHub()
@@ -0,0 +1,145 @@
+"""
+Read/write split for the trade-bot database.
+
+Read-only endpoints take their session from `trade_read_router`: a session on
+the read replica (TRADE_DB_REPLICA_HOST) while it is healthy, otherwise one on
+the primary. Health is checked at most every REPLICA_CHECK_INTERVAL_SECONDS,
+on the request that finds the last check stale:
+
+- replication lag above REPLICA_MAX_LAG_SECONDS sends reads to the primary
+  until a later check sees the replica caught up;
+- a replica error (in the check, or in a query of a request that was routed
+  there) sends reads to the primary for REPLICA_RETRY_SECONDS. The request
+  whose query failed still fails; the ones after it do not.
+
+A lagging replica is safe for /items/changes: it replays commits in order,
+and flush stamps follow commit order, so its cursors only trail the primary.
+
+Endpoints whose results are cached (GET /items/ via PriceQueryCache, and
+/items/snapshot) read from the primary: a lagging replica could otherwise
+serve pre-flush rows that then stay cached under the post-flush generation.
+"""
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import TradeBotSession, TradeReplicaSession
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "1"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Zero while the replica has replayed everything it received; an idle primary
+# would otherwise make now() - pg_last_xact_replay_timestamp() grow forever
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+async def replica_lag_seconds(db: AsyncSession) -> float:
+    """Replication lag of the database behind `db`; 0 where it cannot be measured."""
+    if db.get_bind().dialect.name != "postgresql":
+        # Still proves the database is reachable
+        await db.execute(text("SELECT 1"))
+        return 0.0
+    return float((await db.execute(_PG_LAG_SQL)).scalar() or 0.0)
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary_factory,
+        replica_factory=None,
+        max_lag: Optional[float] = None,
+        check_interval: Optional[float] = None,
+        retry_after: Optional[float] = None,
+        lag_probe: Callable[[AsyncSession], Awaitable[float]] = replica_lag_seconds,
+    ):
+        self.primary_factory = primary_factory
+        self.replica_factory = replica_factory
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.lag_probe = lag_probe
+
+        self._healthy = False
+        self._checked_at: Optional[float] = None
+        self._down_until = 0.0
+        self.last_lag: Optional[float] = None
+
+        # Stats
+        self.replica_sessions = 0
+        self.primary_sessions = 0
+        self.lag_fallbacks = 0
+        self.error_fallbacks = 0
+
+    def _mark_down(self, error: Exception):
+        retry_after = REPLICA_RETRY_SECONDS if self.retry_after is None else self.retry_after
+        self._healthy = False
+        self._down_until = time.monotonic() + retry_after
+        self.error_fallbacks += 1
+        print(f"Replica error, reading from the primary for {retry_after}s: {error}")
+
+    async def replica_usable(self) -> bool:
+        if self.replica_factory is None:
+            return False
+        now = time.monotonic()
+        if now < self._down_until:
+            return False
+        check_interval = REPLICA_CHECK_INTERVAL_SECONDS if self.check_interval is None else self.check_interval
+        if self._checked_at is not None and now - self._checked_at < check_interval:
+            return self._healthy
+
+        # Set before awaiting: concurrent requests keep the previous verdict instead of probing too
+        self._checked_at = now
+        try:
+            async with self.replica_factory() as db:
+                lag = await self.lag_probe(db)
+        except (SQLAlchemyError, OSError) as e:
+            self._mark_down(e)
+            return False
+
+        max_lag = REPLICA_MAX_LAG_SECONDS if self.max_lag is None else self.max_lag
+        self.last_lag = lag
+        self._healthy = lag <= max_lag
+        if not self._healthy:
+            self.lag_fallbacks += 1
+        return self._healthy
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """A session for read-only queries: on the replica when usable, else on the primary."""
+        on_replica = await self.replica_usable()
+        factory = self.replica_factory if on_replica else self.primary_factory
+        if on_replica:
+            self.replica_sessions += 1
+        else:
+            self.primary_sessions += 1
+
+        async with factory() as db:
+            try:
+                yield db
+            except (SQLAlchemyError, OSError) as e:
+                if on_replica:
+                    self._mark_down(e)
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.replica_factory is not None,
+            "healthy": self._healthy and time.monotonic() >= self._down_until,
+            "last_lag_seconds": self.last_lag,
+            "replica_sessions": self.replica_sessions,
+            "primary_sessions": self.primary_sessions,
+            "lag_fallbacks": self.lag_fallbacks,
+            "error_fallbacks": self.error_fallbacks,
+        }
+
+
+trade_read_router = ReplicaRouter(TradeBotSession, TradeReplicaSession)
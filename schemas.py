@@ -1,18 +1,23 @@
-from pydantic import BaseModel, EmailStr, ConfigDict
-from typing import Optional
+from pydantic import BaseModel, EmailStr, ConfigDict, Field
+from typing import Annotated, Optional
 from datetime import datetime
+from price_block import MAX_PRICE
+
+# Rejected with 422 before reaching the buffer: negative values would collide
+# with its NULL sentinel, larger ones overflow its int64 columns
+Price = Annotated[int, Field(ge=0, le=MAX_PRICE)]
 
 # --- Trade Schemas ---
 class ItemPriceUpdate(BaseModel):
     unique_name: str
-    price_black_market: Optional[int] = None
-    price_caerleon: Optional[int] = None
-    price_lymhurst: Optional[int] = None
-    price_bridgewatch: Optional[int] = None
-    price_fort_sterling: Optional[int] = None
-    price_thetford: Optional[int] = None
-    price_martlock: Optional[int] = None
-    price_brecilien: Optional[int] = None
+    price_black_market: Optional[Price] = None
+    price_caerleon: Optional[Price] = None
+    price_lymhurst: Optional[Price] = None
+    price_bridgewatch: Optional[Price] = None
+    price_fort_sterling: Optional[Price] = None
+    price_thetford: Optional[Price] = None
+    price_martlock: Optional[Price] = None
+    price_brecilien: Optional[Price] = None
 
 # --- User Schemas ---
 class UserCreate(BaseModel):
@@ -0,0 +1,47 @@
+"""
+In-flight request coalescing.
+
+When identical reads arrive while one is still running, they wait for that
+one instead of starting their own query. The work runs in its own task, so a
+caller that disconnects does not cancel it for everyone else.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        # Stats
+        self.executions = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns fn()'s result, sharing one execution between concurrent callers with the same key."""
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Callers that went away never collect the error; don't log it as unretrieved
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.executions + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / requests, 4) if requests else 0.0,
+        }
@@ -0,0 +1,125 @@
+"""
+Packed columnar snapshot of one (server, type) price table.
+
+Layout (all integers little-endian):
+
+    8 bytes   magic b"ATBSNAP1"
+    u32       header length, then the JSON header:
+              {"server", "type", "rows", "null", "columns": [{"name", "type"}, ...]}
+    u32       names blob length, then the item names as UTF-8 joined by "\\n"
+    int64[]   one array of `rows` values per int64 column, in header order
+
+Prices are int64, timestamps int64 epoch microseconds (UTC), and missing
+values are `null` (int64 min). A numpy client can read each column with
+np.frombuffer(..., dtype="<i8").
+"""
+import gzip
+import json
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import models
+from price_block import PriceTable, NULL
+
+MAGIC = b"ATBSNAP1"
+MEDIA_TYPE = "application/vnd.albion-trade.snapshot"
+
+INT64_COLUMNS = (
+    [f"price_{city}" for city in models.CITIES]
+    + [f"{city}_updated_at" for city in models.CITIES]
+    + ["updated_at"]
+)
+
+_U32 = struct.Struct("<I")
+
+
+def _little_endian(column: array) -> bytes:
+    if sys.byteorder == "little":
+        return column.tobytes()
+    swapped = array(column.typecode, column)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def encode(server: str, type_: str, table: PriceTable) -> bytes:
+    block = table.block
+    header = json.dumps({
+        "server": server,
+        "type": type_,
+        "rows": len(block),
+        "null": NULL,
+        "columns": [{"name": "unique_name", "type": "utf8"}]
+        + [{"name": name, "type": "int64"} for name in INT64_COLUMNS],
+    }).encode()
+    names = "\n".join(block.names).encode()
+
+    parts = [MAGIC, _U32.pack(len(header)), header, _U32.pack(len(names)), names]
+    for column in block.prices + block.stamps + [table.updated]:
+        parts.append(_little_endian(column))
+    return b"".join(parts)
+
+
+def decode(payload: bytes) -> Tuple[Dict[str, Any], List[str], Dict[str, array]]:
+    """Inverse of encode: (header, names, {column name: int64 array})."""
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a price snapshot")
+    offset = len(MAGIC)
+
+    (length,) = _U32.unpack_from(payload, offset)
+    offset += _U32.size
+    header = json.loads(payload[offset:offset + length])
+    offset += length
+
+    (length,) = _U32.unpack_from(payload, offset)
+    offset += _U32.size
+    blob = payload[offset:offset + length].decode()
+    names = blob.split("\n") if blob else []
+    offset += length
+
+    rows = header["rows"]
+    columns = {}
+    for column in header["columns"][1:]:
+        values = array("q")
+        values.frombytes(payload[offset:offset + rows * 8])
+        if sys.byteorder != "little":
+            values.byteswap()
+        columns[column["name"]] = values
+        offset += rows * 8
+    return header, names, columns
+
+
+class SnapshotStore:
+    """
+    Encoded snapshots keyed by (server, type, compression), valid while the
+    table's PriceTableVersion is unchanged. The version is also the ETag, so
+    every instance serves the same ETag for the same table contents.
+    """
+
+    def __init__(self):
+        self._payloads: Dict[Tuple[str, str, str], Tuple[int, bytes]] = {}
+
+    @staticmethod
+    def etag(server: str, type_: str, version: int) -> str:
+        return f'"{server}-{type_}-{version}"'
+
+    def get(self, server: str, type_: str, compression: str, version: int) -> Optional[bytes]:
+        entry = self._payloads.get((server, type_, compression))
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def build(self, server: str, type_: str, compression: str, table: PriceTable, version: int) -> bytes:
+        """Encodes a table read after `version` was; a write in between only makes the payload newer."""
+        payload = encode(server, type_, table)
+        if compression == "gzip":
+            payload = gzip.compress(payload, compresslevel=6)
+        self._payloads[(server, type_, compression)] = (version, payload)
+        return payload
+
+    def clear(self):
+        self._payloads.clear()
+
+
+snapshot_store = SnapshotStore()
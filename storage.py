@@ -0,0 +1,484 @@
+"""
+Storage layouts for the latest item prices.
+
+- "wide" (default): the six ItemFast/ItemOrder tables, one row per item with
+  a price and timestamp column per city.
+- "long": the ItemPrice table, one row per (server, type, item, city). A flush
+  only writes the cities that changed, instead of a whole 25-column row.
+
+Everything that reads or writes current prices goes through `price_storage`,
+selected with PRICE_STORAGE. Switch an existing database over with
+migrate_to_long.py first.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, func, case, and_, or_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import arbitrage
+from database import dialect_insert
+from price_block import PriceBlock, PriceTable, CITY_INDEX, NULL, from_epoch_us, to_epoch_us
+
+PRICE_STORAGE = os.getenv("PRICE_STORAGE", "wide")
+
+# Rows sent per executemany() call
+UPSERT_BATCH_SIZE = int(os.getenv("FLUSH_UPSERT_BATCH_SIZE", "1000"))
+# Rows fetched per round trip while loading a whole table
+LOAD_PARTITION_ROWS = 5000
+
+PRICE_FIELDS = [f"price_{city}" for city in models.CITIES]
+TIMESTAMP_FIELDS = [f"{city}_updated_at" for city in models.CITIES]
+UPSERT_FIELDS = PRICE_FIELDS + TIMESTAMP_FIELDS
+
+# Hot statements (flush upserts, item reads, freshness counts) are built once per
+# shape and reused with bind parameters: requests skip building the statement,
+# and SQLAlchemy finds its compiled form in the engine's compiled cache by identity
+_statement_cache: Dict[tuple, Any] = {}
+# Upper bound on cached shapes; ?cities= orderings are client controlled
+STATEMENT_CACHE_SIZE = 1000
+
+
+def cached_statement(key: tuple, build: Callable[[], Any]):
+    stmt = _statement_cache.get(key)
+    if stmt is None:
+        stmt = build()
+        if len(_statement_cache) < STATEMENT_CACHE_SIZE:
+            _statement_cache[key] = stmt
+    return stmt
+
+
+def build_upsert(dialect_name: str, model, newer_only: bool = False):
+    """
+    INSERT ... ON CONFLICT (unique_name) DO UPDATE, executed with a list of rows.
+    Cities missing from an update are sent as NULL and COALESCE keeps the stored value.
+    With `newer_only`, a city is only overwritten by a price stamped after the stored one.
+    """
+    def build():
+        table = model.__table__
+        stmt = dialect_insert(dialect_name)(table)
+        if newer_only:
+            set_ = {}
+            for city in models.CITIES:
+                price, stamp = f"price_{city}", f"{city}_updated_at"
+                newer = and_(
+                    stmt.excluded[stamp].is_not(None),
+                    or_(table.c[stamp].is_(None), stmt.excluded[stamp] > table.c[stamp]),
+                )
+                set_[price] = case((newer, stmt.excluded[price]), else_=table.c[price])
+                set_[stamp] = case((newer, stmt.excluded[stamp]), else_=table.c[stamp])
+        else:
+            set_ = {
+                field: func.coalesce(stmt.excluded[field], table.c[field])
+                for field in UPSERT_FIELDS
+            }
+        set_["updated_at"] = stmt.excluded.updated_at
+        return stmt.on_conflict_do_update(index_elements=[table.c.unique_name], set_=set_)
+
+    return cached_statement(("upsert", dialect_name, model.__tablename__, newer_only), build)
+
+
+def build_long_upsert(dialect_name: str, newer_only: bool = False):
+    """
+    INSERT ... ON CONFLICT (server, type, unique_name, city) DO UPDATE for ItemPrice.
+    With `newer_only`, a stored price stamped at or after the new one is kept.
+    """
+    def build():
+        table = models.ItemPrice.__table__
+        stmt = dialect_insert(dialect_name)(table)
+        where = None
+        if newer_only:
+            where = or_(table.c.updated_at.is_(None), stmt.excluded.updated_at > table.c.updated_at)
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.server, table.c.type, table.c.unique_name, table.c.city],
+            set_={
+                "price": stmt.excluded.price,
+                "updated_at": stmt.excluded.updated_at,
+                "flushed_at": stmt.excluded.flushed_at,
+            },
+            where=where,
+        )
+
+    return cached_statement(("upsert", dialect_name, models.ItemPrice.__tablename__, newer_only), build)
+
+
+def build_version_bump(dialect_name: str):
+    """
+    Increments a series' PriceTableVersion row, creating it at 1, and returns
+    the new version. On Postgres it also returns clock_timestamp(), read once
+    the row lock is held.
+    """
+    def build():
+        table = models.PriceTableVersion.__table__
+        stmt = dialect_insert(dialect_name)(table).values(
+            server=bindparam("server"), type=bindparam("type"), version=1
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.server, table.c.type], set_={"version": table.c.version + 1}
+        )
+        if dialect_name == "postgresql":
+            return stmt.returning(table.c.version, func.clock_timestamp())
+        return stmt.returning(table.c.version)
+
+    return cached_statement(("version_bump", dialect_name), build)
+
+
+class _DatetimeCache:
+    """Updates from one request share a timestamp, so convert each distinct one once."""
+
+    def __init__(self):
+        self._values: Dict[int, datetime] = {}
+
+    def __call__(self, stamp_us: Optional[int]) -> Optional[datetime]:
+        if stamp_us is None:
+            return None
+        value = self._values.get(stamp_us)
+        if value is None:
+            value = self._values[stamp_us] = from_epoch_us(stamp_us)
+        return value
+
+
+def _epoch_or_null(value: Optional[datetime]) -> int:
+    return NULL if value is None else to_epoch_us(value)
+
+
+class PriceStorage:
+    """
+    Interface of a price layout. Rows returned by read_prices and
+    fetch_changes use the wide column names whatever the layout.
+    """
+    name = ""
+    # Values in a fetch_changes key
+    key_length = 0
+
+    async def begin_write(self, db: AsyncSession, server: str, type_: str) -> Tuple[int, datetime]:
+        """
+        Starts a price write for a series: bumps its PriceTableVersion and returns
+        (new version, flush stamp for the rows). Call it first in the transaction.
+
+        The version row stays locked until commit, and the stamp is read from the
+        database clock once the lock is held. Writers of a series therefore commit
+        in stamp order, and a reader that has seen a stamp has seen every row
+        stamped before it: /items/changes cursors cannot skip a slow commit.
+        """
+        dialect_name = db.get_bind().dialect.name
+        row = (await db.execute(build_version_bump(dialect_name), {"server": server, "type": type_})).one()
+        # SQLite has a single writer, whose lock is held from the first write
+        stamp = row[1] if dialect_name == "postgresql" else datetime.now(timezone.utc)
+        return row[0], stamp
+
+    async def write_block(self, db: AsyncSession, server: str, type_: str, block: PriceBlock, flushed_at: Optional[datetime] = None,
+                          newer_only: bool = False) -> int:
+        """
+        Upserts a flushed block (without committing). Returns the item count.
+        With `newer_only`, prices older than the stored ones are skipped.
+        """
+        raise NotImplementedError
+
+    async def read_prices(self, db: AsyncSession, server: str, type_: str, item_names: Optional[List[str]], city_slugs: Optional[List[str]]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def load_table(self, db: AsyncSession, server: str, type_: str) -> PriceTable:
+        """Reads a whole (server, type) table into column form."""
+        raise NotImplementedError
+
+    async def count_fresh(self, db: AsyncSession, server: str, type_: str, cutoff_time: datetime) -> List[Tuple[int, int]]:
+        """(items with a price, items updated since cutoff) per city, in models.CITIES order."""
+        raise NotImplementedError
+
+    async def table_version(self, db: AsyncSession, server: str, type_: str) -> int:
+        """
+        The series' PriceTableVersion (0 before its first write). Every write
+        bumps it in its own transaction, so it changes with each commit, from any instance.
+        """
+        stmt = cached_statement(("version", server, type_), lambda: (
+            select(models.PriceTableVersion.version).where(
+                models.PriceTableVersion.server == server, models.PriceTableVersion.type == type_
+            )
+        ))
+        return (await db.execute(stmt)).scalar() or 0
+
+    async def top_routes(self, db: AsyncSession, server: str, type_: str, source: str, destination: str, **options) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def fetch_changes(
+        self, db: AsyncSession, server: str, type_: str, after: Optional[tuple], limit: int
+    ) -> Tuple[List[Dict[str, Any]], Optional[tuple], bool]:
+        """
+        Rows flushed after the `after` key, oldest first: (rows, key of the last
+        row, has_more). Flush stamps follow commit order, see begin_write.
+        """
+        raise NotImplementedError
+
+
+class WideStorage(PriceStorage):
+    """One row per item in the MODEL_MAP tables."""
+    name = "wide"
+    key_length = 2  # (updated_at, unique_name)
+
+    async def write_block(self, db, server, type_, block, flushed_at=None, newer_only=False):
+        model = models.MODEL_MAP[server][type_]
+        now = flushed_at or datetime.now(timezone.utc)
+        to_datetime = _DatetimeCache()
+
+        # Every row needs the same keys to share one compiled statement
+        rows = []
+        for unique_name, prices, stamps in block.iter_items():
+            row = dict(zip(PRICE_FIELDS, prices))
+            row.update(zip(TIMESTAMP_FIELDS, map(to_datetime, stamps)))
+            row["unique_name"] = unique_name
+            row["updated_at"] = now
+            rows.append(row)
+
+        stmt = build_upsert(db.get_bind().dialect.name, model, newer_only)
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            await db.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+        return len(rows)
+
+    async def read_prices(self, db, server, type_, item_names, city_slugs):
+        model = models.MODEL_MAP[server][type_]
+        cities = tuple(city_slugs or ())
+
+        def build():
+            if cities:
+                selected_columns = [model.unique_name]
+                for city_slug in cities:
+                    selected_columns.append(getattr(model, f"price_{city_slug}"))
+                    selected_columns.append(getattr(model, f"{city_slug}_updated_at"))
+            else:
+                selected_columns = list(model.__table__.columns)
+
+            stmt = select(*selected_columns)
+            if item_names:
+                stmt = stmt.where(model.unique_name.in_(bindparam("item_names", expanding=True)))
+            return stmt
+
+        stmt = cached_statement(("wide_read", server, type_, cities, bool(item_names)), build)
+        result = await db.execute(stmt, {"item_names": item_names} if item_names else {})
+        return [dict(row) for row in result.mappings()]
+
+    async def load_table(self, db, server, type_):
+        model = models.MODEL_MAP[server][type_]
+        table = PriceTable()
+        columns = [model.unique_name, model.updated_at]
+        for city in models.CITIES:
+            columns.append(getattr(model, f"price_{city}"))
+            columns.append(getattr(model, f"{city}_updated_at"))
+
+        block = table.block
+        result = await db.stream(select(*columns))
+        async for partition in result.partitions(LOAD_PARTITION_ROWS):
+            # Fill column by column: the table is new, so rows are simply appended
+            start = len(block.names)
+            for offset, row in enumerate(partition):
+                block.index[row[0]] = start + offset
+                block.names.append(row[0])
+            table.updated.extend(_epoch_or_null(row[1]) for row in partition)
+            for city_idx in range(len(models.CITIES)):
+                price_col, stamp_col = 2 + city_idx * 2, 3 + city_idx * 2
+                block.prices[city_idx].extend(
+                    NULL if row[price_col] is None else row[price_col] for row in partition
+                )
+                block.stamps[city_idx].extend(
+                    NULL if row[price_col] is None else _epoch_or_null(row[stamp_col]) for row in partition
+                )
+        return table
+
+    async def count_fresh(self, db, server, type_, cutoff_time):
+        """Full-table scan: one aggregate per city column."""
+        model = models.MODEL_MAP[server][type_]
+
+        def build():
+            cutoff = bindparam("cutoff_time")
+            selections = []
+            for city in models.CITIES:
+                price_col = getattr(model, f"price_{city}")
+                updated_col = getattr(model, f"{city}_updated_at")
+
+                selections.append(func.count(price_col))
+                selections.append(
+                    func.sum(
+                        case(
+                            (and_(price_col.is_not(None), updated_col >= cutoff), 1),
+                            else_=0
+                        )
+                    )
+                )
+            return select(*selections)
+
+        stmt = cached_statement(("wide_count_fresh", server, type_), build)
+        row = (await db.execute(stmt, {"cutoff_time": cutoff_time})).one()
+        return [(row[i * 2] or 0, row[i * 2 + 1] or 0) for i in range(len(models.CITIES))]
+
+    async def top_routes(self, db, server, type_, source, destination, **options):
+        return await arbitrage.top_routes_sql(db, models.MODEL_MAP[server][type_], source, destination, **options)
+
+    async def fetch_changes(self, db, server, type_, after, limit):
+        model = models.MODEL_MAP[server][type_]
+        stmt = (
+            select(*model.__table__.columns)
+            .where(model.updated_at.is_not(None))
+            .order_by(model.updated_at, model.unique_name)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(model.updated_at, model.unique_name) > tuple_(*after))
+
+        result = await db.execute(stmt)
+        rows = [dict(row) for row in result.mappings()]
+        has_more = len(rows) > limit
+        del rows[limit:]
+        last_key = (rows[-1]["updated_at"], rows[-1]["unique_name"]) if rows else None
+        return rows, last_key, has_more
+
+
+class LongStorage(PriceStorage):
+    """
+    One ItemPrice row per (server, type, item, city). `updated_at` is the
+    city's price time (the wide <city>_updated_at), `flushed_at` the time of
+    the flush that wrote it (the wide row-level updated_at).
+    """
+    name = "long"
+    key_length = 3  # (flushed_at, unique_name, city)
+
+    def _series(self, server: str, type_: str):
+        return (models.ItemPrice.server == server, models.ItemPrice.type == type_)
+
+    async def write_block(self, db, server, type_, block, flushed_at=None, newer_only=False):
+        now = flushed_at or datetime.now(timezone.utc)
+        to_datetime = _DatetimeCache()
+
+        rows = []
+        for city_idx, city in enumerate(models.CITIES):
+            prices, stamps = block.prices[city_idx], block.stamps[city_idx]
+            for row, name in enumerate(block.names):
+                if prices[row] == NULL:
+                    continue
+                rows.append({
+                    "server": server, "type": type_, "unique_name": name, "city": city,
+                    "price": prices[row], "updated_at": to_datetime(stamps[row]), "flushed_at": now,
+                })
+
+        stmt = build_long_upsert(db.get_bind().dialect.name, newer_only)
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            await db.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+        return len(block)
+
+    async def read_prices(self, db, server, type_, item_names, city_slugs):
+        """
+        Same row shape as the wide layout. With a city filter, items that
+        have no price in any of those cities are left out.
+        """
+        model = models.ItemPrice
+
+        def build():
+            stmt = select(model.unique_name, model.city, model.price, model.updated_at, model.flushed_at).where(
+                *self._series(server, type_)
+            )
+            if item_names:
+                stmt = stmt.where(model.unique_name.in_(bindparam("item_names", expanding=True)))
+            if city_slugs:
+                stmt = stmt.where(model.city.in_(bindparam("city_slugs", expanding=True)))
+            return stmt.order_by(model.unique_name)
+
+        stmt = cached_statement(("long_read", server, type_, bool(item_names), bool(city_slugs)), build)
+        params = {}
+        if item_names:
+            params["item_names"] = item_names
+        if city_slugs:
+            params["city_slugs"] = city_slugs
+
+        if city_slugs:
+            template = {}
+            for city in city_slugs:
+                template[f"price_{city}"] = None
+                template[f"{city}_updated_at"] = None
+        else:
+            template = dict.fromkeys(PRICE_FIELDS + TIMESTAMP_FIELDS + ["updated_at"])
+
+        items: Dict[str, Dict[str, Any]] = {}
+        for name, city, price, updated_at, flushed_at in (await db.execute(stmt, params)).all():
+            item = items.get(name)
+            if item is None:
+                item = items[name] = {"unique_name": name, **template}
+            item[f"price_{city}"] = price
+            item[f"{city}_updated_at"] = updated_at
+            if not city_slugs and (item["updated_at"] is None or flushed_at > item["updated_at"]):
+                item["updated_at"] = flushed_at
+        return list(items.values())
+
+    async def load_table(self, db, server, type_):
+        model = models.ItemPrice
+        table = PriceTable()
+        block = table.block
+        stmt = select(model.unique_name, model.city, model.price, model.updated_at, model.flushed_at).where(
+            *self._series(server, type_)
+        )
+        result = await db.stream(stmt)
+        async for partition in result.partitions(LOAD_PARTITION_ROWS):
+            for name, city, price, updated_at, flushed_at in partition:
+                row = table.row(name)
+                block.set(row, CITY_INDEX[city], price, _epoch_or_null(updated_at))
+                flushed_us = _epoch_or_null(flushed_at)
+                if flushed_us > table.updated[row]:
+                    table.updated[row] = flushed_us
+        return table
+
+    async def count_fresh(self, db, server, type_, cutoff_time):
+        model = models.ItemPrice
+        stmt = cached_statement(("long_count_fresh", server, type_), lambda: (
+            select(
+                model.city,
+                func.count(model.price),
+                func.sum(case((model.updated_at >= bindparam("cutoff_time"), 1), else_=0)),
+            )
+            .where(*self._series(server, type_))
+            .group_by(model.city)
+        ))
+        rows = (await db.execute(stmt, {"cutoff_time": cutoff_time})).all()
+        counts = {city: (total or 0, recent or 0) for city, total, recent in rows}
+        return [counts.get(city, (0, 0)) for city in models.CITIES]
+
+    async def top_routes(self, db, server, type_, source, destination, **options):
+        return await arbitrage.top_routes_sql_long(db, server, type_, source, destination, **options)
+
+    async def fetch_changes(self, db, server, type_, after, limit):
+        """
+        Pages over city rows, so one item's cities may be split across two
+        pages; each part comes back as its own partial item.
+        """
+        model = models.ItemPrice
+        stmt = (
+            select(model.unique_name, model.city, model.price, model.updated_at, model.flushed_at)
+            .where(*self._series(server, type_))
+            .order_by(model.flushed_at, model.unique_name, model.city)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(model.flushed_at, model.unique_name, model.city) > tuple_(*after))
+
+        rows = (await db.execute(stmt)).all()
+        has_more = len(rows) > limit
+        del rows[limit:]
+
+        items: List[Dict[str, Any]] = []
+        previous = None
+        for name, city, price, updated_at, flushed_at in rows:
+            if previous != (flushed_at, name):
+                items.append({"unique_name": name, "updated_at": flushed_at})
+                previous = (flushed_at, name)
+            items[-1][f"price_{city}"] = price
+            items[-1][f"{city}_updated_at"] = updated_at
+
+        last_key = (rows[-1].flushed_at, rows[-1].unique_name, rows[-1].city) if rows else None
+        return items, last_key, has_more
+
+
+STORAGES = {"wide": WideStorage, "long": LongStorage}
+
+if PRICE_STORAGE not in STORAGES:
+    raise ValueError(f"PRICE_STORAGE must be one of {sorted(STORAGES)}, got '{PRICE_STORAGE}'")
+
+price_storage: PriceStorage = STORAGES[PRICE_STORAGE]()
@@ -13,7 +13,11 @@ from sqlalchemy.pool import StaticPool
 import models 
 from database import Base 
 from main import app
-from dependencies import get_trade_db, get_crypto_db
+from cache import price_cache
+from snapshot import snapshot_store
+from history import price_history
+from user_cache import user_cache
+from dependencies import get_trade_db, get_trade_read_db, get_crypto_db
 
 # --- CONFIGURATION ---
 TEST_TRADE_DB_URL = "sqlite+aiosqlite:///:memory:"
@@ -43,6 +47,10 @@ TestingCryptoSession = async_sessionmaker(_test_crypto_engine, expire_on_commit=
 @pytest_asyncio.fixture(scope="function", autouse=True)
 async def setup_databases():
     """Creates tables on the global engines before every test."""
+    price_cache.clear()
+    snapshot_store.clear()
+    price_history.clear()
+    user_cache.clear()
     async with _test_trade_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     async with _test_crypto_engine.begin() as conn:
@@ -63,6 +71,10 @@ def trade_db_engine():
 def crypto_db_engine():
     return _test_crypto_engine
 
+@pytest.fixture
+def trade_session_factory():
+    return TestingTradeSession
+
 @pytest_asyncio.fixture(scope="session", autouse=True)
 async def shutdown_engines():
     """Ensures DB engines are disposed of after all tests run."""
@@ -81,6 +93,7 @@ async def override_get_crypto_db():
         yield session
 
 app.dependency_overrides[get_trade_db] = override_get_trade_db
+app.dependency_overrides[get_trade_read_db] = override_get_trade_db
 app.dependency_overrides[get_crypto_db] = override_get_crypto_db
 
 @pytest_asyncio.fixture(scope="function")
@@ -0,0 +1,58 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+from hot_table import hot_table
+
+
+def iso(delta_hours):
+    return (datetime.now(timezone.utc) - timedelta(hours=delta_hours)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+async def seed(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemFastEU (unique_name, price_lymhurst, lymhurst_updated_at, price_black_market, black_market_updated_at) VALUES "
+            f"('T4_A', 100, '{iso(1)}', 400, '{iso(1)}'), "   # spread 300, margin 3.0
+            f"('T4_B', 1000, '{iso(1)}', 1500, '{iso(1)}'), "  # spread 500, margin 0.5
+            f"('T4_C', 50, '{iso(1)}', 40, '{iso(1)}'), "      # loss
+            f"('T4_D', 10, '{iso(30)}', 900, '{iso(1)}'), "    # stale buy price
+            "('T4_E', 10, NULL, NULL, NULL)"                   # no sell price
+        ))
+
+@pytest.mark.asyncio
+async def test_arbitrage_sql_and_memory_agree(client, trade_db_engine, trade_session_factory):
+    """
+    Ranking and filters give the same routes from SQL and from the hot table.
+    """
+    await seed(trade_db_engine)
+    cases = [
+        ({"sort_by": "spread"}, ["T4_D", "T4_B", "T4_A"]),
+        ({"sort_by": "margin"}, ["T4_D", "T4_A", "T4_B"]),
+        ({"sort_by": "spread", "max_age_hours": 8}, ["T4_B", "T4_A"]),
+        ({"sort_by": "spread", "min_price": 100}, ["T4_B", "T4_A"]),
+        ({"sort_by": "spread", "limit": 1}, ["T4_D"]),
+    ]
+
+    for extra, expected in cases:
+        params = {"server": "EU", "type": "fast", "source": "lymhurst", "destination": "Black Market", **extra}
+
+        res = await client.get("/items/arbitrage", params=params)
+        assert res.status_code == 200
+        from_sql = res.json()
+        assert [route["unique_name"] for route in from_sql] == expected
+
+        await hot_table.load(trade_session_factory)
+        from_memory = (await client.get("/items/arbitrage", params=params)).json()
+        hot_table.loaded = False
+        assert [route["unique_name"] for route in from_memory] == expected
+        assert [route["spread"] for route in from_memory] == [route["spread"] for route in from_sql]
+
+    hot_table._tables = {}
+
+    top = from_sql[0]
+    assert top["buy_price"] == 10 and top["sell_price"] == 900 and top["margin"] == 89.0
+
+@pytest.mark.asyncio
+async def test_arbitrage_invalid_city(client):
+    res = await client.get("/items/arbitrage", params={"server": "EU", "source": "atlantis", "destination": "caerleon"})
+    assert res.status_code == 400
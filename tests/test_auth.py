@@ -0,0 +1,121 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, text
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import auth
+from main import app
+from price_stream import price_stream
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.mark.asyncio
+async def test_subscription_gate_checks_token_only(client, crypto_db_engine, monkeypatch):
+    """
+    With the gate on, trade endpoints need a token whose sub_until claim is in the future; no user query is made.
+    """
+    monkeypatch.setattr(auth, "SUBSCRIPTION_GATE_ENABLED", True)
+    queries = []
+    listener = lambda *args: queries.append(args[2])
+    event.listen(crypto_db_engine.sync_engine, "before_cursor_execute", listener)
+
+    params = {"server": "EU"}
+    now = datetime.now(timezone.utc)
+    subscribed = auth.create_access_token({"sub": "1"}, subscribed_until=now + timedelta(days=3))
+    lapsed = auth.create_access_token({"sub": "1"}, subscribed_until=now - timedelta(minutes=1))
+    expired = auth.create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=-1), subscribed_until=now + timedelta(days=3))
+    try:
+        assert (await client.get("/items/changes", params=params)).status_code == 401
+        assert (await client.get("/items/changes", params=params, headers=bearer("garbage"))).status_code == 401
+        assert (await client.get("/items/changes", params=params, headers=bearer(expired))).status_code == 401
+        assert (await client.get("/items/changes", params=params, headers=bearer(auth.create_access_token({"sub": "1"})))).status_code == 403
+        assert (await client.get("/items/changes", params=params, headers=bearer(lapsed))).status_code == 403
+        assert (await client.get("/items/prices-up-to-date", params=params)).status_code == 401
+
+        hits = auth.token_cache_stats()["hits"]
+        for _ in range(3):
+            assert (await client.get("/items/changes", params=params, headers=bearer(subscribed))).status_code == 200
+        assert auth.token_cache_stats()["hits"] - hits == 2
+    finally:
+        event.remove(crypto_db_engine.sync_engine, "before_cursor_execute", listener)
+    assert queries == []
+
+@pytest.mark.asyncio
+async def test_refresh_picks_up_extended_subscription(client, monkeypatch):
+    """
+    After the subscription is extended, /token/refresh reissues a token that passes the gate.
+    """
+    monkeypatch.setattr(auth, "SUBSCRIPTION_GATE_ENABLED", True)
+    res = await client.post("/users/", json={"username": "payer", "email": "payer@test.com", "password": "pass"})
+    user_id = res.json()["id"]
+
+    # Issued before paying
+    old_token = auth.create_access_token({"sub": str(user_id)})
+    assert (await client.get("/items/changes", params={"server": "EU"}, headers=bearer(old_token))).status_code == 403
+    await client.post(f"/users/{user_id}/subscription/add", json={"days": 30})
+
+    res = await client.post("/token/refresh", headers=bearer(old_token))
+    assert res.status_code == 200
+    token = res.json()["access_token"]
+    until = datetime.fromisoformat(res.json()["subscribed_until"]).replace(tzinfo=timezone.utc)
+    assert until > datetime.now(timezone.utc) + timedelta(days=29)
+    assert (await client.get("/items/changes", params={"server": "EU"}, headers=bearer(token))).status_code == 200
+
+@pytest.mark.asyncio
+async def test_refresh_refuses_expired_tokens_and_lapsed_users(client, crypto_db_engine):
+    """
+    Only a valid token of an existing user with an active subscription is reissued.
+    """
+    res = await client.post("/users/", json={"username": "lapsed", "email": "lapsed@test.com", "password": "pass"})
+    user_id = res.json()["id"]
+    await client.post(f"/users/{user_id}/subscription/add", json={"days": 30})
+
+    # 1. An expired token cannot be renewed, however recently it expired
+    expired = auth.create_access_token({"sub": str(user_id)}, expires_delta=timedelta(seconds=-1))
+    assert (await client.post("/token/refresh", headers=bearer(expired))).status_code == 401
+
+    # 2. The subscription is read from the database, not from the token or the user cache
+    token = auth.create_access_token({"sub": str(user_id)}, subscribed_until=datetime.now(timezone.utc) + timedelta(days=30))
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(text('UPDATE "User" SET subscribed_until = NULL WHERE id = :id'), {"id": user_id})
+    assert (await client.post("/token/refresh", headers=bearer(token))).status_code == 403
+
+    # 3. A deleted user gets nothing
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(text('DELETE FROM "User" WHERE id = :id'), {"id": user_id})
+    assert (await client.post("/token/refresh", headers=bearer(token))).status_code == 401
+
+def test_price_stream_requires_subscription(monkeypatch):
+    """
+    With the gate on, the WebSocket handshake needs a subscribed token (query param or header) and closes at expiry.
+    """
+    monkeypatch.setattr(auth, "SUBSCRIPTION_GATE_ENABLED", True)
+    client = TestClient(app)
+    url = "/items/stream?server=EU"
+    now = datetime.now(timezone.utc)
+    subscribed = auth.create_access_token({"sub": "1"}, subscribed_until=now + timedelta(days=3))
+    lapsed = auth.create_access_token({"sub": "1"}, subscribed_until=now - timedelta(minutes=1))
+
+    # 1. Missing, invalid and unsubscribed tokens are refused with 1008
+    for params in ("", "&token=garbage", f"&token={lapsed}"):
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect(url + params):
+                pass
+        assert exc.value.code == 1008
+
+    # 2. A subscribed token works as a query param and as a header
+    with client.websocket_connect(f"{url}&token={subscribed}"):
+        assert price_stream.stats()["subscribers"] == 1
+    with client.websocket_connect(url, headers=bearer(subscribed)):
+        assert price_stream.stats()["subscribers"] == 1
+
+    # 3. The stream ends when the token does
+    short = auth.create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=1), subscribed_until=now + timedelta(days=3))
+    with client.websocket_connect(f"{url}&token={short}") as websocket:
+        with pytest.raises(WebSocketDisconnect) as exc:
+            websocket.receive_json()
+        assert exc.value.code == 1008
+    assert price_stream.stats()["subscribers"] == 0
@@ -0,0 +1,168 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+from buffer import PriceUpdateBuffer
+from price_block import CITY_INDEX
+from schemas import ItemPriceUpdate
+
+
+@pytest.mark.asyncio
+async def test_ingest_not_blocked_by_flush(trade_session_factory, monkeypatch):
+    """
+    While an AS flush is stuck in the database, EU ingest completes immediately and
+    AS updates arriving mid-flush land in the fresh buffer instead of being lost.
+    """
+    buffer = PriceUpdateBuffer()
+    release = asyncio.Event()
+    original_flush_data = buffer._flush_data
+
+    async def slow_flush_data(db, server, type_, block, flushed_at=None):
+        await release.wait()
+        return await original_flush_data(db, server, type_, block, flushed_at)
+
+    monkeypatch.setattr(buffer, "_flush_data", slow_flush_data)
+
+    await buffer.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=10)])
+
+    async with trade_session_factory() as db:
+        flush_task = asyncio.create_task(buffer.flush(db, [("AS", "fast")]))
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(
+            buffer.add_updates("EU", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=20)]),
+            timeout=0.1,
+        )
+        await buffer.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T5_BAG", price_caerleon=30)])
+
+        release.set()
+        assert await flush_task == 1
+
+    assert set(buffer._buffers["AS"]["fast"].active) == {"T5_BAG"}
+    assert set(buffer._buffers["EU"]["fast"].active) == {"T4_BAG"}
+
+@pytest.mark.asyncio
+async def test_flush_swaps_without_copy():
+    """
+    A flush hands the existing dict to the writer and installs a new empty one.
+    """
+    buffer = PriceUpdateBuffer()
+    await buffer.add_updates("US", "order", [ItemPriceUpdate(unique_name="T6_ORE", price_martlock=5)])
+
+    shard = buffer._buffers["US"]["order"]
+    before = shard.active
+    swapped = shard.swap()
+
+    assert swapped is before
+    assert len(shard.active) == 0
+    price, stamp = swapped.get("T6_ORE", CITY_INDEX["martlock"])
+    assert price == 5
+    assert stamp is not None
+
+@pytest.mark.asyncio
+async def test_merge_keeps_latest_non_null_price():
+    """
+    Later non-null city prices overwrite earlier ones; nulls leave the buffered value alone.
+    """
+    buffer = PriceUpdateBuffer()
+    await buffer.add_updates("EU", "order", [
+        ItemPriceUpdate(unique_name="T4_HIDE", price_caerleon=10, price_thetford=20),
+    ])
+    await buffer.add_updates("EU", "order", [
+        ItemPriceUpdate(unique_name="T4_HIDE", price_caerleon=11, price_thetford=None),
+        ItemPriceUpdate(unique_name="T5_HIDE", price_lymhurst=None),
+    ])
+
+    block = buffer._buffers["EU"]["order"].active
+    assert list(block) == ["T4_HIDE"]
+    assert block.get("T4_HIDE", CITY_INDEX["caerleon"])[0] == 11
+    assert block.get("T4_HIDE", CITY_INDEX["thetford"])[0] == 20
+    assert block.get("T4_HIDE", CITY_INDEX["lymhurst"]) == (None, None)
+
+@pytest.mark.asyncio
+async def test_failed_table_is_retried_alone(trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    A table whose write fails is retried on its own; the other tables commit on the first attempt.
+    """
+    buffer = PriceUpdateBuffer(retries=2)
+    monkeypatch.setattr("buffer.FLUSH_RETRY_BACKOFF_SECONDS", 0)
+    original_flush_data = buffer._flush_data
+    attempts = {}
+
+    async def flaky_flush_data(db, server, type_, block, flushed_at=None):
+        attempts[(server, type_)] = attempts.get((server, type_), 0) + 1
+        if server == "US" and attempts[(server, type_)] < 3:
+            raise RuntimeError("connection reset")
+        return await original_flush_data(db, server, type_, block, flushed_at)
+
+    monkeypatch.setattr(buffer, "_flush_data", flaky_flush_data)
+    await buffer.add_updates("EU", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=10)])
+    await buffer.add_updates("US", "fast", [ItemPriceUpdate(unique_name="T5_BAG", price_caerleon=20)])
+
+    async with trade_session_factory() as db:
+        assert await buffer.flush(db) == 2
+
+    assert attempts == {("EU", "fast"): 1, ("US", "fast"): 3}
+    assert buffer.failed_flushes == 0
+    async with trade_db_engine.connect() as conn:
+        assert (await conn.execute(text("SELECT price_caerleon FROM ItemFastUS"))).scalar() == 20
+
+@pytest.mark.asyncio
+async def test_flush_runs_tables_concurrently(trade_session_factory, monkeypatch):
+    """
+    Tables are written concurrently, bounded by the parallelism limit.
+    """
+    buffer = PriceUpdateBuffer(parallelism=2)
+    active, peak = 0, 0
+
+    async def slow_flush_data(db, server, type_, block, flushed_at=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return len(block)
+
+    async def begin_write(db, server, type_):
+        return datetime.now(timezone.utc)
+
+    monkeypatch.setattr(buffer, "_flush_data", slow_flush_data)
+    monkeypatch.setattr(buffer, "_begin_write", begin_write)
+    for server, type_ in buffer.buckets():
+        await buffer.add_updates(server, type_, [ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=1)])
+
+    # The SQLite test engine forces one table at a time; pretend to be Postgres
+    async with trade_session_factory() as db:
+        monkeypatch.setattr(db.bind.dialect, "name", "postgresql")
+        assert await buffer.flush(db) == 6
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_slow_writes_always_commit(trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    However long a write takes, it commits: every write bumps the table's version and
+    is stamped after the previous one committed, so stamps follow commit order.
+    """
+    buffer = PriceUpdateBuffer(retries=0)
+    original_flush_data = buffer._flush_data
+    stamps = []
+
+    async def slow_flush_data(db, server, type_, block, flushed_at=None):
+        stamps.append(flushed_at)
+        count = await original_flush_data(db, server, type_, block, flushed_at)
+        await asyncio.sleep(0.1)
+        return count
+
+    monkeypatch.setattr(buffer, "_flush_data", slow_flush_data)
+    for price in (7, 8):
+        await buffer.add_updates("EU", "order", [ItemPriceUpdate(unique_name="T4_SLOW", price_caerleon=price)])
+        async with trade_session_factory() as db:
+            assert await buffer.flush(db) == 1
+
+    assert buffer.failed_flushes == 0
+    assert stamps[1] - stamps[0] >= timedelta(seconds=0.1)
+    async with trade_db_engine.connect() as conn:
+        assert (await conn.execute(text("SELECT price_caerleon FROM ItemOrderEU WHERE unique_name = 'T4_SLOW'"))).scalar() == 8
+        version = await conn.execute(text("SELECT version FROM PriceTableVersion WHERE server = 'EU' AND type = 'order'"))
+        assert version.scalar() == 2
@@ -0,0 +1,147 @@
+import pytest
+from sqlalchemy import func, select, text
+
+import models
+from buffer import PriceUpdateBuffer
+from buffer_backend import StagingTableBackend
+from schemas import ItemPriceUpdate
+from storage import WideStorage
+
+
+def instance():
+    """A PriceUpdateBuffer as one Cloud Run instance would have it."""
+    return PriceUpdateBuffer(storage=WideStorage(), backend=StagingTableBackend(claim_rows=2))
+
+async def stage(buffer, session_factory, server, type_):
+    """Hands a bucket to the staging table without applying anything."""
+    block = buffer._buffers[server][type_].swap()
+    async with session_factory() as db:
+        await buffer.backend.write(db, buffer.storage, server, type_, block, None)
+        await db.commit()
+
+async def staged_rows(session_factory):
+    async with session_factory() as db:
+        return (await db.execute(select(func.count()).select_from(models.PriceStaging))).scalar()
+
+@pytest.mark.asyncio
+async def test_any_instance_applies_staged_updates(trade_db_engine, trade_session_factory):
+    """
+    Updates staged by two instances are merged by a third one's flush, newest price first.
+    """
+    first, second, applier = instance(), instance(), instance()
+    notified = []
+    applier.add_flush_listener(lambda server, type_, block, flushed_at: notified.append((server, type_, sorted(block.names))))
+
+    # 1. The older lymhurst price is staged last
+    await first.add_updates("EU", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=100)])
+    await second.add_updates("EU", "fast", [
+        ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=200),
+        ItemPriceUpdate(unique_name="T5_BAG", price_caerleon=5, price_martlock=6),
+    ])
+    await stage(second, trade_session_factory, "EU", "fast")
+    await stage(first, trade_session_factory, "EU", "fast")
+    assert await staged_rows(trade_session_factory) == 4
+
+    # 2. Nothing buffered locally, but the flush claims and applies every staged row, 2 per transaction
+    async with trade_session_factory() as db:
+        assert await applier.flush(db) == 0
+
+    assert await staged_rows(trade_session_factory) == 0
+    # The second claim's older T4_BAG price was not written, so listeners do not see it
+    assert notified == [("EU", "fast", ["T4_BAG", "T5_BAG"]), ("EU", "fast", ["T5_BAG"])]
+
+    async with trade_db_engine.connect() as conn:
+        rows = dict((await conn.execute(text("SELECT unique_name, price_lymhurst FROM ItemFastEU"))).all())
+    assert rows == {"T4_BAG": 200, "T5_BAG": None}
+    assert applier.backend.stats()["applied_rows"] == 4
+
+@pytest.mark.asyncio
+async def test_failed_apply_leaves_rows_staged(trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    Staging commits on its own; if applying fails, the claim rolls back and the next flush applies the rows.
+    """
+    buffer = instance()
+    await buffer.add_updates("US", "order", [ItemPriceUpdate(unique_name="T4_ORE", price_thetford=9)])
+
+    async def broken_write_block(db, server, type_, block, flushed_at=None, newer_only=False):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(buffer.storage, "write_block", broken_write_block)
+    async with trade_session_factory() as db:
+        assert await buffer.flush(db) == 1
+    assert await staged_rows(trade_session_factory) == 1
+    assert buffer.failed_flushes == 1
+
+    monkeypatch.undo()
+    async with trade_session_factory() as db:
+        assert await buffer.flush(db) == 0
+    assert await staged_rows(trade_session_factory) == 0
+
+    async with trade_db_engine.connect() as conn:
+        price = (await conn.execute(text("SELECT price_thetford FROM ItemOrderUS WHERE unique_name = 'T4_ORE'"))).scalar()
+    assert price == 9
+
+@pytest.mark.asyncio
+async def test_late_staged_price_does_not_overwrite_newer(trade_db_engine, trade_session_factory):
+    """
+    A price staged after a newer one was already applied is skipped, and one flush
+    claims at most max_claims batches.
+    """
+    slow, fast = instance(), instance()
+    applier = PriceUpdateBuffer(storage=WideStorage(), backend=StagingTableBackend(claim_rows=2, max_claims=1))
+
+    # 1. The newer price reaches the table first; the older one is staged afterwards
+    await slow.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T4_HIDE", price_caerleon=100)])
+    await fast.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T4_HIDE", price_caerleon=200)])
+    await stage(fast, trade_session_factory, "AS", "fast")
+    async with trade_session_factory() as db:
+        await applier.flush(db)
+
+    await slow.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T5_HIDE", price_caerleon=1, price_martlock=2)])
+    await stage(slow, trade_session_factory, "AS", "fast")
+    assert await staged_rows(trade_session_factory) == 3
+
+    # 2. One claim of two rows per flush
+    async with trade_session_factory() as db:
+        await applier.flush(db)
+    assert await staged_rows(trade_session_factory) == 1
+    async with trade_session_factory() as db:
+        await applier.flush(db)
+    assert await staged_rows(trade_session_factory) == 0
+
+    async with trade_db_engine.connect() as conn:
+        rows = dict((await conn.execute(text("SELECT unique_name, price_caerleon FROM ItemFastAS"))).all())
+    assert rows == {"T4_HIDE": 200, "T5_HIDE": 1}
+
+@pytest.mark.asyncio
+async def test_each_claim_commits_on_its_own(trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    Claims are applied in separate transactions: a failing claim keeps only its own rows staged.
+    """
+    buffer = instance()
+    await buffer.add_updates("EU", "order", [
+        ItemPriceUpdate(unique_name="T4_ORE", price_thetford=1, price_martlock=2),
+        ItemPriceUpdate(unique_name="T5_ORE", price_thetford=3),
+    ])
+    await stage(buffer, trade_session_factory, "EU", "order")
+
+    original_write_block = buffer.storage.write_block
+    calls = 0
+
+    async def second_write_fails(db, server, type_, block, flushed_at=None, newer_only=False):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("database went away")
+        return await original_write_block(db, server, type_, block, flushed_at, newer_only)
+
+    monkeypatch.setattr(buffer.storage, "write_block", second_write_fails)
+    async with trade_session_factory() as db:
+        await buffer.flush(db)
+
+    assert await staged_rows(trade_session_factory) == 1
+    assert buffer.failed_flushes == 1
+    async with trade_db_engine.connect() as conn:
+        rows = (await conn.execute(text("SELECT unique_name, price_thetford, price_martlock FROM ItemOrderEU ORDER BY unique_name"))).all()
+    # Staged city by city: the thetford prices were the first claim, martlock the failed one
+    assert [tuple(row) for row in rows] == [("T4_ORE", 1, None), ("T5_ORE", 3, None)]
@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import text
+
+from cache import TTLCache, PriceQueryCache, MISSING, price_cache
+from main import price_buffer
+
+
+@pytest.mark.asyncio
+async def test_get_prices_cached_until_flush(client, trade_db_engine):
+    """
+    Repeated reads are served from the cache; a flush touching the item invalidates them.
+    """
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text("INSERT INTO ItemFastEU (unique_name, price_lymhurst) VALUES ('T4_MACE', 100)"))
+
+    price_buffer._buffers["EU"]["fast"].clear()
+    params = {"server": "EU", "type": "fast", "item_names": ["T4_MACE"], "cities": ["lymhurst"]}
+
+    first = await client.get("/items/", params=params)
+    second = await client.get("/items/", params=params)
+    assert first.json() == second.json()
+    assert price_cache.stats()["hits"] == 1
+
+    await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[
+        {"unique_name": "T4_MACE", "price_lymhurst": 250},
+    ])
+    await client.post("/system/flush-buffer")
+
+    third = await client.get("/items/", params=params)
+    assert third.json()[0]["price_lymhurst"] == 250
+
+@pytest.mark.asyncio
+async def test_flush_invalidates_only_written_items(client):
+    """
+    Entries for other items survive a flush; whole-table entries do not.
+    """
+    price_buffer._buffers["US"]["order"].clear()
+
+    await client.get("/items/", params={"server": "US", "type": "order", "item_names": ["T4_OTHER"]})
+    await client.get("/items/", params={"server": "US", "type": "order"})
+    await client.get("/items/", params={"server": "EU", "type": "order"})
+    assert len(price_cache._cache) == 3
+
+    await client.put("/items/prices", params={"server": "US", "type": "order"}, json=[
+        {"unique_name": "T4_WRITTEN", "price_caerleon": 1},
+    ])
+    await client.post("/system/flush-buffer")
+
+    keys = set(price_cache._cache._entries)
+    assert price_cache.make_key("US", "order", ["T4_OTHER"], None) in keys
+    assert price_cache.make_key("EU", "order", None, None) in keys
+    assert price_cache.make_key("US", "order", None, None) not in keys
+
+def test_stale_read_not_stored():
+    """
+    A result read before a flush is not cached if the flush invalidated the table meanwhile.
+    """
+    cache = PriceQueryCache(max_entries=10, ttl=60)
+    key = cache.make_key("AS", "fast", ["T4_ORE"], None)
+
+    generation = cache.generation("AS", "fast")
+    cache.invalidate("AS", "fast", ["T4_ORE"])
+    cache.set(key, ["stale"], generation)
+
+    assert cache.get(key) is MISSING
+
+def test_ttl_cache_evicts_lru_and_expired():
+    now = [0.0]
+    evicted = []
+    cache = TTLCache(max_entries=2, ttl=10, on_evict=evicted.append, clock=lambda: now[0])
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert evicted == ["b"]
+
+    now[0] = 11
+    assert cache.get("a") is MISSING
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
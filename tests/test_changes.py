@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_changes_paginate_and_follow_cursor(client):
+    """
+    The cursor pages through the table, then only returns rows of later flushes.
+    """
+    params = {"server": "EU", "type": "order"}
+
+    # 1. Initial data, paged 2 at a time
+    await client.put("/items/prices", params=params, json=[
+        {"unique_name": f"T4_ITEM_{i}", "price_caerleon": 100 + i} for i in range(5)
+    ])
+    await client.post("/system/flush-buffer")
+
+    seen, cursor = [], None
+    while True:
+        res = await client.get("/items/changes", params={**params, "limit": 2, **({"since": cursor} if cursor else {})})
+        assert res.status_code == 200
+        page = res.json()
+        seen += [row["unique_name"] for row in page["items"]]
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert sorted(seen) == [f"T4_ITEM_{i}" for i in range(5)]
+    assert len(seen) == len(set(seen))
+
+    # 2. Nothing new since the cursor
+    idle = (await client.get("/items/changes", params={**params, "since": cursor})).json()
+    assert idle["items"] == [] and idle["cursor"] == cursor and idle["has_more"] is False
+
+    # 3. A later flush shows up as just the touched rows
+    await client.put("/items/prices", params=params, json=[{"unique_name": "T4_ITEM_3", "price_martlock": 7}])
+    await client.post("/system/flush-buffer")
+
+    delta = (await client.get("/items/changes", params={**params, "since": cursor})).json()
+    assert [row["unique_name"] for row in delta["items"]] == ["T4_ITEM_3"]
+    assert delta["items"][0]["price_martlock"] == 7
+    assert delta["items"][0]["price_caerleon"] == 103
+    assert delta["cursor"] != cursor
+
+@pytest.mark.asyncio
+async def test_changes_are_readable_at_once_and_bad_cursor(client):
+    """
+    Rows of a committed flush are returned right away; a malformed cursor is a 400.
+    """
+    params = {"server": "US", "type": "fast"}
+    await client.put("/items/prices", params=params, json=[{"unique_name": "T4_NEW", "price_lymhurst": 1}])
+    await client.post("/system/flush-buffer")
+
+    page = (await client.get("/items/changes", params=params)).json()
+    assert [row["unique_name"] for row in page["items"]] == ["T4_NEW"]
+
+    res = await client.get("/items/changes", params={**params, "since": "not-a-cursor"})
+    assert res.status_code == 400
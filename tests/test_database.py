@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import storage
+from database import MeteredPool, pool_stats
+
+
+@pytest.mark.asyncio
+async def test_metered_pool_counts_checkouts(tmp_path):
+    """
+    Checkouts, new connections and wait times show up in pool_stats.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pool.db", poolclass=MeteredPool, pool_size=1, max_overflow=0)
+    for _ in range(3):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    stats = pool_stats(engine)
+    await engine.dispose()
+
+    assert stats["pool"] == "MeteredPool"
+    assert stats["checkouts"] == 3
+    # The one pooled connection is reused
+    assert stats["connects"] == 1
+    assert stats["checked_out"] == 0
+    assert stats["max_wait_ms"] >= stats["avg_wait_ms"] > 0
+
+@pytest.mark.asyncio
+async def test_hot_statements_are_built_once(trade_session_factory):
+    """
+    Repeated reads reuse the cached statement object and only change its bind parameters.
+    """
+    wide = storage.WideStorage()
+    async with trade_session_factory() as db:
+        await wide.read_prices(db, "US", "fast", ["T4_BAG"], ["lymhurst"])
+        stmt = storage._statement_cache[("wide_read", "US", "fast", ("lymhurst",), True)]
+        await wide.read_prices(db, "US", "fast", ["T5_BAG", "T6_BAG"], ["lymhurst"])
+        assert storage._statement_cache[("wide_read", "US", "fast", ("lymhurst",), True)] is stmt
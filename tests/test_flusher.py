@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import text
+
+from buffer import PriceUpdateBuffer
+from flusher import BackgroundFlusher
+from schemas import ItemPriceUpdate
+
+
+def make_updates(count, prefix="T4_ITEM"):
+    return [ItemPriceUpdate(unique_name=f"{prefix}_{i}", price_caerleon=100 + i) for i in range(count)]
+
+async def count_rows(engine, table):
+    async with engine.begin() as conn:
+        result = await conn.execute(text(f"SELECT COUNT(*) FROM {table}"))
+        return result.scalar()
+
+@pytest.mark.asyncio
+async def test_flush_due_on_size_threshold(trade_db_engine, trade_session_factory):
+    """
+    Only the bucket that reached max_items is flushed.
+    """
+    buffer = PriceUpdateBuffer()
+    flusher = BackgroundFlusher(buffer, trade_session_factory, max_items=10, max_age=3600)
+
+    await buffer.add_updates("EU", "fast", make_updates(10))
+    await buffer.add_updates("AS", "order", make_updates(3))
+
+    assert flusher.due_buckets() == [("EU", "fast")]
+    assert await flusher.flush_due() == 10
+
+    assert await count_rows(trade_db_engine, "ItemFastEU") == 10
+    assert await count_rows(trade_db_engine, "ItemOrderAS") == 0
+    assert flusher.stats()["last_flush"]["batch_size"] == 10
+
+@pytest.mark.asyncio
+async def test_flush_due_on_age_threshold(trade_db_engine, trade_session_factory):
+    """
+    A small bucket is flushed once its oldest entry passes max_age.
+    """
+    buffer = PriceUpdateBuffer()
+    flusher = BackgroundFlusher(buffer, trade_session_factory, max_items=1000, max_age=0)
+
+    await buffer.add_updates("US", "fast", make_updates(2))
+
+    assert await flusher.flush_due() == 2
+    assert await count_rows(trade_db_engine, "ItemFastUS") == 2
+    assert flusher.due_buckets() == []
+
+@pytest.mark.asyncio
+async def test_stop_drains_buffer(trade_db_engine, trade_session_factory):
+    """
+    Stopping the scheduler writes everything that is still buffered.
+    """
+    buffer = PriceUpdateBuffer()
+    flusher = BackgroundFlusher(buffer, trade_session_factory, max_items=1000, max_age=3600, check_interval=60)
+    flusher.start()
+
+    await buffer.add_updates("EU", "order", make_updates(4))
+    await buffer.add_updates("US", "fast", make_updates(1))
+
+    assert await flusher.stop() == 5
+    assert await count_rows(trade_db_engine, "ItemOrderEU") == 4
+    assert await count_rows(trade_db_engine, "ItemFastUS") == 1
+    assert flusher.stats()["running"] is False
@@ -0,0 +1,80 @@
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+
+from freshness import freshness_counters, FreshnessCounters, _FreshnessTable
+from price_block import PriceBlock, CITY_INDEX, to_epoch_us
+from main import price_buffer
+
+
+def iso(delta_hours):
+    return (datetime.now(timezone.utc) - timedelta(hours=delta_hours)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+@pytest_asyncio.fixture
+async def seeded(trade_db_engine):
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemFastEU (unique_name, price_caerleon, caerleon_updated_at, price_lymhurst) "
+            f"VALUES ('T4_A', 1, '{iso(1)}', 5), ('T4_B', 2, '{iso(10)}', NULL), ('T4_C', 3, '{iso(20)}', NULL)"
+        ))
+        await conn.execute(text(
+            "INSERT INTO ItemOrderEU (unique_name, price_caerleon, caerleon_updated_at) "
+            f"VALUES ('T4_A', 1, '{iso(2)}')"
+        ))
+
+@pytest.mark.asyncio
+async def test_counters_match_sql(client, seeded, trade_session_factory):
+    """
+    The incremental counters give the same answer as the full-table scan, for several windows.
+    """
+    for window in (8, 12, 24):
+        from_sql = (await client.get("/items/prices-up-to-date", params={"server": "EU", "window_hours": window})).json()
+        await freshness_counters.load(trade_session_factory)
+        from_counters = (await client.get("/items/prices-up-to-date", params={"server": "EU", "window_hours": window})).json()
+        freshness_counters.loaded = False
+        assert from_counters == from_sql
+
+    # 8h: caerleon has 2 recent (fast T4_A, order T4_A) of 4; lymhurst has a price but no timestamp
+    sql_8h = (await client.get("/items/prices-up-to-date", params={"server": "EU"})).json()
+    assert sql_8h["caerleon"] == "50%"
+    assert sql_8h["lymhurst"] == "0%"
+
+@pytest.mark.asyncio
+async def test_counters_follow_flushes(client, seeded, trade_session_factory):
+    """
+    A flush moves items into the current bucket without touching the database for the stats.
+    """
+    price_buffer._buffers["EU"]["fast"].clear()
+    await freshness_counters.load(trade_session_factory)
+    try:
+        await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[
+            {"unique_name": "T4_B", "price_caerleon": 7},
+            {"unique_name": "T4_C", "price_caerleon": 8, "price_lymhurst": 9},
+        ])
+        await client.post("/system/flush-buffer")
+
+        res = (await client.get("/items/prices-up-to-date", params={"server": "EU"})).json()
+        assert res["caerleon"] == "100%"
+        assert res["lymhurst"] == "50%"
+    finally:
+        freshness_counters.loaded = False
+
+def test_buckets_roll_forward():
+    """
+    Items drop out of the window as time passes, without any update.
+    """
+    counters = FreshnessCounters(retention_hours=2, bucket_seconds=60)
+    counters._tables = {("AS", "fast"): _FreshnessTable()}
+    counters.loaded = True
+
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    block = PriceBlock()
+    block.set(block.row("T4_X"), CITY_INDEX["martlock"], 10, to_epoch_us(start))
+    counters.on_flush("AS", "fast", block, start)
+
+    martlock = CITY_INDEX["martlock"]
+    assert counters.counts("AS", "fast", 1, now=start + timedelta(minutes=30))[martlock] == (1, 1)
+    assert counters.counts("AS", "fast", 1, now=start + timedelta(minutes=90))[martlock] == (1, 0)
+    assert counters.counts("AS", "fast", 2, now=start + timedelta(hours=5))[martlock] == (1, 0)
+    assert counters.can_answer(3) is False
@@ -0,0 +1,101 @@
+import pytest
+from datetime import datetime, timezone
+
+from history import HistoryRecorder, RESOLUTIONS, price_history
+from main import price_buffer
+from price_block import PriceBlock, CITY_INDEX, to_epoch_us
+
+
+def block_at(stamp: datetime, prices):
+    """prices: {unique_name: {city: price}}, all stamped `stamp`."""
+    block = PriceBlock()
+    for name, cities in prices.items():
+        row = block.row(name)
+        for city, price in cities.items():
+            block.set(row, CITY_INDEX[city], price, to_epoch_us(stamp))
+    return block
+
+@pytest.mark.asyncio
+async def test_flushes_recorded_as_ticks_and_candles(client, trade_session_factory, monkeypatch):
+    """
+    Each flush adds a tick per item/city; candles aggregate them per resolution.
+    """
+    params = {"server": "EU", "type": "fast"}
+    # As main.py registers it with HISTORY_ENABLED=1
+    monkeypatch.setattr(price_buffer, "_flush_listeners", [*price_buffer._flush_listeners, price_history.on_flush])
+
+    # 1. Three flushes of the same item, one of them without a lymhurst price
+    for prices in ({"price_lymhurst": 100}, {"price_lymhurst": 130, "price_caerleon": 5}, {"price_caerleon": 6}, {"price_lymhurst": 90}):
+        await client.put("/items/prices", params=params, json=[{"unique_name": "T4_BAG", **prices}])
+        await client.post("/system/flush-buffer")
+
+    async with trade_session_factory() as db:
+        assert await price_history.write_pending(db) == 5
+
+    # 2. Raw ticks, oldest first
+    res = await client.get("/items/history", params={**params, "item_name": "T4_BAG", "city": "Lymhurst", "resolution": "raw"})
+    assert res.status_code == 200
+    assert [tick["price"] for tick in res.json()] == [100, 130, 90]
+
+    # 3. All ticks fall in one candle per resolution (unless the test straddles a boundary)
+    for resolution in RESOLUTIONS:
+        candles = (await client.get("/items/history", params={**params, "item_name": "T4_BAG", "city": "lymhurst", "resolution": resolution})).json()
+        assert sum(candle["ticks"] for candle in candles) == 3
+        if len(candles) == 1:
+            assert (candles[0]["open"], candles[0]["high"], candles[0]["low"], candles[0]["close"]) == (100, 130, 90, 90)
+
+    res = await client.get("/items/history", params={**params, "item_name": "T4_BAG", "city": "atlantis"})
+    assert res.status_code == 400
+
+@pytest.mark.asyncio
+async def test_late_batch_merges_into_candle(client, trade_session_factory):
+    """
+    A batch with older ticks written after a newer one still sets the candle's open, not its close.
+    """
+    recorder = HistoryRecorder(trade_session_factory)
+    now = datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)
+
+    recorder.on_flush("US", "order", block_at(now.replace(minute=40), {"T5_ORE": {"martlock": 50}}), now)
+    async with trade_session_factory() as db:
+        await recorder.write_pending(db)
+
+    recorder.on_flush("US", "order", block_at(now.replace(minute=10), {"T5_ORE": {"martlock": 70}}), now)
+    recorder.on_flush("US", "order", block_at(now.replace(minute=20), {"T5_ORE": {"martlock": 20}}), now)
+    async with trade_session_factory() as db:
+        await recorder.write_pending(db)
+
+    params = {"server": "US", "type": "order", "item_name": "T5_ORE", "city": "martlock", "resolution": "1h"}
+    (candle,) = (await client.get("/items/history", params=params)).json()
+    assert (candle["open"], candle["high"], candle["low"], candle["close"], candle["ticks"]) == (70, 70, 20, 50, 3)
+
+    # 5 minute candles at 12:10, 12:20 and 12:40
+    candles = (await client.get("/items/history", params={**params, "resolution": "5m"})).json()
+    assert [candle["close"] for candle in candles] == [70, 20, 50]
+    assert recorder.stats()["ticks_written"] == 3
+
+@pytest.mark.asyncio
+async def test_failed_write_keeps_pending_capped(trade_session_factory, monkeypatch):
+    """
+    Blocks put back after a failed write still respect HISTORY_MAX_PENDING_BLOCKS, oldest dropped first.
+    """
+    monkeypatch.setattr("history.HISTORY_MAX_PENDING_BLOCKS", 3)
+    recorder = HistoryRecorder(trade_session_factory)
+    now = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+    for minute in range(3):
+        recorder.on_flush("EU", "fast", block_at(now.replace(minute=minute), {"T4_BAG": {"lymhurst": minute}}), now)
+
+    class BrokenSession:
+        def get_bind(self):
+            raise RuntimeError("database went away")
+
+        async def rollback(self):
+            # More flushes land while the write is failing
+            for minute in (3, 4):
+                recorder.on_flush("EU", "fast", block_at(now.replace(minute=minute), {"T4_BAG": {"lymhurst": minute}}), now)
+
+    with pytest.raises(RuntimeError):
+        await recorder.write_pending(BrokenSession())
+
+    assert recorder.stats()["pending_blocks"] == 3
+    assert recorder.stats()["discarded_blocks"] == 2
+    assert [block.prices[CITY_INDEX["lymhurst"]][0] for _, _, block in recorder._pending] == [2, 3, 4]
@@ -0,0 +1,83 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from hot_table import hot_table
+from main import price_buffer
+
+
+@pytest_asyncio.fixture
+async def loaded_hot_table(trade_db_engine, trade_session_factory):
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemFastEU (unique_name, price_lymhurst, price_thetford) VALUES ('T4_STAFF', 300, 400)"
+        ))
+        await conn.execute(text("INSERT INTO ItemFastEU (unique_name) VALUES ('T5_STAFF')"))
+
+    await hot_table.load(trade_session_factory)
+    yield hot_table
+    hot_table.loaded = False
+    hot_table._tables = {}
+
+def strip_utc(rows):
+    # SQLite hands back naive UTC datetimes, the snapshot aware ones (as Postgres does)
+    return [
+        {key: value.removesuffix("+00:00") if isinstance(value, str) else value for key, value in row.items()}
+        for row in rows
+    ]
+
+@pytest.mark.asyncio
+async def test_hot_table_matches_database(client, trade_db_engine, trade_session_factory):
+    """
+    Once loaded, GET /items/ returns the same rows as the SQL path.
+    """
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemOrderUS (unique_name, price_caerleon, price_brecilien) VALUES ('T4_CLOTH', 10, 20)"
+        ))
+
+    for params in (
+        {"server": "US", "type": "order"},
+        {"server": "US", "type": "order", "item_names": ["T4_CLOTH"], "cities": ["brecilien", "caerleon"]},
+    ):
+        from_db = (await client.get("/items/", params=params)).json()
+        await hot_table.load(trade_session_factory)
+        from_memory = (await client.get("/items/", params=params)).json()
+        hot_table.loaded = False
+        assert strip_utc(from_memory) == strip_utc(from_db)
+
+    hot_table._tables = {}
+
+@pytest.mark.asyncio
+async def test_hot_table_served_without_database(client, trade_db_engine, loaded_hot_table):
+    """
+    Reads come from memory and flushes patch the snapshot in place.
+    """
+    price_buffer._buffers["EU"]["fast"].clear()
+
+    # Remove the rows behind the snapshot's back: reads must not notice
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text("DELETE FROM ItemFastEU"))
+
+    res = await client.get("/items/", params={"server": "EU", "type": "fast", "cities": ["lymhurst", "thetford"]})
+    items = {item["unique_name"]: item for item in res.json()}
+    assert items["T4_STAFF"]["price_thetford"] == 400
+    assert items["T5_STAFF"]["price_lymhurst"] is None
+
+    await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[
+        {"unique_name": "T4_STAFF", "price_lymhurst": 350},
+        {"unique_name": "T6_STAFF", "price_thetford": 999},
+    ])
+    await client.post("/system/flush-buffer")
+
+    res = await client.get("/items/", params={"server": "EU", "type": "fast", "item_names": ["T4_STAFF", "T6_STAFF"]})
+    items = {item["unique_name"]: item for item in res.json()}
+    assert items["T4_STAFF"]["price_lymhurst"] == 350
+    assert items["T4_STAFF"]["price_thetford"] == 400
+    assert items["T4_STAFF"]["lymhurst_updated_at"] is not None
+    assert items["T6_STAFF"]["price_thetford"] == 999
+    assert items["T6_STAFF"]["updated_at"] is not None
+
+    stats = loaded_hot_table.stats()
+    assert stats["rows"]["EU/fast"] == 3
+    assert stats["memory_bytes"]["total"] > 0
@@ -0,0 +1,78 @@
+import pytest
+import pytest_asyncio
+import httpx
+
+from http_client import http_client
+
+
+@pytest_asyncio.fixture
+async def provider_calls(monkeypatch):
+    """Routes the shared client through a MockTransport; tests append a handler per expected call."""
+    handlers, calls = [], []
+
+    def handle(request: httpx.Request):
+        calls.append((request.method, request.url.host, request.url.path))
+        return handlers.pop(0)(request)
+
+    monkeypatch.setattr(http_client, "backoff", 0)
+    await http_client.close()
+    http_client.start(transport=httpx.MockTransport(handle))
+    yield handlers, calls
+    await http_client.close()
+
+@pytest.mark.asyncio
+async def test_discord_login_retries_unsent_request(client, provider_calls):
+    """
+    A connection failure before the code exchange is retried on the shared client.
+    """
+    handlers, calls = provider_calls
+    retries = http_client.counts.get("discord", {}).get("retries", 0)
+
+    def refuse(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    handlers.extend([
+        refuse,
+        lambda request: httpx.Response(200, json={"access_token": "discord-token"}),
+        lambda request: httpx.Response(200, json={"id": 42, "email": "player@test.com"}),
+    ])
+
+    res = await client.get("/login/discord", params={"code": "abc", "state": "http://localhost:8550/callback"})
+
+    assert res.status_code == 303
+    assert calls == [
+        ("POST", "discord.com", "/api/oauth2/token"),
+        ("POST", "discord.com", "/api/oauth2/token"),
+        ("GET", "discord.com", "/api/users/@me"),
+    ]
+    assert http_client.counts["discord"]["retries"] - retries == 1
+
+@pytest.mark.asyncio
+async def test_sent_post_is_not_retried(client, provider_calls, monkeypatch):
+    """
+    A NOWPayments invoice call that timed out after sending is not resent; the client sees 502.
+    """
+    handlers, calls = provider_calls
+    monkeypatch.setenv("NOWPAYMENTS_API_KEY", "test-key")
+
+    def time_out(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    handlers.append(time_out)
+    res = await client.post("/payments/create", params={"user_id": 1}, json={"plan_id": "1_week"})
+
+    assert res.status_code == 502
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_get_retries_unavailable_then_gives_up(provider_calls):
+    """
+    GETs are retried on 503 at most HTTP_RETRIES times, then the last response is returned.
+    """
+    handlers, calls = provider_calls
+    handlers.extend([lambda request: httpx.Response(503)] * 3 + [lambda request: httpx.Response(200)])
+
+    resp = await http_client.get("google", "https://www.googleapis.com/oauth2/v1/userinfo")
+
+    assert resp.status_code == 503
+    assert len(calls) == 3
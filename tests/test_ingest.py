@@ -0,0 +1,140 @@
+import json
+import struct
+import msgpack
+import pytest
+from pydantic import ValidationError
+
+import ingest
+from main import price_buffer
+from schemas import ItemPriceUpdate
+
+
+def ndjson(rows):
+    return b"".join(json.dumps(row).encode() + b"\n" for row in rows)
+
+def msgpack_frames(rows):
+    out = b""
+    for row in rows:
+        packed = msgpack.packb(row)
+        out += struct.pack(">I", len(packed)) + packed
+    return out
+
+@pytest.mark.asyncio
+async def test_stream_ndjson_upload(client):
+    """
+    NDJSON rows are validated one by one; bad rows are reported, good rows reach the DB
+    and unknown fields are dropped.
+    """
+    price_buffer._buffers["EU"]["fast"].clear()
+
+    body = ndjson([
+        {"unique_name": "T4_AXE", "price_caerleon": 100},
+        {"unique_name": "T5_AXE", "price_caerleon": "cheap"},
+        {"unique_name": "T6_AXE", "price_bridgewatch": 300, "colour": "red"},
+        {"unique_name": "T7_AXE", "price_bridgewatch": 400, "price_caerleon": None},
+    ]) + b"{not json\n"
+
+    # Split the body mid-row to make sure lines are reassembled across chunks
+    async def chunks():
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+    res = await client.put(
+        "/items/prices/stream",
+        params={"server": "EU", "type": "fast"},
+        content=chunks(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert res.status_code == 200
+    data = res.json()
+    assert data["accepted"] == 3
+    assert data["rejected"] == 2
+    assert [error["row"] for error in data["errors"]] == [2, 5]
+
+    await client.post("/system/flush-buffer")
+    res = await client.get("/items/", params={"server": "EU", "type": "fast", "cities": ["caerleon", "bridgewatch"]})
+    items = {item["unique_name"]: item for item in res.json()}
+    assert set(items) == {"T4_AXE", "T6_AXE", "T7_AXE"}
+    assert items["T4_AXE"]["price_caerleon"] == 100
+    assert items["T6_AXE"]["price_bridgewatch"] == 300
+    assert items["T7_AXE"]["price_bridgewatch"] == 400
+
+@pytest.mark.asyncio
+async def test_stream_msgpack_upload(client):
+    """
+    Length-prefixed msgpack frames are accepted.
+    """
+    price_buffer._buffers["US"]["order"].clear()
+
+    res = await client.put(
+        "/items/prices/stream",
+        params={"server": "US", "type": "order"},
+        content=msgpack_frames([{"unique_name": f"T4_ROCK_{i}", "price_martlock": i} for i in range(25)]),
+        headers={"Content-Type": "application/x-msgpack"},
+    )
+    assert res.status_code == 200
+    assert res.json()["accepted"] == 25
+    assert len(price_buffer._buffers["US"]["order"]) == 25
+
+@pytest.mark.asyncio
+async def test_stream_rejects_bad_requests(client, monkeypatch):
+    """
+    Unknown content types get 415; a row over the size cap aborts with 413.
+    """
+    import ingest
+    monkeypatch.setattr(ingest, "STREAM_MAX_ROW_BYTES", 64)
+
+    res = await client.put(
+        "/items/prices/stream",
+        params={"server": "EU", "type": "order"},
+        content=b"[]",
+        headers={"Content-Type": "application/json"},
+    )
+    assert res.status_code == 415
+
+    big_frame = struct.pack(">I", 10_000) + b"x" * 100
+    res = await client.put(
+        "/items/prices/stream",
+        params={"server": "EU", "type": "order"},
+        content=msgpack_frames([{"unique_name": "T4_OK", "price_martlock": 1}]) + big_frame,
+        headers={"Content-Type": "application/x-msgpack"},
+    )
+    assert res.status_code == 413
+    assert res.json()["detail"]["accepted"] == 1
+
+def test_validate_row_matches_item_price_update():
+    """
+    The stream fast path accepts and rejects the same rows as the JSON endpoint's
+    model, except for the two cases where it is stricter on purpose.
+    """
+    rows = [
+        {"unique_name": "T4_AXE", "price_caerleon": 100, "price_thetford": None},
+        {"unique_name": "T4_AXE", "price_caerleon": 100, "colour": "red"},
+        {"unique_name": "T4_AXE", "price_caerleon": 12.0},
+        {"unique_name": "T4_AXE", "price_caerleon": "12"},
+        {"unique_name": "T4_AXE", "price_caerleon": " +012 "},
+        {"unique_name": "T4_AXE", "price_caerleon": "1_000"},
+        {"unique_name": "T4_AXE", "price_caerleon": "12.00"},
+        {"unique_name": "T4_AXE", "price_caerleon": 12.5},
+        {"unique_name": "T4_AXE", "price_caerleon": "12.5"},
+        {"unique_name": "T4_AXE", "price_caerleon": "1e3"},
+        {"unique_name": "T4_AXE", "price_caerleon": "cheap"},
+        {"unique_name": "T4_AXE", "price_caerleon": "-1"},
+        {"unique_name": "T4_AXE", "price_caerleon": 2 ** 63},
+        {"unique_name": "T4_AXE", "price_caerleon": [1]},
+        {"unique_name": 4, "price_caerleon": 1},
+        {"price_caerleon": 1},
+    ]
+
+    # 1. Same verdict, and the same prices when accepted
+    for row in rows:
+        try:
+            expected = ItemPriceUpdate(**row).model_dump(exclude_unset=True)
+        except ValidationError:
+            expected = None
+        assert ingest.validate_row(dict(row))[0] == expected, row
+
+    # 2. Stricter on purpose
+    for row in ({"unique_name": "T4_AXE", "price_caerleon": True}, {"unique_name": "", "price_caerleon": 1}):
+        ItemPriceUpdate(**row)
+        assert ingest.validate_row(dict(row))[0] is None
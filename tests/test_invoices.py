@@ -0,0 +1,75 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+import models
+
+
+async def seed_invoices(crypto_db_engine):
+    """Two users, 7 invoices; two share a created_at so the id breaks the tie."""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(models.User.__table__.insert(), [
+            {"id": 1, "username": "a", "email": "a@test.com", "password": "x"},
+            {"id": 2, "username": "b", "email": "b@test.com", "password": "x"},
+        ])
+        await conn.execute(models.Invoice.__table__.insert(), [
+            {"id": 100 + i, "user_id": 1 + i % 2, "status": "waiting", "price_amount": 5.0,
+             "created_at": start + timedelta(minutes=min(i, 5))}
+            for i in range(7)
+        ])
+
+async def get_page(client, **params):
+    """(invoice ids, X-Next-Cursor or None)."""
+    res = await client.get("/invoices/", params=params)
+    assert res.status_code == 200
+    return [invoice["id"] for invoice in res.json()], res.headers.get("x-next-cursor")
+
+@pytest.mark.asyncio
+async def test_invoice_pages_follow_cursor(client, crypto_db_engine):
+    """
+    Pages walk (created_at, id) newest first without gaps or repeats, and survive new invoices.
+    """
+    await seed_invoices(crypto_db_engine)
+
+    # 1. First page: the same bare list as before cursors, the cursor in a header
+    ids, cursor = await get_page(client, limit=3)
+    assert ids == [106, 105, 104]
+    assert cursor is not None
+
+    # 2. A new invoice arrives; the cursor still continues where it stopped
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(models.Invoice.__table__.insert(), [
+            {"id": 200, "user_id": 1, "status": "waiting", "price_amount": 5.0, "created_at": datetime(2026, 2, 1, tzinfo=timezone.utc)},
+        ])
+
+    while cursor:
+        page, cursor = await get_page(client, limit=3, cursor=cursor)
+        ids += page
+    assert ids == [106, 105, 104, 103, 102, 101, 100]
+
+    # 3. Filtered by user
+    ids, cursor = await get_page(client, user_id=2, limit=2)
+    assert ids == [105, 103]
+    ids, cursor = await get_page(client, user_id=2, limit=2, cursor=cursor)
+    assert ids == [101]
+    assert cursor is None
+
+    assert (await client.get("/invoices/", params={"cursor": "not-a-cursor"})).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_invoice_offset_still_works(client, crypto_db_engine):
+    """
+    Clients written before cursors keep working: no parameters, or the deprecated offset.
+    """
+    await seed_invoices(crypto_db_engine)
+
+    # 1. Old clients page by offset and get a list
+    assert (await get_page(client, limit=3, offset=3))[0] == [103, 102, 101]
+    res = await client.get("/invoices/")
+    assert [invoice["id"] for invoice in res.json()] == [106, 105, 104, 103, 102, 101, 100]
+
+    # 2. Mixing both pagination styles is rejected
+    _, cursor = await get_page(client, limit=3)
+    res = await client.get("/invoices/", params={"limit": 3, "offset": 3, "cursor": cursor})
+    assert res.status_code == 400
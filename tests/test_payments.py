@@ -0,0 +1,73 @@
+import hashlib
+import hmac
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+IPN_SECRET = "test-ipn-secret"
+
+
+def signed(payload):
+    """Request kwargs for an IPN signed the way NOWPayments signs it."""
+    body = json.dumps(payload, separators=(',', ':'), sort_keys=True)
+    sig = hmac.new(IPN_SECRET.encode(), body.encode(), hashlib.sha512).hexdigest()
+    return {"content": body, "headers": {"x-nowpayments-sig": sig, "Content-Type": "application/json"}}
+
+async def create_user_with_invoice(client, crypto_db_engine, invoice_id):
+    res = await client.post("/users/", json={"username": f"buyer{invoice_id}", "email": "buyer@test.com", "password": "pass"})
+    user_id = res.json()["id"]
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO Invoice (id, user_id, status, price_amount) VALUES (:id, :user_id, 'waiting', 14.99)"
+        ), {"id": invoice_id, "user_id": user_id})
+    return user_id
+
+@pytest.mark.asyncio
+async def test_webhook_retries_extend_subscription_once(client, crypto_db_engine, monkeypatch):
+    """
+    Duplicate and out-of-order IPNs for one payment extend the subscription exactly once.
+    """
+    monkeypatch.setenv("NOWPAYMENTS_IPN_SECRET", IPN_SECRET)
+    user_id = await create_user_with_invoice(client, crypto_db_engine, 5001)
+
+    def ipn(status):
+        return {"id": 5001, "payment_status": status, "order_id": f"{user_id}::30"}
+
+    # 1. Retries of "finished", with progress updates arriving around and after them
+    ipns = [ipn("finished")] * 5 + [ipn("confirming"), ipn("waiting"), ipn("partially_paid")]
+    random.Random(3).shuffle(ipns)
+    for payload in ipns:
+        res = await client.post("/payments/webhook", **signed(payload))
+        assert res.status_code == 200
+
+    # 2. Thirty days once, and the invoice stays paid
+    status = (await client.get(f"/users/{user_id}/subscription")).json()
+    until = datetime.fromisoformat(status["subscribed_until"])
+    assert timedelta(days=29, hours=23) < until - datetime.now(timezone.utc) <= timedelta(days=30)
+
+    async with crypto_db_engine.connect() as conn:
+        assert (await conn.execute(text("SELECT status FROM Invoice WHERE id = 5001"))).scalar() == "done"
+        assert (await conn.execute(text("SELECT COUNT(*) FROM ProcessedPayment"))).scalar() == 1
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_bad_signature(client, crypto_db_engine, monkeypatch):
+    """
+    An IPN whose signature does not match, or is not even ASCII, changes nothing.
+    """
+    monkeypatch.setenv("NOWPAYMENTS_IPN_SECRET", IPN_SECRET)
+    user_id = await create_user_with_invoice(client, crypto_db_engine, 5002)
+
+    request = signed({"id": 5002, "payment_status": "finished", "order_id": f"{user_id}::30"})
+    request["headers"]["x-nowpayments-sig"] = "0" * 128
+    res = await client.post("/payments/webhook", **request)
+
+    assert res.status_code == 403
+
+    request["headers"]["x-nowpayments-sig"] = "é".encode("latin-1") * 128
+    res = await client.post("/payments/webhook", **request)
+
+    assert res.status_code == 403
+    assert (await client.get(f"/users/{user_id}/subscription")).json()["active"] is False
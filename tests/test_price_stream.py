@@ -0,0 +1,105 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from main import app, price_buffer
+from price_block import PriceBlock, CITY_INDEX, to_epoch_us
+from price_stream import PriceStreamHub, DROPPED, price_stream
+
+
+def make_block(prices):
+    """prices: {unique_name: {city: price}}"""
+    block = PriceBlock()
+    stamp = to_epoch_us(datetime.now(timezone.utc))
+    for name, cities in prices.items():
+        row = block.row(name)
+        for city, price in cities.items():
+            block.set(row, CITY_INDEX[city], price, stamp)
+    return block
+
+@pytest.mark.asyncio
+async def test_hub_filters_items_and_cities():
+    """
+    Each subscriber only gets the changed prices of its items/cities, and nothing when none changed.
+    """
+    hub = PriceStreamHub()
+    everything = hub.subscribe("EU", "fast")
+    martlock_wood = hub.subscribe("EU", "fast", ["T4_WOOD"], ["martlock"])
+    other_table = hub.subscribe("EU", "order")
+
+    block = make_block({"T4_WOOD": {"martlock": 10, "lymhurst": 20}, "T4_ORE": {"lymhurst": 5}})
+    hub.on_flush("EU", "fast", block, datetime.now(timezone.utc))
+
+    full = json.loads(everything.queue.get_nowait())
+    assert [item["unique_name"] for item in full["items"]] == ["T4_WOOD", "T4_ORE"]
+    assert full["items"][1] == {"unique_name": "T4_ORE", "price_lymhurst": 5, "lymhurst_updated_at": full["items"][1]["lymhurst_updated_at"]}
+
+    filtered = json.loads(martlock_wood.queue.get_nowait())
+    assert filtered["items"] == [{"unique_name": "T4_WOOD", "price_martlock": 10, "martlock_updated_at": filtered["items"][0]["martlock_updated_at"]}]
+    assert other_table.queue.empty()
+
+    # 1. A flush that touches none of its cities sends nothing
+    hub.on_flush("EU", "fast", make_block({"T4_WOOD": {"lymhurst": 21}}), datetime.now(timezone.utc))
+    assert martlock_wood.queue.empty()
+    assert hub.stats()["messages_sent"] == 3
+
+@pytest.mark.asyncio
+async def test_hub_drops_slow_consumer():
+    """
+    A subscriber whose queue is full is dropped without affecting the others.
+    """
+    hub = PriceStreamHub(queue_size=2)
+    slow = hub.subscribe("US", "fast")
+    fast = hub.subscribe("US", "fast")
+
+    for price in range(3):
+        hub.on_flush("US", "fast", make_block({"T4_X": {"caerleon": price}}), datetime.now(timezone.utc))
+        while not fast.queue.empty():
+            fast.queue.get_nowait()
+
+    assert slow.dropped and not fast.dropped
+    assert await slow.get() is DROPPED
+    assert hub.stats() == {"subscribers": 1, "messages_sent": 5, "dropped_subscribers": 1, "queue_size": 2}
+
+def test_websocket_receives_flushed_prices():
+    """
+    A WebSocket subscriber receives the prices of a flush and is removed on disconnect.
+    """
+    client = TestClient(app)
+    url = "/items/stream?server=AS&type=order&item_names=T4_WOOD&cities=Fort Sterling"
+    with client.websocket_connect(url) as websocket:
+        assert price_stream.stats()["subscribers"] == 1
+
+        # Flush listeners run on the app's event loop
+        block = make_block({"T4_WOOD": {"fort_sterling": 42, "martlock": 1}, "T4_ORE": {"fort_sterling": 3}})
+        websocket.portal.call(price_buffer._notify_flushed, "AS", "order", block, datetime.now(timezone.utc))
+
+        message = websocket.receive_json()
+        assert message["server"] == "AS" and message["type"] == "order"
+        assert [(item["unique_name"], item["price_fort_sterling"]) for item in message["items"]] == [("T4_WOOD", 42)]
+        assert "price_martlock" not in message["items"][0]
+
+    assert price_stream.stats()["subscribers"] == 0
+
+def test_websocket_rejects_invalid_city():
+    client = TestClient(app)
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect("/items/stream?server=EU&cities=atlantis"):
+            pass
+    assert exc.value.code == 1008
+
+def test_websocket_closes_on_send_timeout(monkeypatch):
+    """
+    A send that outlives PRICE_STREAM_SEND_TIMEOUT_SECONDS closes the socket with 1013.
+    """
+    monkeypatch.setattr("main.PRICE_STREAM_SEND_TIMEOUT_SECONDS", 0)
+    client = TestClient(app)
+    with client.websocket_connect("/items/stream?server=EU&type=fast") as websocket:
+        block = make_block({"T4_WOOD": {"lymhurst": 1}})
+        websocket.portal.call(price_buffer._notify_flushed, "EU", "fast", block, datetime.now(timezone.utc))
+        with pytest.raises(WebSocketDisconnect) as exc:
+            websocket.receive_json()
+        assert exc.value.code == 1013
+    assert price_stream.stats()["subscribers"] == 0
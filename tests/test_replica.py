@@ -0,0 +1,120 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import models
+from database import Base
+from dependencies import get_trade_db, get_trade_read_db
+from main import app
+from replica import ReplicaRouter
+
+
+async def seed(engine, price):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(models.ItemFastEU.__table__.insert(), [
+            {"unique_name": "T4_BAG", "price_lymhurst": price, "price_black_market": 1000}
+        ])
+
+async def read_price(client):
+    """Lymhurst price of T4_BAG through /items/arbitrage, an uncached replica-routed read."""
+    response = await client.get("/items/arbitrage", params={"server": "EU", "source": "lymhurst", "destination": "black_market"})
+    assert response.status_code == 200
+    return response.json()[0]["buy_price"]
+
+@pytest.fixture
+def route_reads():
+    """Sends the read-only endpoints through the given router for one test."""
+    previous = app.dependency_overrides[get_trade_read_db]
+
+    def install(router):
+        async def override():
+            async with router.session() as session:
+                yield session
+        app.dependency_overrides[get_trade_read_db] = override
+
+    yield install
+    app.dependency_overrides[get_trade_read_db] = previous
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica_until_it_lags(client, trade_db_engine, trade_session_factory, tmp_path, route_reads):
+    """
+    Reads use the replica while its lag is within bounds, and the primary once it falls behind.
+    """
+    replica_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    await seed(trade_db_engine, 100)
+    await seed(replica_engine, 90)
+
+    lag = {"seconds": 0.5}
+
+    async def lag_probe(db):
+        return lag["seconds"]
+
+    router = ReplicaRouter(
+        trade_session_factory, async_sessionmaker(replica_engine, expire_on_commit=False),
+        max_lag=1.0, check_interval=0, lag_probe=lag_probe,
+    )
+    route_reads(router)
+
+    # 1. Replica within bounds
+    assert await read_price(client) == 90
+
+    # 2. Replica falls behind
+    lag["seconds"] = 5.0
+    assert await read_price(client) == 100
+
+    # 3. Caught up again
+    lag["seconds"] = 0.0
+    assert await read_price(client) == 90
+
+    stats = router.stats()
+    assert (stats["replica_sessions"], stats["primary_sessions"], stats["lag_fallbacks"]) == (2, 1, 1)
+    await replica_engine.dispose()
+
+@pytest.mark.asyncio
+async def test_replica_errors_fall_back_to_primary(client, trade_db_engine, trade_session_factory, tmp_path, route_reads):
+    """
+    A replica that errors is skipped for retry_after seconds.
+    """
+    replica_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    await seed(trade_db_engine, 100)
+    await seed(replica_engine, 90)
+
+    router = ReplicaRouter(
+        trade_session_factory, async_sessionmaker(replica_engine, expire_on_commit=False),
+        check_interval=3600, retry_after=3600,
+    )
+    route_reads(router)
+    assert await read_price(client) == 90
+
+    # 1. The replica loses its table: the request routed there fails...
+    async with replica_engine.begin() as conn:
+        await conn.execute(text('DROP TABLE "ItemFastEU"'))
+    with pytest.raises(Exception):
+        await read_price(client)
+
+    # 2. ...and the next ones read from the primary
+    assert await read_price(client) == 100
+    assert router.stats()["error_fallbacks"] == 1
+    assert router.stats()["healthy"] is False
+
+    # 3. An unreachable replica is caught by the health check itself
+    unreachable = ReplicaRouter(
+        trade_session_factory,
+        async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db")),
+    )
+    route_reads(unreachable)
+    assert await read_price(client) == 100
+    assert unreachable.stats()["error_fallbacks"] == 1
+    await replica_engine.dispose()
+
+def test_cached_endpoints_read_from_primary():
+    """
+    Endpoints that fill a cache never take a replica session, so a lagging replica
+    cannot pin pre-flush rows in the cache.
+    """
+    for path in ("/items/", "/items/snapshot"):
+        route = next(route for route in app.routes if getattr(route, "path", None) == path)
+        calls = {dependency.call for dependency in route.dependant.dependencies}
+        assert get_trade_db in calls
+        assert get_trade_read_db not in calls
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from main import prices_flight, freshness_flight
+from storage import price_storage
+
+
+@pytest.mark.asyncio
+async def test_identical_reads_share_one_query(client, monkeypatch):
+    """
+    Concurrent identical GET /items/ and /items/prices-up-to-date requests run one query each.
+    """
+    calls = {"read_prices": 0, "count_fresh": 0}
+    release = asyncio.Event()
+
+    async def slow_read_prices(db, server, type_, item_names, city_slugs):
+        calls["read_prices"] += 1
+        await release.wait()
+        return [{"unique_name": "T4_BAG", "price_lymhurst": 100}]
+
+    async def slow_count_fresh(db, server, type_, cutoff_time):
+        calls["count_fresh"] += 1
+        await release.wait()
+        return [(2, 1)] * 8
+
+    monkeypatch.setattr(price_storage, "read_prices", slow_read_prices)
+    monkeypatch.setattr(price_storage, "count_fresh", slow_count_fresh)
+    items_before, freshness_before = prices_flight.coalesced, freshness_flight.coalesced
+
+    # 1. Ten bots poll at once; a different query still runs on its own
+    requests = [client.get("/items/", params={"server": "EU", "type": "fast"}) for _ in range(10)]
+    requests.append(client.get("/items/", params={"server": "US", "type": "fast"}))
+    requests += [client.get("/items/prices-up-to-date", params={"server": "EU", "window_hours": 2}) for _ in range(5)]
+    pending = asyncio.gather(*requests)
+    await asyncio.sleep(0.05)
+    release.set()
+    responses = await pending
+
+    assert calls == {"read_prices": 2, "count_fresh": 2}  # fast + order tables, once
+    assert {response.status_code for response in responses} == {200}
+    assert len({response.content for response in responses[:10]}) == 1
+    assert responses[0].json() == [{"unique_name": "T4_BAG", "price_lymhurst": 100}]
+    assert responses[-1].json()["lymhurst"] == "50%"
+
+    assert prices_flight.coalesced - items_before == 9
+    assert freshness_flight.coalesced - freshness_before == 4
+    assert len(prices_flight) == 0
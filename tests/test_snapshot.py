@@ -0,0 +1,90 @@
+import pytest
+from sqlalchemy import text
+
+import snapshot
+from main import price_buffer
+from price_block import NULL
+from storage import price_storage
+
+
+@pytest.mark.asyncio
+async def test_snapshot_roundtrip_and_etag(client, trade_db_engine):
+    """
+    The snapshot decodes to the table contents, and If-None-Match returns 304 until the next flush.
+    """
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemOrderAS (unique_name, price_martlock, price_caerleon) VALUES ('T4_WOOD', 11, 22), ('T5_WOOD', NULL, 33)"
+        ))
+
+    price_buffer._buffers["AS"]["order"].clear()
+    params = {"server": "AS", "type": "order"}
+
+    res = await client.get("/items/snapshot", params=params)
+    assert res.status_code == 200
+    assert res.headers["content-encoding"] == "gzip"
+    etag = res.headers["etag"]
+
+    header, names, columns = snapshot.decode(res.content)
+    assert header["rows"] == 2
+    rows = dict(zip(names, range(len(names))))
+    assert columns["price_martlock"][rows["T4_WOOD"]] == 11
+    assert columns["price_martlock"][rows["T5_WOOD"]] == NULL
+    assert columns["price_caerleon"][rows["T5_WOOD"]] == 33
+
+    unchanged = await client.get("/items/snapshot", params=params, headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+
+    await client.put("/items/prices", params=params, json=[{"unique_name": "T4_WOOD", "price_martlock": 12}])
+    await client.post("/system/flush-buffer")
+
+    changed = await client.get("/items/snapshot", params={**params, "compression": "none"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert "content-encoding" not in changed.headers
+
+    header, names, columns = snapshot.decode(changed.content)
+    assert columns["price_martlock"][names.index("T4_WOOD")] == 12
+    assert columns["martlock_updated_at"][names.index("T4_WOOD")] != NULL
+
+@pytest.mark.asyncio
+async def test_snapshot_other_table_etag_unaffected(client):
+    """
+    A flush of one table leaves the ETag of the others alone.
+    """
+    eu = await client.get("/items/snapshot", params={"server": "EU", "type": "fast"})
+
+    await client.put("/items/prices", params={"server": "US", "type": "fast"}, json=[{"unique_name": "T4_X", "price_martlock": 1}])
+    await client.post("/system/flush-buffer")
+
+    again = await client.get("/items/snapshot", params={"server": "EU", "type": "fast"}, headers={"If-None-Match": eu.headers["etag"]})
+    assert again.status_code == 304
+
+@pytest.mark.asyncio
+async def test_snapshot_sees_writes_from_other_instances(client, trade_session_factory):
+    """
+    The ETag is the table's version in the database, so another process's write changes
+    it even when it moves neither the row count nor the latest updated_at.
+    """
+    params = {"server": "EU", "type": "order"}
+    await client.put("/items/prices", params=params, json=[
+        {"unique_name": "T4_ORE", "price_lymhurst": 5},
+        {"unique_name": "T5_ORE", "price_lymhurst": 9},
+    ])
+    await client.post("/system/flush-buffer")
+    first = await client.get("/items/snapshot", params=params)
+
+    # Another instance's write: same row count, older stamp, nothing in this process hears about it
+    async with trade_session_factory() as db:
+        await price_storage.begin_write(db, "EU", "order")
+        await db.execute(text(
+            "UPDATE ItemOrderEU SET price_lymhurst = 6, updated_at = '2020-01-01 00:00:00' WHERE unique_name = 'T4_ORE'"
+        ))
+        await db.commit()
+
+    res = await client.get("/items/snapshot", params=params, headers={"If-None-Match": first.headers["etag"]})
+    assert res.status_code == 200
+    assert res.headers["etag"] != first.headers["etag"]
+    _, names, columns = snapshot.decode(res.content)
+    assert columns["price_lymhurst"][names.index("T4_ORE")] == 6
@@ -0,0 +1,100 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from buffer import PriceUpdateBuffer
+from schemas import ItemPriceUpdate
+from storage import WideStorage, LongStorage
+from migrate_to_long import copy_to_long
+
+WIDE, LONG = WideStorage(), LongStorage()
+
+UPDATES = [
+    [
+        ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=100, price_black_market=400),
+        ItemPriceUpdate(unique_name="T5_BAG", price_lymhurst=1000, price_caerleon=7),
+        ItemPriceUpdate(unique_name="T6_BAG", price_martlock=3),
+    ],
+    # Second flush only touches some cities
+    [
+        ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=90),
+        ItemPriceUpdate(unique_name="T5_BAG", price_black_market=1800),
+    ],
+]
+
+
+async def flush_into(storage, session_factory):
+    buffer = PriceUpdateBuffer(storage=storage)
+    for updates in UPDATES:
+        await buffer.add_updates("EU", "order", updates)
+        async with session_factory() as db:
+            await buffer.flush(db)
+
+
+def prices_only(rows):
+    """Rows by name without timestamps or null prices, for comparing layouts."""
+    return {
+        row["unique_name"]: {key: value for key, value in row.items() if key.startswith("price_") and value is not None}
+        for row in rows
+    }
+
+@pytest.mark.asyncio
+async def test_wide_and_long_layouts_agree(trade_session_factory):
+    """
+    The same flushes give the same reads, counts, routes and changes in both layouts.
+    """
+    await flush_into(WIDE, trade_session_factory)
+    await flush_into(LONG, trade_session_factory)
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    async with trade_session_factory() as db:
+        for item_names, cities in ((None, None), (["T4_BAG", "T6_BAG"], None), (None, ["lymhurst", "black_market"])):
+            wide = await WIDE.read_prices(db, "EU", "order", item_names, cities)
+            long = await LONG.read_prices(db, "EU", "order", item_names, cities)
+            # The long layout leaves out items with no price in the requested cities
+            expected = {name: prices for name, prices in prices_only(wide).items() if prices or not cities}
+            assert prices_only(long) == expected
+
+        full = {row["unique_name"]: row for row in await LONG.read_prices(db, "EU", "order", None, None)}
+        assert list(full["T4_BAG"]) == list((await WIDE.read_prices(db, "EU", "order", ["T4_BAG"], None))[0])
+        assert full["T4_BAG"]["price_lymhurst"] == 90 and full["T4_BAG"]["price_black_market"] == 400
+
+        assert await LONG.count_fresh(db, "EU", "order", cutoff) == await WIDE.count_fresh(db, "EU", "order", cutoff)
+
+        wide_table = await WIDE.load_table(db, "EU", "order")
+        long_table = await LONG.load_table(db, "EU", "order")
+        assert sorted(item[:2] for item in long_table.block.iter_items()) == sorted(item[:2] for item in wide_table.block.iter_items())
+
+        for sort_by in ("spread", "margin"):
+            options = dict(limit=10, sort_by=sort_by, min_price=0, max_age_hours=1)
+            routes = [
+                [(route["unique_name"], route["spread"]) for route in await storage.top_routes(db, "EU", "order", "lymhurst", "black_market", **options)]
+                for storage in (WIDE, LONG)
+            ]
+            assert routes[0] == routes[1] == [("T5_BAG", 800), ("T4_BAG", 310)][::1 if sort_by == "spread" else -1]
+
+        for storage in (WIDE, LONG):
+            rows, key, has_more = await storage.fetch_changes(db, "EU", "order", None, limit=2)
+            assert len(key) == storage.key_length and has_more
+            rest, _, has_more = await storage.fetch_changes(db, "EU", "order", key, limit=100)
+            assert not has_more
+            names = {row["unique_name"] for row in rows + rest}
+            assert names == {"T4_BAG", "T5_BAG", "T6_BAG"}
+
+@pytest.mark.asyncio
+async def test_migrate_to_long_copies_wide_tables(trade_db_engine, trade_session_factory):
+    """
+    copy_to_long reproduces the wide tables in ItemPrice, and can be re-run.
+    """
+    await flush_into(WIDE, trade_session_factory)
+
+    for _ in range(2):
+        async with trade_db_engine.begin() as conn:
+            copied = await copy_to_long(conn)
+    assert copied["ItemOrderEU"] == 6
+    assert copied["ItemFastEU"] == 0
+
+    async with trade_session_factory() as db:
+        wide = await WIDE.read_prices(db, "EU", "order", None, None)
+        long = await LONG.read_prices(db, "EU", "order", None, None)
+        assert prices_only(long) == prices_only(wide)
+        assert {row["unique_name"]: row["updated_at"] for row in long} == {row["unique_name"]: row["updated_at"] for row in wide}
@@ -9,10 +9,10 @@ async def test_update_price_flow_fast(client, trade_db_engine):
     """
     # 1. SEED DATA (ItemFast)
     async with trade_db_engine.begin() as conn:
-        await conn.execute(text("INSERT INTO ItemFast (unique_name) VALUES ('T4_SWORD')"))
+        await conn.execute(text("INSERT INTO ItemFastEU (unique_name) VALUES ('T4_SWORD')"))
 
     # 2. Clear buffer
-    price_buffer._buffers["fast"].clear()
+    price_buffer._buffers["EU"]["fast"].clear()
 
     # 3. Send Price Update (type=fast)
     payload = [{
@@ -20,7 +20,7 @@ async def test_update_price_flow_fast(client, trade_db_engine):
         "price_caerleon": 1000,
         "price_martlock": 2000
     }]
-    response = await client.put("/items/prices", params={"type": "fast"}, json=payload)
+    response = await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=payload)
     assert response.status_code == 200
 
     # 4. Trigger Flush
@@ -29,7 +29,7 @@ async def test_update_price_flow_fast(client, trade_db_engine):
     assert flush_res.json()["flushed_items"] > 0
 
     # 5. Verify Data (ItemFast)
-    final_res = await client.get("/items/", params={"item_names": ["T4_SWORD"], "type": "fast"})
+    final_res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_SWORD"], "type": "fast"})
     items = final_res.json()
     assert len(items) > 0
     item = items[0]
@@ -45,17 +45,17 @@ async def test_update_price_flow_order(client, trade_db_engine):
     """
     # 1. SEED DATA (ItemOrder)
     async with trade_db_engine.begin() as conn:
-        await conn.execute(text("INSERT INTO ItemOrder (unique_name) VALUES ('T4_BOW')"))
+        await conn.execute(text("INSERT INTO ItemOrderEU (unique_name) VALUES ('T4_BOW')"))
 
     # 2. Clear buffer
-    price_buffer._buffers["order"].clear()
+    price_buffer._buffers["EU"]["order"].clear()
 
     # 3. Send Price Update (type=order)
     payload = [{
         "unique_name": "T4_BOW",
         "price_lymhurst": 500
     }]
-    response = await client.put("/items/prices", params={"type": "order"}, json=payload)
+    response = await client.put("/items/prices", params={"server": "EU", "type": "order"}, json=payload)
     assert response.status_code == 200
 
     # 4. Trigger Flush
@@ -63,7 +63,7 @@ async def test_update_price_flow_order(client, trade_db_engine):
     assert flush_res.status_code == 200
 
     # 5. Verify Data (ItemOrder)
-    final_res = await client.get("/items/", params={"item_names": ["T4_BOW"], "type": "order"})
+    final_res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_BOW"], "type": "order"})
     items = final_res.json()
     assert len(items) > 0
     
@@ -77,18 +77,18 @@ async def test_buffer_merging(client, trade_db_engine):
     """
     # 1. SEED DATA
     async with trade_db_engine.begin() as conn:
-        await conn.execute(text("INSERT INTO ItemFast (unique_name) VALUES ('T4_SHIELD')"))
+        await conn.execute(text("INSERT INTO ItemFastEU (unique_name) VALUES ('T4_SHIELD')"))
 
-    price_buffer._buffers["fast"].clear()
+    price_buffer._buffers["EU"]["fast"].clear()
 
     # User 1 sends Caerleon price
-    await client.put("/items/prices", params={"type": "fast"}, json=[{
+    await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[{
         "unique_name": "T4_SHIELD",
         "price_caerleon": 500
     }])
 
     # User 2 sends Martlock price (same item)
-    await client.put("/items/prices", params={"type": "fast"}, json=[{
+    await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[{
         "unique_name": "T4_SHIELD",
         "price_martlock": 600
     }])
@@ -97,7 +97,7 @@ async def test_buffer_merging(client, trade_db_engine):
     await client.post("/system/flush-buffer")
 
     # Check DB
-    res = await client.get("/items/", params={"item_names": ["T4_SHIELD"], "type": "fast"})
+    res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_SHIELD"], "type": "fast"})
     data = res.json()[0]
     
     assert data["price_caerleon"] == 500
@@ -111,11 +111,11 @@ async def test_get_prices_city_filter(client, trade_db_engine):
     # 1. SEED DATA
     async with trade_db_engine.begin() as conn:
         await conn.execute(text(
-            "INSERT INTO ItemFast (unique_name, price_lymhurst, price_thetford) VALUES ('T4_HELM', 300, 400)"
+            "INSERT INTO ItemFastEU (unique_name, price_lymhurst, price_thetford) VALUES ('T4_HELM', 300, 400)"
         ))
 
     # 2. Get with City Filter (Note: using 'cities' list param)
-    res = await client.get("/items/", params={"item_names": ["T4_HELM"], "cities": ["lymhurst"], "type": "fast"})
+    res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_HELM"], "cities": ["lymhurst"], "type": "fast"})
     assert res.status_code == 200
     data = res.json()[0]
 
@@ -134,11 +134,11 @@ async def test_get_prices_multiple_cities(client, trade_db_engine):
     # 1. SEED DATA
     async with trade_db_engine.begin() as conn:
         await conn.execute(text(
-            "INSERT INTO ItemFast (unique_name, price_lymhurst, price_thetford, price_martlock) VALUES ('T4_BOOTS', 100, 200, 300)"
+            "INSERT INTO ItemFastEU (unique_name, price_lymhurst, price_thetford, price_martlock) VALUES ('T4_BOOTS', 100, 200, 300)"
         ))
 
     # 2. Get with Multiple Cities
-    res = await client.get("/items/", params={"item_names": ["T4_BOOTS"], "cities": ["lymhurst", "martlock"], "type": "fast"})
+    res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_BOOTS"], "cities": ["lymhurst", "martlock"], "type": "fast"})
     assert res.status_code == 200
     data = res.json()[0]
 
@@ -148,4 +148,74 @@ async def test_get_prices_multiple_cities(client, trade_db_engine):
     assert data["price_martlock"] == 300
     
     # Ensure unrequested city is NOT present
-    assert "price_thetford" not in data
\ No newline at end of file
+    assert "price_thetford" not in data
+
+@pytest.mark.asyncio
+async def test_flush_upsert_keeps_missing_cities(client, trade_db_engine):
+    """
+    Cities absent from an update must keep their stored price, and unknown items are inserted.
+    """
+    # 1. SEED DATA
+    async with trade_db_engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO ItemFastEU (unique_name, price_lymhurst, price_thetford) VALUES ('T4_CAPE', 100, 200)"
+        ))
+
+    price_buffer._buffers["EU"]["fast"].clear()
+
+    # 2. Update one existing city and push a brand new item
+    await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[
+        {"unique_name": "T4_CAPE", "price_lymhurst": 150},
+        {"unique_name": "T5_CAPE", "price_thetford": 900},
+    ])
+    flush_res = await client.post("/system/flush-buffer")
+    assert flush_res.json()["flushed_items"] == 2
+
+    # 3. Verify
+    res = await client.get("/items/", params={"server": "EU", "item_names": ["T4_CAPE", "T5_CAPE"], "type": "fast"})
+    items = {item["unique_name"]: item for item in res.json()}
+
+    assert items["T4_CAPE"]["price_lymhurst"] == 150
+    assert items["T4_CAPE"]["price_thetford"] == 200
+    assert items["T4_CAPE"]["lymhurst_updated_at"] is not None
+    assert items["T5_CAPE"]["price_thetford"] == 900
+    assert items["T5_CAPE"]["price_lymhurst"] is None
+
+@pytest.mark.asyncio
+async def test_flush_upsert_multiple_batches(client, monkeypatch):
+    """
+    A flush larger than the upsert batch size is split over several statements.
+    """
+    import storage
+    monkeypatch.setattr(storage, "UPSERT_BATCH_SIZE", 7)
+
+    price_buffer._buffers["EU"]["order"].clear()
+
+    payload = [{"unique_name": f"T4_ITEM_{i}", "price_martlock": i} for i in range(50)]
+    await client.put("/items/prices", params={"server": "EU", "type": "order"}, json=payload)
+
+    flush_res = await client.post("/system/flush-buffer")
+    assert flush_res.json()["flushed_items"] == 50
+
+    res = await client.get("/items/", params={"server": "EU", "type": "order", "cities": ["martlock"]})
+    prices = {item["unique_name"]: item["price_martlock"] for item in res.json()}
+    assert len(prices) == 50
+    assert prices["T4_ITEM_42"] == 42
+
+@pytest.mark.asyncio
+async def test_update_price_rejects_out_of_range(client):
+    """
+    Prices outside 0..2**63-1 get a 422 and never reach the buffer.
+    """
+    import ingest
+    price_buffer._buffers["EU"]["fast"].clear()
+
+    for price in (2 ** 63, -(2 ** 63), -1):
+        res = await client.put("/items/prices", params={"server": "EU", "type": "fast"}, json=[
+            {"unique_name": "T4_OK", "price_lymhurst": 10},
+            {"unique_name": "T4_BAD", "price_lymhurst": price},
+        ])
+        assert res.status_code == 422
+        assert ingest.validate_row({"unique_name": "T4_BAD", "price_lymhurst": price})[0] is None
+
+    assert len(price_buffer._buffers["EU"]["fast"]) == 0
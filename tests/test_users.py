@@ -55,4 +55,40 @@ async def test_subscription_logic(client):
     sub_res_2 = await client.post(f"/users/{user_id}/subscription/add", json={"days": 30})
     sub_until_2 = datetime.fromisoformat(sub_res_2.json()["subscribed_until"])
     
-    assert sub_until_2 > now_utc + timedelta(days=59)
\ No newline at end of file
+    assert sub_until_2 > now_utc + timedelta(days=59)
+
+
+@pytest.mark.asyncio
+async def test_user_cache_invalidated_on_writes(client, crypto_db_engine):
+    """
+    User reads are served from the cache until a write path invalidates the entry.
+    """
+    from sqlalchemy import text
+    from user_cache import user_cache
+
+    res = await client.post("/users/", json={"username": "cached", "email": "cached@test.com", "password": "pass"})
+    user_id = res.json()["id"]
+
+    # 1. Second read is a hit, even though the row changed behind the cache's back
+    assert (await client.get(f"/users/{user_id}")).json()["username"] == "cached"
+    async with crypto_db_engine.begin() as conn:
+        await conn.execute(text('UPDATE "User" SET username = \'renamed\' WHERE id = :id'), {"id": user_id})
+    assert (await client.get(f"/users/{user_id}")).json()["username"] == "cached"
+    hits, invalidations = user_cache.stats()["hits"], user_cache.stats()["invalidations"]
+
+    # 2. Writes through the API invalidate
+    await client.patch(f"/users/{user_id}", json={"username": "patched"})
+    assert (await client.get(f"/users/{user_id}")).json()["username"] == "patched"
+
+    status = (await client.get(f"/users/{user_id}/subscription")).json()
+    assert status["active"] is False
+    await client.post(f"/users/{user_id}/subscription/add", json={"days": 3})
+    status = (await client.get(f"/users/{user_id}/subscription")).json()
+    assert status["active"] is True
+    await client.delete(f"/users/{user_id}/subscription")
+    assert (await client.get(f"/users/{user_id}/subscription")).json()["active"] is False
+
+    stats = user_cache.stats()
+    assert stats["hits"] > hits
+    assert stats["invalidations"] - invalidations == 3
+    assert (await client.get("/users/999999/subscription")).status_code == 404
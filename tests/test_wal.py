@@ -0,0 +1,136 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import text
+
+from buffer import PriceUpdateBuffer
+from schemas import ItemPriceUpdate
+from wal import PriceWAL
+
+
+def segment_files(directory):
+    return sorted(
+        os.path.join(bucket, name)
+        for bucket in os.listdir(directory)
+        for name in os.listdir(os.path.join(directory, bucket))
+    )
+
+@pytest.mark.asyncio
+async def test_wal_replays_unflushed_updates(tmp_path, trade_db_engine, trade_session_factory):
+    """
+    Updates acknowledged before a crash are replayed by the next process and flushed.
+    """
+    # 1. One process ingests (concurrent writers share a commit) and dies without flushing
+    wal = PriceWAL(str(tmp_path), group_commit_ms=5)
+    crashed = PriceUpdateBuffer(wal=wal)
+    await crashed.add_updates("EU", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=100)])
+    await crashed.add_updates("EU", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_lymhurst=120, price_martlock=7)])
+    await crashed.add_rows("US", "order", [{"unique_name": "T5_ORE", "price_thetford": 9}])
+    assert wal.records == 3
+    assert segment_files(tmp_path) == [os.path.join("EU-fast", "000000000000.wal"), os.path.join("US-order", "000000000000.wal")]
+
+    # 2. The next process replays the log in order and flushes it
+    restarted = PriceUpdateBuffer(wal=PriceWAL(str(tmp_path)))
+    assert restarted.replay_wal() == 3
+    async with trade_session_factory() as db:
+        assert await restarted.flush(db) == 2
+
+    async with trade_db_engine.connect() as conn:
+        bag = (await conn.execute(text("SELECT price_lymhurst, price_martlock FROM ItemFastEU WHERE unique_name = 'T4_BAG'"))).one()
+        ore = (await conn.execute(text("SELECT price_thetford FROM ItemOrderUS WHERE unique_name = 'T5_ORE'"))).scalar()
+    assert tuple(bag) == (120, 7)
+    assert ore == 9
+
+    # 3. Flushed segments are gone: a third start has nothing to replay
+    assert segment_files(tmp_path) == []
+    assert PriceUpdateBuffer(wal=PriceWAL(str(tmp_path))).replay_wal() == 0
+
+@pytest.mark.asyncio
+async def test_wal_ignores_torn_record(tmp_path):
+    """
+    A record cut short by a crash ends the replay of its segment instead of failing startup.
+    """
+    wal = PriceWAL(str(tmp_path), group_commit_ms=0)
+    buffer = PriceUpdateBuffer(wal=wal)
+    await buffer.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T4_BAG", price_bridgewatch=5)])
+    await buffer.add_updates("AS", "fast", [ItemPriceUpdate(unique_name="T6_BAG", price_bridgewatch=6)])
+
+    path = tmp_path / "AS-fast" / "000000000000.wal"
+    path.write_bytes(path.read_bytes()[:-3])
+
+    restarted = PriceUpdateBuffer(wal=PriceWAL(str(tmp_path)))
+    assert restarted.replay_wal() == 1
+    assert restarted._buffers["AS"]["fast"].active.names == ["T4_BAG"]
+
+@pytest.mark.asyncio
+async def test_failed_flush_requeues_blocks(tmp_path, trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    A failed flush puts its blocks back under newer updates and keeps their WAL segments.
+    """
+    buffer = PriceUpdateBuffer(wal=PriceWAL(str(tmp_path), group_commit_ms=0))
+    await buffer.add_updates("EU", "order", [
+        ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=10, price_lymhurst=11),
+        ItemPriceUpdate(unique_name="T5_BAG", price_caerleon=20),
+    ])
+
+    # 1. The database write fails
+    async def broken_write_block(db, server, type_, block, flushed_at=None, newer_only=False):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(buffer.storage, "write_block", broken_write_block)
+    async with trade_session_factory() as db:
+        assert await buffer.flush(db) == 0
+    assert buffer.failed_flushes == 1
+    assert buffer.bucket_stats()[1]["size"] == 2
+
+    # 2. A newer caerleon price arrives before the retry and wins
+    await buffer.add_updates("EU", "order", [ItemPriceUpdate(unique_name="T4_BAG", price_caerleon=15)])
+    assert len(segment_files(tmp_path)) == 2
+
+    monkeypatch.undo()
+    async with trade_session_factory() as db:
+        assert await buffer.flush(db) == 2
+
+    async with trade_db_engine.connect() as conn:
+        rows = (await conn.execute(text("SELECT unique_name, price_caerleon, price_lymhurst FROM ItemOrderEU ORDER BY unique_name"))).all()
+    assert [tuple(row) for row in rows] == [("T4_BAG", 15, 11), ("T5_BAG", 20, None)]
+    assert segment_files(tmp_path) == []
+
+@pytest.mark.asyncio
+async def test_overlapping_flushes_keep_uncommitted_segments(tmp_path, trade_db_engine, trade_session_factory, monkeypatch):
+    """
+    A second flush of a bucket waits for the first one, so it cannot release WAL
+    segments whose records the first flush has not committed yet.
+    """
+    buffer = PriceUpdateBuffer(wal=PriceWAL(str(tmp_path), group_commit_ms=0))
+    original_flush_data = buffer._flush_data
+    unblock = asyncio.Event()
+
+    async def stuck_flush_data(db, server, type_, block, flushed_at=None):
+        if "T4_FIRST" in block:
+            await unblock.wait()
+        return await original_flush_data(db, server, type_, block, flushed_at)
+
+    monkeypatch.setattr(buffer, "_flush_data", stuck_flush_data)
+
+    async with trade_session_factory() as db:
+        # 1. The background flush is stuck in the database
+        await buffer.add_updates("US", "fast", [ItemPriceUpdate(unique_name="T4_FIRST", price_caerleon=1)])
+        first = asyncio.create_task(buffer.flush(db, [("US", "fast")]))
+        await asyncio.sleep(0.01)
+
+        # 2. A manual flush of the same bucket starts meanwhile; the first record stays on disk
+        await buffer.add_updates("US", "fast", [ItemPriceUpdate(unique_name="T4_SECOND", price_caerleon=2)])
+        second = asyncio.create_task(buffer.flush(db, [("US", "fast")]))
+        await asyncio.sleep(0.01)
+        assert os.path.join("US-fast", "000000000000.wal") in segment_files(tmp_path)
+
+        unblock.set()
+        assert await first == 1
+        assert await second == 1
+
+    assert segment_files(tmp_path) == []
+    async with trade_db_engine.connect() as conn:
+        names = (await conn.execute(text("SELECT unique_name FROM ItemFastUS ORDER BY unique_name"))).scalars().all()
+    assert names == ["T4_FIRST", "T4_SECOND"]
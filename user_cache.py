@@ -0,0 +1,79 @@
+"""
+Per-process cache of UserResponse data, keyed by user id.
+
+Every endpoint that writes a User row calls `user_cache.invalidate(user_id)`
+after its commit. Writes on other instances are not seen here, so
+USER_CACHE_TTL_SECONDS bounds how stale an entry can get.
+"""
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from cache import TTLCache, MISSING
+from schemas import UserResponse
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+
+class UserCache:
+    def __init__(self, max_entries: int = USER_CACHE_MAX_ENTRIES, ttl: float = USER_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(max_entries, ttl)
+        # Bumped by every invalidation; a read that started before a write must not store what it read
+        self._writes = 0
+        self.invalidations = 0
+
+    def version(self) -> int:
+        return self._writes
+
+    def get(self, user_id: int) -> Any:
+        """The cached UserResponse, or MISSING."""
+        return self._cache.get(user_id)
+
+    def set(self, user: models.User, version: int) -> UserResponse:
+        data = UserResponse.model_validate(user)
+        if version == self._writes:
+            self._cache.set(user.id, data)
+        return data
+
+    async def load(self, db: AsyncSession, user_id: int) -> Optional[UserResponse]:
+        """UserResponse for user_id, from the cache when possible; None if there is no such user."""
+        cached = self.get(user_id)
+        if cached is not MISSING:
+            return cached
+
+        version = self.version()
+        result = await db.execute(select(models.User).where(models.User.id == user_id))
+        user = result.scalar_one_or_none()
+        if not user:
+            return None
+        return self.set(user, version)
+
+    def invalidate(self, user_id: int):
+        self._writes += 1
+        self._cache.pop(user_id)
+        self.invalidations += 1
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._cache.stats(), "invalidations": self.invalidations}
+
+
+def subscription_status(user: UserResponse) -> Dict[str, Any]:
+    until = user.subscribed_until
+    if until is not None and until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return {
+        "user_id": user.id,
+        "active": until is not None and until > datetime.now(timezone.utc),
+        "subscribed_until": until,
+    }
+
+
+user_cache = UserCache()
@@ -0,0 +1,225 @@
+"""
+Write-ahead log for PriceUpdateBuffer.
+
+Every merge appends one record to the log of its (server, type) bucket, and
+ingest only returns once the record is on disk. Records are written by a
+group commit: the first writer schedules a commit WAL_GROUP_COMMIT_MS later,
+and every record appended until then is written and fsynced with it, so
+concurrent requests share one fsync instead of paying for one each.
+
+Each bucket logs to numbered segment files in WAL_DIR/<server>-<type>/.
+A flush rotates the bucket to a new segment when it swaps the block out, and
+deletes the older segments once the flush committed: what is left on disk is
+exactly what is still buffered. A segment also rotates once it grows past
+WAL_SEGMENT_BYTES. At startup, replay() feeds the remaining segments back
+into the buffer.
+
+Record format: uint32 length, uint32 crc32, then a JSON payload
+[stamp_us, [[unique_name, city_idx, price], ...]]. A torn or corrupt record
+(crash in the middle of a write) ends the replay of its segment.
+
+The log only survives restarts on a persistent disk: on Cloud Run, point
+WAL_DIR at a mounted volume, the default local filesystem lives in memory.
+"""
+import asyncio
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+WAL_ENABLED = os.getenv("WAL_ENABLED", "0") == "1"
+WAL_DIR = os.getenv("WAL_DIR", "./wal")
+WAL_SEGMENT_BYTES = int(os.getenv("WAL_SEGMENT_BYTES", str(16 * 2**20)))
+# How long a commit waits for more records to share its fsync
+WAL_GROUP_COMMIT_MS = float(os.getenv("WAL_GROUP_COMMIT_MS", "2"))
+# Set to 0 to only write() records: survives a process crash, not a machine crash
+WAL_FSYNC = os.getenv("WAL_FSYNC", "1") == "1"
+
+_HEADER = struct.Struct("<II")
+_SEGMENT_SUFFIX = ".wal"
+
+# (unique_name, city_idx, price)
+Entry = Tuple[str, int, int]
+
+
+def encode_record(stamp: int, entries: List[Entry]) -> bytes:
+    payload = json.dumps([stamp, entries], separators=(",", ":")).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path: str) -> Iterator[Tuple[int, List[Entry]]]:
+    """Yields (stamp_us, entries) per record, stopping at the first torn or corrupt one."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            print(f"WAL: ignoring torn record at {path}:{offset}")
+            return
+        stamp, entries = json.loads(payload)
+        yield stamp, entries
+        offset = start + length
+
+
+class _BucketLog:
+    """Segments of one (server, type) bucket."""
+    __slots__ = ("directory", "seq", "size", "pending", "released")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        existing = self.segments()
+        # Always start a new segment: replayed ones stay until the next flush releases them
+        self.seq = existing[-1] + 1 if existing else 0
+        self.size = 0
+        # seq -> records appended but not written yet
+        self.pending: Dict[int, List[bytes]] = {}
+        # Segments below this seq are flushed and must not be written again
+        self.released = 0
+
+    def path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}{_SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[int]:
+        return sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory) if name.endswith(_SEGMENT_SUFFIX)
+        )
+
+
+class PriceWAL:
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        segment_bytes: Optional[int] = None,
+        group_commit_ms: Optional[float] = None,
+        fsync: Optional[bool] = None,
+    ):
+        self.directory = directory or WAL_DIR
+        self.segment_bytes = segment_bytes or WAL_SEGMENT_BYTES
+        self.group_commit_ms = WAL_GROUP_COMMIT_MS if group_commit_ms is None else group_commit_ms
+        self.fsync = WAL_FSYNC if fsync is None else fsync
+        self._logs: Dict[Tuple[str, str], _BucketLog] = {}
+        # Future of the commit that the next appended record will be part of
+        self._next_commit: Optional[asyncio.Future] = None
+        # Commits write one after another, in append order
+        self._commit_lock = asyncio.Lock()
+        self._commit_tasks = set()
+        # Guards the segment files between the writer thread and release()
+        self._file_lock = threading.Lock()
+        self.records = 0
+        self.commits = 0
+        self.bytes_written = 0
+
+    def _log(self, server: str, type_: str) -> _BucketLog:
+        log = self._logs.get((server, type_))
+        if log is None:
+            directory = os.path.join(self.directory, f"{server}-{type_}")
+            os.makedirs(directory, exist_ok=True)
+            log = self._logs[(server, type_)] = _BucketLog(directory)
+        return log
+
+    def append(self, server: str, type_: str, stamp: int, entries: List[Entry]):
+        """
+        Queues a record for the next commit. Synchronous, so a record always lands
+        in the segment matching the block its merge wrote to; await sync() before
+        acknowledging the update.
+        """
+        log = self._log(server, type_)
+        record = encode_record(stamp, entries)
+        log.pending.setdefault(log.seq, []).append(record)
+        log.size += len(record)
+        self.records += 1
+        if log.size >= self.segment_bytes:
+            self.rotate(server, type_)
+
+    def rotate(self, server: str, type_: str) -> int:
+        """Starts a new segment and returns its seq: everything logged so far is in older ones."""
+        log = self._log(server, type_)
+        log.seq += 1
+        log.size = 0
+        return log.seq
+
+    async def sync(self):
+        """Waits until every record appended so far is on disk."""
+        if self._next_commit is None:
+            self._next_commit = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._commit(self._next_commit))
+            self._commit_tasks.add(task)
+            task.add_done_callback(self._commit_tasks.discard)
+        await asyncio.shield(self._next_commit)
+
+    async def _commit(self, done: asyncio.Future):
+        try:
+            if self.group_commit_ms > 0:
+                await asyncio.sleep(self.group_commit_ms / 1000)
+            async with self._commit_lock:
+                # Records appended from here on belong to the next commit
+                if self._next_commit is done:
+                    self._next_commit = None
+                batch = []
+                for log in self._logs.values():
+                    if log.pending:
+                        batch.append((log, log.pending))
+                        log.pending = {}
+                if batch:
+                    await asyncio.to_thread(self._write, batch)
+                self.commits += 1
+            done.set_result(None)
+        except Exception as e:
+            done.set_exception(e)
+
+    def _write(self, batch: List[Tuple[_BucketLog, Dict[int, List[bytes]]]]):
+        with self._file_lock:
+            for log, pending in batch:
+                for seq, records in sorted(pending.items()):
+                    if seq < log.released:
+                        continue
+                    with open(log.path(seq), "ab") as f:
+                        data = b"".join(records)
+                        f.write(data)
+                        if self.fsync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    self.bytes_written += len(data)
+
+    async def release(self, server: str, type_: str, seq: int):
+        """Deletes the segments below seq once their records are committed to the database."""
+        log = self._log(server, type_)
+        log.released = max(log.released, seq)
+        for pending_seq in [s for s in log.pending if s < seq]:
+            del log.pending[pending_seq]
+        await asyncio.to_thread(self._delete, log, seq)
+
+    def _delete(self, log: _BucketLog, seq: int):
+        with self._file_lock:
+            for segment in log.segments():
+                if segment < seq:
+                    os.remove(log.path(segment))
+
+    def replay(self) -> Iterator[Tuple[str, str, int, List[Entry]]]:
+        """Yields (server, type, stamp_us, entries) for every record on disk, oldest first per bucket."""
+        if not os.path.isdir(self.directory):
+            return
+        for bucket in sorted(os.listdir(self.directory)):
+            server, _, type_ = bucket.partition("-")
+            log = self._log(server, type_)
+            for seq in log.segments():
+                if seq >= log.seq:
+                    continue
+                for stamp, entries in read_segment(log.path(seq)):
+                    yield server, type_, stamp, entries
+
+    def stats(self):
+        segments = {f"{server}-{type_}": len(log.segments()) for (server, type_), log in self._logs.items()}
+        return {
+            "directory": self.directory,
+            "records": self.records,
+            "commits": self.commits,
+            "bytes_written": self.bytes_written,
+            "segments": segments,
+        }